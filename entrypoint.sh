@@ -1,14 +1,19 @@
 #!/bin/sh
 # Docker script to set up and run the Django app
 
-# Run Django management commands
-python manage.py collectstatic --noinput
-python manage.py makemigrations matcher
+# Run Django management commands. Static files are collected when the image
+# is built, and migrations are committed to the repo, so only unapplied
+# migrations need to run here
 python manage.py migrate
 python manage.py createsuperuser --no-input
 
 # Start supercronic and put it in the background
 supercronic /app/cron-jobs &
 
-# Start Gunicorn server
+# Start Gunicorn server. set WEB_SERVER=asgi to serve the app over ASGI with
+# Uvicorn workers instead, see "Serving over ASGI" in the README
+if [ "$WEB_SERVER" = "asgi" ]; then
+    exec gunicorn meetups.asgi:application --bind 0.0.0.0:$PORT \
+        --worker-class uvicorn_worker.UvicornWorker
+fi
 exec gunicorn meetups.wsgi:application --bind 0.0.0.0:$PORT
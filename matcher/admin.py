@@ -3,15 +3,30 @@ import logging
 import csv
 from datetime import date
 
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import GroupAdmin
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete
 from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
 
-from .models import Pool, Person, PoolMembership, Round, Match
-from .utils import get_set_element, get_other_person_from_match
+from meetups import settings
+from .archive import get_past_partners
+from .models import (Pool, Person, PoolMembership, Round, Match,
+                     ArchivedRound, PairHistory, Schedule, ScheduleRun,
+                     FailedDelivery, MatchingRule, Workspace,
+                     OutboundMessage, get_message_key)
+from .pairing import (compile_constraints, make_shards, pair_people,
+                      pair_shards)
+from .tracing import traced, get_round_timings
 
 
 logger = logging.getLogger(__name__)
@@ -31,12 +46,47 @@ class IntroListFilter(admin.SimpleListFilter):
             return queryset.filter(intro="")
 
 
+# cache key for the list of pools used by admin list filters
+POOL_CHOICES_CACHE_KEY = "admin_pool_choices"
+
+
+def get_pool_choices():
+    """return a tuple of (pool ID, pool name) for all pools, cached so list
+    filters don't query the pools table on every admin page load
+    """
+    return cache.get_or_set(POOL_CHOICES_CACHE_KEY,
+        lambda: tuple(Pool.objects.values_list("pk", "name")), None)
+
+
+def clear_pool_choices(sender, **kwargs):
+    """invalidate the cached pool choices when a pool changes
+    """
+    cache.delete(POOL_CHOICES_CACHE_KEY)
+
+post_save.connect(clear_pool_choices, sender=Pool)
+post_delete.connect(clear_pool_choices, sender=Pool)
+
+
+class PoolListFilter(admin.SimpleListFilter):
+    title = "pools"
+    parameter_name = "pools"
+
+    def lookups(self, request, model_admin):
+        return get_pool_choices()
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        else:
+            return queryset.filter(pools=self.value())
+
+
 class AvailabilityListFilter(admin.SimpleListFilter):
     title = "availability for pool"
     parameter_name = "available_for_pool"
 
     def lookups(self, request, model_admin):
-        return tuple((pool.pk, pool.name) for pool in Pool.objects.all())
+        return get_pool_choices()
 
     def queryset(self, request, queryset):
         if self.value() is None:
@@ -56,11 +106,31 @@ ADMIN_SITE = MatcherAdmin()
 admin.site = ADMIN_SITE # register our custom admin site with Django
 
 
+@admin.register(Workspace, site=ADMIN_SITE)
+class WorkspaceAdmin(admin.ModelAdmin):
+    list_display = ("name", "team_id")
+    search_fields = ("name", "team_id")
+
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        # keep the credentials off the screen
+        if db_field.name in ("api_token", "signing_secret"):
+            kwargs["widget"] = forms.PasswordInput(render_value=True)
+        return super().formfield_for_dbfield(db_field, request, **kwargs)
+
+
+class MatchingRuleInline(admin.TabularInline):
+    model = MatchingRule
+    extra = 0
+
+
 @admin.register(Pool, site=ADMIN_SITE)
 class PoolAdmin(admin.ModelAdmin):
     change_form_template = "pool_change_form.html"
-    list_display = ("name", "channel_name")
+    list_display = ("name", "channel_name", "workspace")
+    list_select_related = ("workspace",)
+    list_filter = ("workspace",)
     search_fields = ("name", "channel_name")
+    inlines = (MatchingRuleInline,)
 
     def response_change(self, request, pool):
         if "download-pool-members" in request.POST:
@@ -73,17 +143,118 @@ class PersonAdmin(admin.ModelAdmin):
     list_display = ("user_name", "full_name", "has_intro", "joined")
     # "pools" cannot be display as an editable field here because of the
     # custom "through" model on the many-to-many relation
-    readonly_fields = ("pools", "joined", "last_query")
-    list_filter = (IntroListFilter, "pools", AvailabilityListFilter)
+    readonly_fields = ("pools", "joined", "last_query",
+        "get_excluded_rounds")
+    list_filter = (IntroListFilter, PoolListFilter, AvailabilityListFilter)
     ordering = ("-joined",)
     search_fields = ("user_id", "user_name", "full_name", "casual_name")
+    # skip the extra unfiltered COUNT(*) on every changelist page load
+    show_full_result_count = False
+    actions = ("allow_exclusion", "disallow_exclusion")
+
+    # bulk actions below run a single UPDATE for all selected rows rather
+    # than saving each one
+
+    @admin.action(permissions=["change"],
+        description="Allow selected people to be excluded from a round")
+    def allow_exclusion(self, request, queryset):
+        count = queryset.update(can_be_excluded=True)
+        self.message_user(request, f"{count} people can now be excluded.")
+
+    @admin.action(permissions=["change"],
+        description="Don’t allow selected people to be excluded from a "
+            "round")
+    def disallow_exclusion(self, request, queryset):
+        count = queryset.update(can_be_excluded=False)
+        self.message_user(request, f"{count} people can no longer be "
+            "excluded.")
+
+    def get_excluded_rounds(self, person):
+        rounds = [*Round.objects.filter(excluded=person)
+            .select_related("pool"),
+            *ArchivedRound.objects.filter(excluded=person)
+            .select_related("pool")] if person.pk else []
+        if not rounds:
+            return "-"
+        return format_html_join(mark_safe("<br>"), "{}",
+            ((round,) for round in rounds))
+    get_excluded_rounds.short_description = "Excluded from rounds"
 
 
 @admin.register(PoolMembership, site=ADMIN_SITE)
 class PoolMembershipAdmin(admin.ModelAdmin):
-    list_display = ("person", "pool", "available", "get_has_intro")
+    list_display = ("person", "pool", "available", "get_has_intro",
+        "rounds_since_excluded")
+    list_select_related = ("person", "pool")
     list_filter = ("pool", "available")
     search_fields = ("person__user_name", "person__full_name")
+    # choosing from every Person in a <select> renders the whole table
+    autocomplete_fields = ("person",)
+    show_full_result_count = False
+    actions = ("mark_available", "mark_unavailable", "mark_unknown",
+        "remove_from_pool", "rematch_without")
+
+    def get_queryset(self, request):
+        # also used to load the object on the change form, whose title uses
+        # `PoolMembership.__str__`
+        return super().get_queryset(request).select_related("person", "pool")
+
+    # bulk actions below run a single UPDATE or DELETE for all selected rows
+    # rather than saving or deleting each one
+
+    @admin.action(permissions=["change"],
+        description="Mark selected as available")
+    def mark_available(self, request, queryset):
+        count = queryset.update(available=True)
+        self.message_user(request, f"Marked {count} pool memberships as "
+            "available.")
+
+    @admin.action(permissions=["change"],
+        description="Mark selected as unavailable")
+    def mark_unavailable(self, request, queryset):
+        count = queryset.update(available=False)
+        self.message_user(request, f"Marked {count} pool memberships as "
+            "unavailable.")
+
+    @admin.action(permissions=["change"],
+        description="Mark selected as unknown availability")
+    def mark_unknown(self, request, queryset):
+        count = queryset.update(available=None)
+        self.message_user(request, f"Marked {count} pool memberships as "
+            "unknown availability.")
+
+    @admin.action(permissions=["delete"],
+        description="Remove selected people from pool")
+    def remove_from_pool(self, request, queryset):
+        # unlike the built-in "delete selected" action, this doesn't load
+        # every row for a confirmation page. pool memberships have no
+        # dependent rows or delete signals, so Django deletes them with a
+        # single DELETE query
+        count, _ = queryset.delete()
+        self.message_user(request, f"Removed {count} people from their "
+            "pools.")
+
+    @admin.action(permissions=["change"],
+        description="Re-match without selected people in the pool's latest "
+            "matched round")
+    def rematch_without(self, request, queryset):
+        for pool in Pool.objects.filter(poolmembership__in=queryset)\
+            .distinct():
+            round = Round.objects.filter(pool=pool, match__isnull=False)\
+                .order_by("-start_date").first()
+            if not round:
+                self.message_user(request, f"“{pool}” has no matched rounds.",
+                    messages.WARNING)
+                continue
+            dropouts = Person.objects.filter(poolmembership__in=queryset,
+                poolmembership__pool=pool)
+            new_matches, left_out = rematch_dropouts(round, dropouts)
+            message = f"Made {len(new_matches)} new matches in round "\
+                f"“{round}”."
+            if left_out:
+                message += f" {left_out} was left out because there were an "\
+                    "odd number of people."
+            self.message_user(request, message)
 
     def get_has_intro(self, pool_membership):
         return pool_membership.person.has_intro()
@@ -94,33 +265,198 @@ class PoolMembershipAdmin(admin.ModelAdmin):
 @admin.register(Round, site=ADMIN_SITE)
 class RoundAdmin(admin.ModelAdmin):
     change_form_template = "round_change_form.html"
-    list_display = ("pool", "start_date", "end_date")
+    list_display = ("pool", "start_date", "end_date", "excluded")
+    list_select_related = ("pool", "excluded")
     list_filter = ("pool",)
     ordering = ("-start_date",)
+    show_full_result_count = False
+    readonly_fields = ("get_fanout_progress", "get_timings",
+        "met_feedback_requested", "excluded")
+    actions = ("redo_matching",)
+
+    def get_queryset(self, request):
+        # also used to load the object on the change form, whose title uses
+        # `Round.__str__`
+        return super().get_queryset(request)\
+            .select_related("pool", "excluded")
+
+    def get_fanout_progress(self, round):
+        if not round.pk:
+            return "-"
+        sent, total = round.get_fanout_progress()
+        return f"{sent} of {total} sent"
+    get_fanout_progress.short_description = "Availability messages"
+
+    def get_timings(self, round):
+        timings = get_round_timings(round) if round.pk else []
+        if not timings:
+            return "-"
+        return format_html_join(mark_safe("<br>"), "{}: {}", timings)
+    get_timings.short_description = "Timing"
 
     def response_change(self, request, round):
         if "do-round-matching" in request.POST:
             match(round)
         return super().response_change(request, round)
 
+    @admin.action(permissions=["change"],
+        description="Delete matches and redo matching for selected rounds")
+    def redo_matching(self, request, queryset):
+        # matches have no delete signals, but their failed deliveries are
+        # unlinked (`FailedDelivery.match` is SET_NULL), so Django loads the
+        # matches and runs an UPDATE of their failed deliveries before the
+        # DELETE, rather than a single DELETE query
+        matches = Match.objects.filter(round__in=queryset)
+        with transaction.atomic():
+            cancel_match_intros(matches)
+            deleted, _ = matches.delete()
+        rematched = 0
+        for round in queryset.select_related("pool"):
+            # keep going if one round can't be matched, e.g. because it has
+            # an odd number of participants and no one who can be excluded
+            try:
+                match(round)
+            except Exception as exception:
+                self.message_user(request, f"Failed to match round "
+                    f"“{round}”: {exception}", messages.ERROR)
+            else:
+                rematched += 1
+        self.message_user(request, f"Deleted {deleted} matches and redid "
+            f"matching for {rematched} rounds.")
+
 
 @admin.register(Match, site=ADMIN_SITE)
 class MatchAdmin(admin.ModelAdmin):
     list_display = ("person_1", "person_2", "get_round_pool",
         "get_round_start_date", "met")
     list_display_links = ("person_1", "person_2")
+    # fetch the related rows used by the columns above (including each
+    # Person's `__str__`) in the changelist query rather than once per row
+    list_select_related = ("person_1", "person_2", "round__pool")
     list_filter = ("round__pool", "met")
     ordering = ("-round__start_date",)
     search_fields = ("person_1__user_name", "person_1__full_name",
         "person_2__user_name", "person_2__full_name")
+    autocomplete_fields = ("person_1", "person_2")
+    show_full_result_count = False
 
     def get_round_pool(self, match):
         return match.round.pool
     get_round_pool.short_description = "Pool"
+    get_round_pool.admin_order_field = "round__pool"
 
     def get_round_start_date(self, match):
         return match.round.start_date
     get_round_start_date.short_description = "Round start date"
+    get_round_start_date.admin_order_field = "round__start_date"
+
+    def get_queryset(self, request):
+        # also used to load the object on the change form, whose title uses
+        # `Match.__str__`
+        return super().get_queryset(request)\
+            .select_related("person_1", "person_2", "round__pool")
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # `Round.__str__` includes its pool, so fetch them together for the
+        # round <select> options
+        if db_field.name == "round":
+            kwargs["queryset"] = Round.objects.select_related("pool")
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+@admin.register(PairHistory, site=ADMIN_SITE)
+class PairHistoryAdmin(admin.ModelAdmin):
+    list_display = ("person_1", "person_2", "pool", "match_count",
+        "met_count", "not_met_count")
+    list_select_related = ("person_1", "person_2", "pool")
+    list_filter = ("pool",)
+    search_fields = ("person_1__user_name", "person_1__full_name",
+        "person_2__user_name", "person_2__full_name")
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # also used to load the object on the change form, whose title uses
+        # `PairHistory.__str__`
+        return super().get_queryset(request)\
+            .select_related("person_1", "person_2", "pool")
+
+    # pair histories are generated by archiving rounds
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Schedule, site=ADMIN_SITE)
+class ScheduleAdmin(admin.ModelAdmin):
+    list_display = ("pool", "enabled", "interval_weeks", "ask_weekday",
+        "ask_time", "match_weekday", "match_time")
+    list_select_related = ("pool",)
+    list_filter = ("enabled",)
+
+
+@admin.register(ScheduleRun, site=ADMIN_SITE)
+class ScheduleRunAdmin(admin.ModelAdmin):
+    list_display = ("get_pool", "kind", "scheduled_for", "run_at",
+        "finished", "succeeded")
+    list_select_related = ("schedule__pool",)
+    list_filter = ("kind", "succeeded", "schedule__pool")
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # also used to load the object on the change form, whose title uses
+        # `ScheduleRun.__str__`
+        return super().get_queryset(request)\
+            .select_related("schedule__pool", "round__pool")
+
+    def get_pool(self, run):
+        return run.schedule.pool
+    get_pool.short_description = "Pool"
+    get_pool.admin_order_field = "schedule__pool"
+
+    # schedule runs are a record of what the scheduler did
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(FailedDelivery, site=ADMIN_SITE)
+class FailedDeliveryAdmin(admin.ModelAdmin):
+    list_display = ("failed", "task", "error_type", "round", "replayed",
+        "replay_count")
+    list_select_related = ("round__pool",)
+    list_filter = ("task", "error_type", "replayed", "pool")
+    search_fields = ("error",)
+    show_full_result_count = False
+    actions = ("replay",)
+
+    def get_queryset(self, request):
+        # also used to load the object on the change form, whose read-only
+        # related fields use `__str__`
+        return super().get_queryset(request).select_related("round__pool",
+            "match__person_1", "match__person_2", "match__round__pool",
+            "pool", "outbound_message")
+
+    def replay(self, request, queryset):
+        # import within the function so that loading the admin doesn't also
+        # import Celery, see `handle_match_save`
+        from .delivery import replay_failed_delivery
+        count = 0
+        for failed_delivery in queryset:
+            replay_failed_delivery(failed_delivery)
+            count += 1
+        self.message_user(request, f"Replayed {count} failed deliveries.")
+    replay.short_description = "Replay selected failed deliveries"
+
+    # failed deliveries are a record of what the task queue couldn't send
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 # readd the built-in "authentication and authorization" models to our custom
@@ -132,52 +468,146 @@ admin.site.register(User, UserAdmin)
 admin.site.register(Group, GroupAdmin)
 
 
+def get_person_to_exclude(round, person_ids=None):
+    """return the available Person in a Round's pool who can be excluded and
+    was excluded longest ago (or never), picked at random among ties, or None
+    if there's no one who can be excluded. pass `person_ids` to only choose
+    among those people. if the round was matched before, the person excluded
+    then is excluded again if they still can be, so redoing a round's
+    matching doesn't move who's left out
+    """
+    memberships = PoolMembership.objects.filter(pool=round.pool,
+        available=True, person__can_be_excluded=True)\
+        .select_related("person")
+    if person_ids is not None:
+        memberships = memberships.filter(person__in=person_ids)
+    if round.excluded_id:
+        membership = memberships.filter(person=round.excluded_id).first()
+        if membership:
+            return membership.person
+    # one query using the `pool_membership_exclusion` index; people who've
+    # never been excluded have no count, and sort first
+    membership = memberships.order_by(
+        F("rounds_since_excluded").desc(nulls_first=True), "?").first()
+    return membership.person if membership else None
+
+
+def exclude_from_round(round, person):
+    """record that a Person was left out of a Round because there were an odd
+    number of people, resetting their count of rounds since they were last
+    excluded and adding one to everyone else's in the pool who's been
+    excluded before. if someone else was already excluded from the round,
+    that's undone first, see `include_in_round`, so everyone's count only
+    goes up once per round
+    """
+    if round.excluded_id == person.pk:
+        # already recorded, e.g. when the round's matching is redone
+        return
+    with transaction.atomic():
+        include_in_round(round)
+        membership = PoolMembership.objects.filter(pool=round.pool,
+            person=person)
+        previous_count = membership.values_list("rounds_since_excluded",
+            flat=True).first()
+        PoolMembership.objects.filter(pool=round.pool,
+            rounds_since_excluded__isnull=False).exclude(person=person)\
+            .update(rounds_since_excluded=F("rounds_since_excluded") + 1)
+        membership.update(rounds_since_excluded=0)
+        Round.objects.filter(pk=round.pk).update(excluded=person,
+            excluded_rounds_since_excluded=previous_count)
+    round.excluded = person
+    round.excluded_rounds_since_excluded = previous_count
+
+
+def include_in_round(round):
+    """undo `exclude_from_round` for the Person excluded from a Round, e.g.
+    when they're matched in it after all: their count of rounds since they
+    were last excluded goes back to what it was, and everyone else's in the
+    pool goes back down by one
+    """
+    if not round.excluded_id:
+        return
+    with transaction.atomic():
+        PoolMembership.objects.filter(pool=round.pool,
+            rounds_since_excluded__gt=0).exclude(person=round.excluded_id)\
+            .update(rounds_since_excluded=F("rounds_since_excluded") - 1)
+        PoolMembership.objects.filter(pool=round.pool,
+            person=round.excluded_id).update(
+                rounds_since_excluded=round.excluded_rounds_since_excluded)
+        Round.objects.filter(pk=round.pk).update(excluded=None,
+            excluded_rounds_since_excluded=None)
+    round.excluded = None
+    round.excluded_rounds_since_excluded = None
+
+
 def get_round_participants(round):
     """return a randomly-ordered queryset of participants for this Round.
-    excludes someone if there are an odd number, and throws and error if no
-    one is marked as excludable
+    excludes the person who was excluded longest ago if there are an odd
+    number, see `get_person_to_exclude`, and throws and error if no one is
+    marked as excludable
     """
     # don't rematch if matches already exist for this round
     existing_matches = Match.objects.filter(round=round).count()
     if existing_matches:
         raise Exception(f"{existing_matches} matches already exist for this "
             "round. If you want to rematch, please delete the existing "
-            "matches for this round first.")
-    # randomly order the people for "fairer" matching, see `create_matches`
-    # function docstring
-    # note: this can be a slow query for large tables
+            "matches for this round first, or if some people can no longer "
+            "take part, use “Re-match without selected people” on their "
+            "pool memberships.")
     people_to_match = Person.objects\
-        .filter(pools=round.pool, poolmembership__available=True)\
-        .order_by("?")
+        .filter(pools=round.pool, poolmembership__available=True)
+    participant_count = people_to_match.count()
     logger.info(f"Starting matching for round \"{round}\" with "
-        f"{len(people_to_match)} participants.")
-    if len(people_to_match) % 2 != 0:
+        f"{participant_count} participants.")
+    if participant_count % 2 != 0:
         # we have an odd number of people and need to exclude someone from
         # this round
-        excludable_people = people_to_match.filter(can_be_excluded=True)
-        if not excludable_people:
+        person_to_exclude = get_person_to_exclude(round)
+        if not person_to_exclude:
             raise Exception("There are an odd number of people to match this "
                 "round, which means somone must be excluded. However, no one "
                 "in this pool is marked as available and as a person who can "
                 "be excluded. Please ensure at least one person from this "
                 "pool is both available and can be excluded.")
-        person_to_exclude = random.choice(excludable_people)
+        exclude_from_round(round, person_to_exclude)
         people_to_match = people_to_match.exclude(id=person_to_exclude.id)
-        logger.info(f"Odd number of people ({len(people_to_match) + 1}) for "
+        logger.info(f"Odd number of people ({participant_count}) for "
             f"round \"{round}\", excluded {person_to_exclude}.")
-    return people_to_match
+    # randomly order the people for "fairer" matching, see `create_matches`
+    # function docstring
+    # note: this can be a slow query for large tables
+    return people_to_match.order_by("?")
+
+
+def get_matching_constraints(pool, person_ids):
+    """return a tuple of the "avoid same" and "prefer different" bitmasks
+    for a Pool's matching rules and a list of Person IDs, see
+    `compile_constraints` in `./pairing.py`. people's attributes aren't
+    loaded if the pool has no rules
+    """
+    rules = list(MatchingRule.objects.filter(pool=pool)\
+        .values_list("attribute", "kind"))
+    if not rules:
+        return {}, {}
+    attributes = dict(Person.objects.filter(pk__in=person_ids).order_by()\
+        .values_list("pk", "attributes"))
+    return compile_constraints(attributes, rules)
 
 
 def create_matches(round, people_to_match):
     """given a queryset of people to match, creates matches with a bias toward
     matching people with those they haven't been paired with before (avoiding
-    duplicates), where feasible.
+    duplicates), and who don't break the pool's matching rules, where
+    feasible. see `pair_people` in `./pairing.py`.
     Important considerations:
-    - the time complexity of this function is O(N^2) where N is the number of
-      participants
-    - the space complexity of this function is O(N+M) where N is the number of
-      participants and M is the highest number of past matches an individual
-      participant has had
+    - everyone's past matches and the pool's matching rules are loaded up
+      front, so the number of queries doesn't grow with the number of
+      participants, and the rules are compiled into bitmasks so checking a
+      pairing against all of them is a single AND
+    - the time complexity of this function is O(N^2) in the worst case where
+      N is the number of participants, but usually closer to O(N*M) where M
+      is the highest number of past matches (or people sharing an "avoid
+      same" value) an individual participant has had
     - the pairing algorithm may not prevent duplicate pairings in certain
       cases where a "solution" was possible that didn't involve duplicates,
       because such an algorithm would be significantly more complex and have a
@@ -193,48 +623,60 @@ def create_matches(round, people_to_match):
     if (len(people_to_match) % 2 != 0):
         raise ValueError(f"`people_to_match` must have an even-numbered "
             f"length. Received length: {len(people_to_match)}.")
-    # cast the QuerySet to a Set to avoid mutating the variable over which
-    # we'll be iterating
-    available_people = set(people_to_match)
-    for person in people_to_match:
-        if person not in available_people:
-            # this person is already matched; do nothing
-            continue
-
-        # remaining people available to match, excluding this person (you
-        # can't be matched with yourself)
-        potential_matches = available_people - set([person])
-
-        # get the person's past matches, regardless of pool
-        past_matches = (Match.objects.filter(person_1=person) |
-                        Match.objects.filter(person_2=person))
-        past_match_people = {
-            get_other_person_from_match(person.user_id, match)
-            for match in past_matches
-        }
-
-        # set difference; a new set of other people this person hasn't yet met
-        nonduplicate_matches = potential_matches - past_match_people
-        if nonduplicate_matches:
-            # if there are non-duplicate matches available at ths point, match
-            # this person with one of them
-            potential_matches = nonduplicate_matches
-        else:
-            # otherwise, match them with anyone still available to match
-            logger.warn(f"No non-duplicate matches available for {person}.")
-        # pick an arbitrary person from the available options
-        # N.B. this is different than a "random" person in the sense of
-        # picking a random element from the set; it's simply the first person
-        # pointed to by the set iterator
-        other_person = get_set_element(potential_matches)
-        new_match = Match(person_1=person, person_2=other_person, round=round)
+    # evaluate the queryset once to keep its random order
+    person_ids = [person.pk for person in people_to_match]
+    avoid, prefer_different = get_matching_constraints(round.pool,
+        person_ids)
+    pairs, _ = pair_people(person_ids, get_past_partners(people_to_match),
+        avoid, prefer_different, allow_duplicates=True)
+    for person_1_id, person_2_id in pairs:
+        new_match = Match(person_1_id=person_1_id, person_2_id=person_2_id,
+            round=round)
         # save the match and send matching messages
         new_match.save()
         logger.info(f"Matched: {new_match}")
-        # remove both newly matched people from the set of available people to
-        # match
-        available_people.remove(person)
-        available_people.remove(other_person)
+
+
+def create_sharded_matches(round, people_to_match):
+    """like `create_matches`, but for very large pools: splits the people to
+    match into shards of up to `settings.MATCHING_SHARD_SIZE` people and
+    pairs the shards in parallel across CPU cores, then pairs the people left
+    over from each shard with each other. duplicate pairings are avoided
+    using everyone's match history in all pools, like `create_matches`, but
+    with a time complexity of about O(N*M) rather than O(N^2), where M is the
+    highest number of past matches a participant has had. see
+    `matcher/pairing.py`
+    """
+    # evaluate the queryset once to keep its random order
+    person_ids = [person.pk for person in people_to_match]
+    keys = None
+    if settings.MATCHING_SHARD_BY:
+        # keep people with the same value of this field together
+        keys = dict(people_to_match.values_list("pk",
+            settings.MATCHING_SHARD_BY))
+    shards = make_shards(person_ids, settings.MATCHING_SHARD_SIZE, keys)
+    avoid, prefer_different = get_matching_constraints(round.pool,
+        person_ids)
+    pairs = pair_shards(shards, get_past_partners(people_to_match), avoid,
+        prefer_different, workers=settings.MATCHING_WORKERS or None)
+    with transaction.atomic():
+        matches = Match.objects.bulk_create((
+            Match(round=round, person_1_id=person_1_id,
+                person_2_id=person_2_id)
+            for person_1_id, person_2_id in pairs
+        ), batch_size=500)
+    # `bulk_create` doesn't send `post_save`, so open the matches'
+    # conversations here once they're committed, see `handle_match_save`.
+    # import within the function so the admin doesn't import Celery
+    from .tasks import open_match_dm
+    match_ids = [new_match.pk for new_match in matches]
+
+    def open_conversations():
+        for match_id in match_ids:
+            open_match_dm.delay(match_id)
+    transaction.on_commit(open_conversations)
+    logger.info(f"Made {len(matches)} matches for round \"{round}\" in "
+        f"{len(shards)} shards.")
 
 
 def match(round):
@@ -243,8 +685,89 @@ def match(round):
     matching messages to be send in each Match.save() call. one person won't
     recieve a Match if there are an odd number of People in the Round.
     """
-    people_to_match = get_round_participants(round)
-    create_matches(round, people_to_match)
+    with traced(round, "participants"):
+        people_to_match = get_round_participants(round)
+    with traced(round, "matching"):
+        if settings.MATCHING_SHARD_SIZE and \
+            len(people_to_match) > settings.MATCHING_SHARD_SIZE:
+            create_sharded_matches(round, people_to_match)
+        else:
+            create_matches(round, people_to_match)
+
+
+def cancel_match_intros(matches):
+    """cancel the introductions queued for `matches`, a queryset of Matches
+    about to be deleted, which haven't been sent. they aren't linked to the
+    matches, only keyed by them, so they'd otherwise still be sent
+    """
+    intro_keys = [
+        get_message_key("match_intro", match.conversation_id, match=match)
+        for match in matches.filter(conversation_id__isnull=False)
+    ]
+    return OutboundMessage.objects.filter(key__in=intro_keys,
+        delivered__isnull=True, cancelled__isnull=True)\
+        .update(cancelled=timezone.now())
+
+
+def rematch_dropouts(round, dropouts):
+    """re-pair the people who were matched with `dropouts` (People who can
+    no longer take part in an already matched Round), along with anyone else
+    who's available but wasn't matched, like someone left out because there
+    was an odd number of people. the dropouts are marked unavailable and their
+    matches are deleted, and only the new matches get introduction messages;
+    everyone else's matches are left alone. returns a tuple of (list of new
+    Matches, Person left out if there's an odd number or None)
+    """
+    dropout_ids = [person.pk for person in dropouts]
+    round_matches = Match.objects.filter(round=round)
+    with transaction.atomic():
+        PoolMembership.objects.filter(pool=round.pool,
+            person__in=dropout_ids).update(available=False)
+        dropout_matches = round_matches.filter(Q(person_1__in=dropout_ids) |
+            Q(person_2__in=dropout_ids))
+        cancel_match_intros(dropout_matches)
+        deleted, _ = dropout_matches.delete()
+    # now includes the dropouts' former partners
+    unmatched = Person.objects\
+        .filter(pools=round.pool, poolmembership__available=True)\
+        .exclude(pk__in=round_matches.values("person_1"))\
+        .exclude(pk__in=round_matches.values("person_2"))
+    people_to_match = list(unmatched)
+    random.shuffle(people_to_match)
+    left_out = None
+    if len(people_to_match) % 2 != 0:
+        # prefer the person already excluded from this round, if they're
+        # still available, then whoever was excluded longest ago. unlike
+        # `get_round_participants`, leave someone out even if no one can be
+        # excluded, since the rest of the round is already matched
+        left_out = get_person_to_exclude(round,
+            [person.pk for person in people_to_match])
+        if not left_out:
+            logger.warning(f"No one who can be excluded is left to re-match "
+                f"in round \"{round}\", leaving out someone who can't be.")
+            left_out = random.choice(people_to_match)
+        exclude_from_round(round, left_out)
+        people_to_match.remove(left_out)
+    elif round.excluded_id in [person.pk for person in people_to_match]:
+        # the person excluded from the round is now being matched
+        include_in_round(round)
+    person_ids = [person.pk for person in people_to_match]
+    avoid, prefer_different = get_matching_constraints(round.pool,
+        person_ids)
+    pairs, _ = pair_people(person_ids,
+        get_past_partners(Person.objects.filter(pk__in=person_ids)), avoid,
+        prefer_different, allow_duplicates=True)
+    new_matches = []
+    for person_1_id, person_2_id in pairs:
+        new_match = Match(round=round, person_1_id=person_1_id,
+            person_2_id=person_2_id)
+        # save the match and send matching messages
+        new_match.save()
+        new_matches.append(new_match)
+    logger.info(f"Removed {len(dropout_ids)} people and {deleted} matches "
+        f"from round \"{round}\" and made {len(new_matches)} new matches, "
+        f"leaving out {left_out}.")
+    return new_matches, left_out
 
 
 def download_pool_members(pool):
@@ -0,0 +1,171 @@
+import logging
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from meetups import settings
+from .models import (Round, Match, ArchivedRound, ArchivedMatch,
+                     OutboundMessage, PairHistory, RoundPhase)
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_archivable_rounds(horizon_days=None):
+    """return a queryset of Rounds which ended more than `horizon_days` ago,
+    excluding the most recent Round in each Pool, which is always kept
+    because stats and matching treat it specially
+    """
+    if horizon_days is None:
+        horizon_days = settings.ARCHIVE_AFTER_DAYS
+    cutoff = date.today() - timedelta(days=horizon_days)
+    latest_round_ids = [
+        Round.objects.filter(pool=pool_id).latest("end_date").pk
+        for pool_id in Round.objects.values_list("pool", flat=True).distinct()
+    ]
+    return Round.objects.filter(end_date__lt=cutoff)\
+        .exclude(pk__in=latest_round_ids)
+
+
+def get_pair_key(match):
+    """return a (lower person ID, higher person ID) tuple for a Match, which
+    is how pairs are stored in PairHistory
+    """
+    return tuple(sorted((match.person_1_id, match.person_2_id)))
+
+
+@transaction.atomic
+def archive_round(round):
+    """move a Round and its Matches into the archive tables, adding its
+    Matches to its Pool's PairHistory. the round's messages and timings are
+    kept, moved to the ArchivedRound
+    """
+    matches = list(Match.objects.filter(round=round))
+    archived_round = ArchivedRound.objects.create(original_id=round.pk,
+        pool_id=round.pool_id, start_date=round.start_date,
+        end_date=round.end_date, excluded_id=round.excluded_id)
+    ArchivedMatch.objects.bulk_create(
+        ArchivedMatch(original_id=match.pk, round=archived_round,
+            person_1_id=match.person_1_id, person_2_id=match.person_2_id,
+            conversation_id=match.conversation_id, met=match.met)
+        for match in matches
+    )
+
+    # tally this round's pairings, then add them to the existing pair history
+    # rows (or create new rows) with one query each rather than one per match
+    match_counts = Counter(get_pair_key(match) for match in matches)
+    met_counts = Counter(get_pair_key(match) for match in matches
+        if match.met is True)
+    not_met_counts = Counter(get_pair_key(match) for match in matches
+        if match.met is False)
+    existing = {
+        (history.person_1_id, history.person_2_id): history
+        for history in PairHistory.objects.filter(pool_id=round.pool_id,
+            person_1__in={key[0] for key in match_counts})
+        if (history.person_1_id, history.person_2_id) in match_counts
+    }
+    new = []
+    for key, count in match_counts.items():
+        history = existing.get(key) or PairHistory(pool_id=round.pool_id,
+            person_1_id=key[0], person_2_id=key[1])
+        history.match_count += count
+        history.met_count += met_counts[key]
+        history.not_met_count += not_met_counts[key]
+        if history.pk is None:
+            new.append(history)
+    PairHistory.objects.bulk_update(existing.values(),
+        ["match_count", "met_count", "not_met_count"])
+    PairHistory.objects.bulk_create(new)
+
+    # deleting the Round also deletes its Matches, and anything else still
+    # pointing at it
+    OutboundMessage.objects.filter(round=round).update(round=None,
+        archived_round=archived_round)
+    RoundPhase.objects.filter(round=round).update(round=None,
+        archived_round=archived_round)
+    round.delete()
+    logger.info(f"Archived round \"{archived_round}\" with {len(matches)} "
+        "matches.")
+    return archived_round
+
+
+def get_archived_match(user_id, match_id):
+    """get the ArchivedMatch archived from the Match with `match_id`, if the
+    Person with `user_id` was in it, or None
+    """
+    return ArchivedMatch.objects.filter(
+        Q(person_1__user_id=user_id) | Q(person_2__user_id=user_id),
+        original_id=match_id)\
+        .select_related("person_1", "person_2", "round__pool").first()
+
+
+@transaction.atomic
+def set_archived_met(archived_match, met):
+    """record whether the people in an ArchivedMatch met, e.g. if one of them
+    answers after its round was archived, moving the answer between its
+    Pool's PairHistory counts
+    """
+    if archived_match.met == met:
+        return
+    counts = {}
+    for value, field in ((True, "met_count"), (False, "not_met_count")):
+        if archived_match.met is value:
+            counts[field] = F(field) - 1
+        elif met is value:
+            counts[field] = F(field) + 1
+    person_1_id, person_2_id = get_pair_key(archived_match)
+    PairHistory.objects.filter(pool=archived_match.round.pool_id,
+        person_1=person_1_id, person_2=person_2_id).update(**counts)
+    ArchivedMatch.objects.filter(pk=archived_match.pk).update(met=met)
+    archived_match.met = met
+
+
+def archive_rounds(horizon_days=None):
+    """archive all Rounds which ended more than `horizon_days` ago (default:
+    `settings.ARCHIVE_AFTER_DAYS`), returning the number archived
+    """
+    rounds = get_archivable_rounds(horizon_days).select_related("pool")
+    count = 0
+    for round in rounds:
+        archive_round(round)
+        count += 1
+    return count
+
+
+def get_past_partners(people):
+    """return a dict of Person ID -> set of IDs of all People they've been
+    matched with, in any pool, including archived matches, for everyone in a
+    queryset of People, in two queries however many people there are
+    """
+    person_ids = people.order_by().values("pk")
+    past_partners = {}
+    for model in (Match, PairHistory):
+        for person_1_id, person_2_id in model.objects\
+            .filter(Q(person_1__in=person_ids) | Q(person_2__in=person_ids))\
+            .values_list("person_1", "person_2"):
+            past_partners.setdefault(person_1_id, set()).add(person_2_id)
+            past_partners.setdefault(person_2_id, set()).add(person_1_id)
+    return past_partners
+
+
+def get_archived_stats_matches(pool):
+    """return a list of match dicts in the format of the pool stats API, one
+    per archived Match in the pool
+    """
+    matches = []
+    for history in PairHistory.objects.filter(pool=pool):
+        unknown_count = history.match_count - history.met_count - \
+            history.not_met_count
+        for met, count in ((True, history.met_count),
+                           (False, history.not_met_count),
+                           (None, unknown_count)):
+            matches += [{
+                # archived matches no longer have IDs of their own
+                "id": None,
+                "person_1": history.person_1_id,
+                "person_2": history.person_2_id,
+                "met": met
+            }] * count
+    return matches
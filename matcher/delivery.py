@@ -0,0 +1,146 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from meetups import settings
+from .models import FailedDelivery, OutboundMessage
+from .tasks import app, send_msg
+
+
+logger = logging.getLogger(__name__)
+# send budgets by workspace ID (None for the workspace in
+# `settings.SLACK_API_TOKEN`), created on first use by `get_send_budget`
+_send_budgets = {}
+
+
+class TokenBucket:
+    """a budget of `rate` things per second, of which up to `burst` can be
+    taken at once after a pause
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, count):
+        """take up to `count` things from the budget, returning how many were
+        taken
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        taken = min(count, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+    def give_back(self, count):
+        """return `count` things which were taken but not used"""
+        self.tokens = min(self.burst, self.tokens + count)
+
+
+def get_send_budget(workspace_id):
+    """get the TokenBucket for sending messages in the Workspace with
+    `workspace_id`, creating it on first use, see `settings.SLACK_SEND_RATE`
+    """
+    budget = _send_budgets.get(workspace_id)
+    if budget is None:
+        budget = _send_budgets[workspace_id] = TokenBucket(
+            settings.SLACK_SEND_RATE, settings.SLACK_SEND_BURST)
+    return budget
+
+
+def claim_message(outbound_message, now):
+    """mark an OutboundMessage as dispatched at `now`, unless another process
+    dispatched it (or its task requeued it) since it was read, returning
+    whether it was claimed. a conditional update rather than a row lock, which
+    SQLite doesn't have
+    """
+    return OutboundMessage.objects.filter(pk=outbound_message.pk,
+        dispatched=outbound_message.dispatched,
+        retry_after=outbound_message.retry_after).update(dispatched=now) == 1
+
+
+def dispatch_due_messages(limit=100, throttle=True):
+    """hand off up to `limit` queued messages per workspace which are due to
+    be sent to the `send_msg` task, oldest first, returning the dispatched
+    OutboundMessages. each workspace has its own limit, and if `throttle`,
+    its own budget of `settings.SLACK_SEND_RATE` messages per second, so a
+    big backlog in one workspace (which Slack rate limits separately) doesn't
+    hold up the others' messages or use up their budget. messages over the
+    budget stay queued for the next call. messages are claimed by marking
+    them dispatched before they're handed off, so two processes running this
+    at once don't both send them, see `claim_message`. messages which
+    haven't been delivered or failed for good, and which nothing has
+    happened to for `settings.OUTBOX_REDISPATCH_MINUTES` (not dispatched, an
+    attempt started, or a retry due), e.g. because the task queue lost their
+    task, are dispatched again, checking whether Slack already accepted
+    them. so are messages whose task was run eagerly (see
+    `settings.CELERY_TASK_ALWAYS_EAGER`) and failed, once their
+    `retry_after` has passed
+    """
+    now = timezone.now()
+    stale = now - timedelta(minutes=settings.OUTBOX_REDISPATCH_MINUTES)
+    pending = OutboundMessage.objects.filter(
+        (Q(dispatched__isnull=True) &
+            (Q(retry_after__isnull=True) | Q(retry_after__lte=now))) |
+        # skip messages being sent or waiting for the task queue to retry
+        # them
+        (Q(dispatched__lt=stale, delivered__isnull=True) &
+            (Q(attempted__isnull=True) | Q(attempted__lt=stale)) &
+            (Q(retry_after__isnull=True) | Q(retry_after__lt=stale)) &
+            ~Exists(FailedDelivery.objects.filter(
+                outbound_message=OuterRef("pk")))),
+        cancelled__isnull=True, send_after__lte=now)
+    due = []
+    # claimed in one transaction, so they're written together
+    with transaction.atomic():
+        for workspace_id in pending.order_by()\
+            .values_list("workspace", flat=True).distinct():
+            budget = get_send_budget(workspace_id) \
+                if throttle and settings.SLACK_SEND_RATE else None
+            count = budget.take(limit) if budget else limit
+            if not count:
+                continue
+            workspace_due = [outbound_message for outbound_message in
+                pending.filter(workspace=workspace_id).order_by("send_after")
+                [:count] if claim_message(outbound_message, now)]
+            if budget:
+                budget.give_back(count - len(workspace_due))
+            due += workspace_due
+    dispatched = []
+    try:
+        for outbound_message in due:
+            # check whether Slack already accepted a message sent before
+            send_msg.delay(outbound_message.pk,
+                check_delivered=outbound_message.dispatched is not None or
+                    outbound_message.attempts > 0)
+            dispatched.append(outbound_message)
+    finally:
+        # put back whatever wasn't handed off, e.g. because the task queue
+        # went down partway through, so it's dispatched once it's back
+        for outbound_message in due[len(dispatched):]:
+            OutboundMessage.objects.filter(pk=outbound_message.pk,
+                dispatched=now).update(dispatched=outbound_message.dispatched)
+    return dispatched
+
+
+def replay_failed_delivery(failed_delivery):
+    """send a FailedDelivery's task to the task queue again with the same
+    arguments. replayed messages are checked against what Slack already
+    accepted, so a message isn't sent twice if its last attempt timed out
+    after Slack accepted it
+    """
+    kwargs = dict(failed_delivery.kwargs)
+    if failed_delivery.task == send_msg.name:
+        kwargs["check_delivered"] = True
+    app.tasks[failed_delivery.task].apply_async(args=failed_delivery.args,
+        kwargs=kwargs)
+    FailedDelivery.objects.filter(pk=failed_delivery.pk).update(
+        replayed=timezone.now(), replay_count=F("replay_count") + 1)
@@ -0,0 +1,95 @@
+import logging
+from datetime import timedelta
+
+import pytz
+from django.db import transaction
+from django.utils import timezone
+
+import matcher.messages as messages
+from meetups import settings
+from .models import (Match, OutboundMessage, Round,
+                     get_fanout_interval, get_message_key)
+
+
+logger = logging.getLogger(__name__)
+
+# same purpose, and so the same idempotency keys, as the message queued by
+# `ask_if_met` after someone says they're available for the next round, so
+# nobody is asked twice about the same match
+PURPOSE = "ask_if_met"
+
+
+def get_ended_rounds(now=None):
+    """return a list of Rounds which have ended in their pool's timezone in
+    the last `settings.MET_FEEDBACK_LOOKBACK_DAYS` days, and whose people
+    haven't been asked whether they met yet
+    """
+    now = now or timezone.now()
+    # timezones are at most a day ahead of or behind UTC, so this includes
+    # every round that might have ended, which are then checked in their
+    # pool's timezone
+    utc_today = now.date()
+    rounds = Round.objects.filter(met_feedback_requested__isnull=True,
+        end_date__lte=utc_today + timedelta(days=1),
+        end_date__gte=utc_today -
+            timedelta(days=settings.MET_FEEDBACK_LOOKBACK_DAYS))\
+        .select_related("pool")
+    return [round for round in rounds if round.end_date <
+        now.astimezone(pytz.timezone(round.pool.timezone)).date()]
+
+
+def request_met_feedback(round, now=None):
+    """queue a message to each person in a Round's matches who hasn't said
+    whether they met, asking if they did, unless they were already asked.
+    the messages are spread over `settings.MET_FEEDBACK_FANOUT_MINUTES`, but
+    sent no faster than `settings.AVAILABILITY_FANOUT_RATE` per second.
+    returns the number of messages queued
+    """
+    now = now or timezone.now()
+    unanswered = Match.objects.filter(round=round, met__isnull=True)
+    already_asked = set(OutboundMessage.objects\
+        .filter(round=round, purpose=PURPOSE)\
+        .values_list("key", flat=True))
+    prompts = {}
+    for match in unanswered.select_related("person_1", "person_2"):
+        for person, other_person in ((match.person_1, match.person_2),
+                                     (match.person_2, match.person_1)):
+            key = get_message_key(PURPOSE, person.user_id, match=match)
+            # one message per person, even if they're in more than one match
+            if key in already_asked or person.user_id in prompts:
+                continue
+            blocks = messages.format_block_text("ASK_IF_MET", match.id,
+                {"pool": round.pool, "other_person": other_person})
+            prompts[person.user_id] = (key, blocks)
+    interval = get_fanout_interval(len(prompts) or 1,
+        settings.MET_FEEDBACK_FANOUT_MINUTES)
+    with transaction.atomic():
+        # `ignore_conflicts` skips any message `ask_if_met` queued since the
+        # keys were loaded
+        OutboundMessage.objects.bulk_create((
+            OutboundMessage(round=round, channel_id=user_id, purpose=PURPOSE,
+                workspace_id=round.pool.workspace_id, key=key,
+                message={"blocks": blocks},
+                send_after=now + index * interval)
+            for index, (user_id, (key, blocks)) in enumerate(prompts.items())
+        ), batch_size=500, ignore_conflicts=True)
+        # people's last query is left alone: unlike `ask_if_met`, these are
+        # sent long after they're queued, and someone may be in the middle
+        # of a text-based exchange, like writing their intro, until then.
+        # block-based questions don't need it
+        Round.objects.filter(pk=round.pk).update(met_feedback_requested=now)
+    logger.info(f"Queued {len(prompts)} messages asking if people met for "
+        f"round \"{round}\", to be sent over {interval * len(prompts)}.")
+    return len(prompts)
+
+
+def cancel_met_prompts(match):
+    """cancel any messages asking a Match's people whether they met which
+    haven't been sent yet, once one of them has answered. returns the number
+    of messages cancelled
+    """
+    keys = [get_message_key(PURPOSE, person.user_id, match=match)
+        for person in (match.person_1, match.person_2)]
+    return OutboundMessage.objects.filter(key__in=keys,
+        delivered__isnull=True, cancelled__isnull=True)\
+        .update(cancelled=timezone.now())
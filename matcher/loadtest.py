@@ -0,0 +1,288 @@
+"""helpers for load testing the bot locally: building signed Slack requests,
+firing them at a running instance, and a stand-in Slack Web API server that
+records the bot's API calls. see the `load_test_webhooks` and
+`fake_slack_api` management commands
+"""
+
+import hmac
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode, parse_qsl, urlparse
+
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, percent):
+    """get the value at `percent` (0–100) of a list of numbers
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def sign_request(signing_secret, body, timestamp=None):
+    """return the headers Slack would send with a request `body` (bytes),
+    including a valid signature for `VerifySlackRequest`
+    https://api.slack.com/authentication/verifying-requests-from-slack
+    """
+    timestamp = str(int(timestamp or time.time()))
+    base_string = f"v0:{timestamp}:{body.decode('utf-8')}".encode("utf-8")
+    signature = "v0=" + hmac.new(bytes(signing_secret, "utf-8"),
+        base_string, hashlib.sha256).hexdigest()
+    return {
+        "X-Slack-Request-Timestamp": timestamp,
+        "X-Slack-Signature": signature,
+    }
+
+
+def build_message_event(user_id, text, team_id=None):
+    """return the body and content type of an Events API request for a
+    direct message from `user_id` to the bot, from the workspace `team_id`
+    https://api.slack.com/events/message.im
+    """
+    body = json.dumps({
+        "type": "event_callback",
+        "team_id": team_id,
+        "event": {
+            "type": "message",
+            "channel_type": "im",
+            "user": user_id,
+            "text": text,
+            "ts": f"{time.time():.6f}",
+        },
+    }).encode("utf-8")
+    return body, "application/json"
+
+
+def build_block_action(user_id, block_id, value, response_url=None,
+                       team_id=None):
+    """return the body and content type of an interaction request for
+    `user_id` in the workspace `team_id` clicking a button with `value` in
+    the block `block_id`, e.g. "availability-<pool ID>" or "met-<match ID>"
+    https://api.slack.com/reference/interaction-payloads/block-actions
+    """
+    payload = {
+        "type": "block_actions",
+        "team": {"id": team_id},
+        "user": {"id": user_id},
+        "actions": [{
+            "type": "button",
+            "block_id": block_id,
+            "value": value,
+            "action_ts": f"{time.time():.6f}",
+        }],
+    }
+    if response_url:
+        payload["response_url"] = response_url
+    body = urlencode({"payload": json.dumps(payload)}).encode("utf-8")
+    return body, "application/x-www-form-urlencoded"
+
+
+def post_signed(url, body, content_type, signing_secret, timeout=30):
+    """POST a signed request to `url`, returning (status code, seconds
+    taken)
+    """
+    headers = {"Content-Type": content_type,
+        **sign_request(signing_secret, body)}
+    request = urllib.request.Request(url, data=body, headers=headers,
+        method="POST")
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except Exception as exception: # see [1] in ./tasks.py
+        logger.warning(f"Request to {url} failed: {exception}")
+        status = None
+    return status, time.monotonic() - start
+
+
+def fire_at_rate(requests, rate, send, concurrency=50):
+    """call `send(request)` for each of `requests`, starting them at a steady
+    `rate` per second with up to `concurrency` in flight at once. returns a
+    list of (request, start time, result) in completion order
+    """
+    results = []
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def run(request, start_time):
+        try:
+            result = send(request)
+            with lock:
+                results.append((request, start_time, result))
+        finally:
+            slots.release()
+
+    threads = []
+    start = time.monotonic()
+    for index, request in enumerate(requests):
+        # wait until this request's scheduled start time
+        time.sleep(max(0, start + index / rate - time.monotonic()))
+        slots.acquire()
+        thread = threading.Thread(target=run,
+            args=(request, time.time()), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class FakeSlackAPI:
+    """a local stand-in for the Slack Web API that records every call it
+    receives, and can add latency and respond with rate limit errors (HTTP
+    429). point the bot at it with the `SLACK_API_URL` environment variable,
+    e.g. `SLACK_API_URL=http://localhost:8001/api/`
+    """
+
+    def __init__(self, host="localhost", port=8001, latency=0,
+                 rate_limit_ratio=0, retry_after=1, members=()):
+        # seconds to wait before responding to each call
+        self.latency = latency
+        # fraction of calls (0–1) which get a 429 response
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        # user IDs returned from `conversations.members` for any channel
+        self.members = list(members)
+        self.lock = threading.Lock()
+        # Slack API method name -> list of (time received, params)
+        self.calls = defaultdict(list)
+        self.rate_limited_count = 0
+        self.server = ThreadingHTTPServer((host, port),
+            self.get_handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        """serve requests in a background thread
+        """
+        thread = threading.Thread(target=self.server.serve_forever,
+            daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_replies(self):
+        """return a dict of channel/user ID -> list of times a message was
+        sent to it, including responses sent to interactions' `response_url`
+        """
+        replies = defaultdict(list)
+        with self.lock:
+            for method in ("chat.postMessage", "response"):
+                for received, params in self.calls[method]:
+                    replies[params.get("channel")].append(received)
+        return replies
+
+    def get_conversation_id(self, users):
+        """return a stable fake conversation ID for a comma-separated list of
+        user IDs
+        """
+        return "D" + hashlib.sha1(users.encode("utf-8")).hexdigest()[:10]\
+            .upper()
+
+    def handle_call(self, method, params):
+        """return the response body for a Slack API call
+        """
+        if method == "conversations.members":
+            return {"ok": True, "members": self.members,
+                "response_metadata": {"next_cursor": ""}}
+        if method == "conversations.open":
+            return {"ok": True, "channel": {
+                "id": self.get_conversation_id(params.get("users", ""))}}
+        if method == "conversations.history":
+            # messages the bot posted in the conversation, including ones
+            # posted to a user ID in its direct message with them
+            channel_id = params.get("channel")
+            with self.lock:
+                posted = list(self.calls["chat.postMessage"])
+            return {"ok": True, "messages": [
+                {"ts": f"{received:.6f}", "text": message.get("text", ""),
+                    "metadata": message.get("metadata", {})}
+                for received, message in posted
+                if channel_id in (message.get("channel"),
+                    self.get_conversation_id(message.get("channel", "")))
+            ]}
+        if method == "users.info":
+            user_id = params.get("user")
+            return {"ok": True, "user": {"id": user_id, "is_bot": False,
+                "name": user_id.lower(),
+                "profile": {"real_name": f"Test {user_id}",
+                    "email": f"{user_id.lower()}@example.com"}}}
+        if method == "chat.postMessage":
+            return {"ok": True, "channel": params.get("channel"),
+                "ts": f"{time.time():.6f}"}
+        return {"ok": True}
+
+    def get_handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received = time.time()
+                path = urlparse(self.path)
+                # "/api/chat.postMessage" -> "chat.postMessage". requests to
+                # "/response/<user ID>" stand in for interaction
+                # `response_url`s
+                parts = path.path.strip("/").split("/")
+                params = dict(parse_qsl(path.query))
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                if "json" in self.headers.get("Content-Type", ""):
+                    params.update(json.loads(body or "{}"))
+                else:
+                    params.update(parse_qsl(body))
+                if parts[0] == "response":
+                    method = "response"
+                    params["channel"] = parts[-1]
+                else:
+                    method = parts[-1]
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if random.random() < fake.rate_limit_ratio:
+                    with fake.lock:
+                        fake.rate_limited_count += 1
+                    self.send_json(429, {"ok": False,
+                        "error": "ratelimited"},
+                        {"Retry-After": str(fake.retry_after)})
+                    return
+                with fake.lock:
+                    fake.calls[method].append((received, params))
+                self.send_json(200, fake.handle_call(method, params))
+
+            do_GET = do_POST
+
+            def send_json(self, status, data, headers={}):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # don't log every request to stderr
+                pass
+
+        return Handler
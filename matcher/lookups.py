@@ -0,0 +1,160 @@
+"""per-process caches for the Person, Pool and Workspace lookups on the
+webhook hot path. each process (web server worker, Celery worker) has its own caches,
+which are cleared when this process saves or deletes a Person or Pool, and
+entries expire after `settings.LOOKUP_CACHE_TTL` seconds in case another
+process changed them.
+
+cached objects are shared, so treat them as read-only, and only rely on the
+fields that identify them (like the primary key, user ID, names and channel
+ID). fields which change often, like `Person.last_query`, may be out of date,
+so read those from the database
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from django.db.models.signals import post_save, post_delete
+
+from meetups import settings
+from .models import Person, Pool, Workspace
+
+
+logger = logging.getLogger(__name__)
+
+# log each cache's hit rate every this many lookups
+STATS_LOG_INTERVAL = 1000
+
+
+class LRUCache:
+    """a thread-safe cache holding up to `max_size` entries for up to `ttl`
+    seconds, evicting the least recently used entry when full, with counters
+    for monitoring its hit rate
+    """
+
+    def __init__(self, name, max_size, ttl):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """return the cached value for `key`, or call `load()` to get it and
+        cache it. exceptions from `load`, like DoesNotExist, aren't cached
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.log_stats()
+                return entry[1]
+            self.misses += 1
+            self.log_stats()
+        value = load()
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        """return a dict of this cache's size and counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    def log_stats(self):
+        # called with the lock held
+        if (self.hits + self.misses) % STATS_LOG_INTERVAL == 0:
+            stats = self.get_stats()
+            logger.info(f"Lookup cache \"{self.name}\": {stats['hit_rate']:.1%}"
+                f" hit rate, {stats['hits']} hits, {stats['misses']} misses, "
+                f"{stats['evictions']} evictions, {stats['size']} entries.")
+
+
+person_cache = LRUCache("person", settings.LOOKUP_CACHE_SIZE,
+    settings.LOOKUP_CACHE_TTL)
+pool_cache = LRUCache("pool", settings.LOOKUP_CACHE_SIZE,
+    settings.LOOKUP_CACHE_TTL)
+workspace_cache = LRUCache("workspace", settings.LOOKUP_CACHE_SIZE,
+    settings.LOOKUP_CACHE_TTL)
+
+
+def get_person(user_id):
+    """get the Person with a Slack user ID, raising Person.DoesNotExist if
+    there isn't one. see the note at the top of this file about which fields
+    can be relied on
+    """
+    return person_cache.get(user_id,
+        lambda: Person.objects.get(user_id=user_id))
+
+
+def get_pool(pk=None, channel_name=None):
+    """get a Pool by its ID or channel name, raising Pool.DoesNotExist if
+    there isn't one
+    """
+    if pk is not None:
+        return pool_cache.get(("pk", str(pk)),
+            lambda: Pool.objects.get(pk=pk))
+    return pool_cache.get(("channel_name", channel_name),
+        lambda: Pool.objects.get(channel_name=channel_name))
+
+
+def get_workspace(team_id):
+    """get the Workspace with a Slack team ID, or None if there isn't one,
+    e.g. for requests from the default workspace. unknown team IDs are
+    cached too, so requests from them don't each query the database
+    """
+    return workspace_cache.get(team_id,
+        lambda: Workspace.objects.filter(team_id=team_id).first())
+
+
+def get_cache_stats():
+    """return a dict of cache name -> stats for this process's caches"""
+    return {cache.name: cache.get_stats()
+        for cache in (person_cache, pool_cache, workspace_cache)}
+
+
+def invalidate_person(sender, instance, **kwargs):
+    person_cache.invalidate(instance.user_id)
+
+
+def invalidate_pools(sender, instance, **kwargs):
+    # pools are cached under more than one key and rarely change, so clear
+    # them all
+    pool_cache.clear()
+
+
+def invalidate_workspaces(sender, instance, **kwargs):
+    # also clears cached unknown team IDs, in case this workspace was just
+    # added or its team ID changed
+    workspace_cache.clear()
+
+
+post_save.connect(invalidate_person, sender=Person)
+post_delete.connect(invalidate_person, sender=Person)
+post_save.connect(invalidate_pools, sender=Pool)
+post_delete.connect(invalidate_pools, sender=Pool)
+post_save.connect(invalidate_workspaces, sender=Workspace)
+post_delete.connect(invalidate_workspaces, sender=Workspace)
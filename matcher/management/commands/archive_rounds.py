@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from matcher.archive import archive_rounds
+from meetups import settings
+
+
+class Command(BaseCommand):
+    help = "Archives rounds which ended more than ARCHIVE_AFTER_DAYS days "\
+        "ago, moving their matches out of the tables used for matching and "\
+        "stats. Syntax: python3 manage.py archive_rounds [--days <days>]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+            default=settings.ARCHIVE_AFTER_DAYS)
+
+    def handle(self, *args, **options):
+        count = archive_rounds(options['days'])
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully archived {count} rounds")
+        )
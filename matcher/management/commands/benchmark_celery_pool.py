@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from matcher.delivery import dispatch_due_messages
+from matcher.loadtest import FakeSlackAPI
+from matcher.models import OutboundMessage
+from matcher.tasks import app
+from meetups import settings
+
+
+PURPOSE = "benchmark"
+
+
+class Command(BaseCommand):
+    help = "Benchmarks how many queued messages per second a Celery worker "\
+        "sends with each worker pool, by starting a worker for each pool and"\
+        " timing it sending messages to a fake Slack API which takes "\
+        "--latency seconds to respond. The broker (by default "\
+        "CELERY_BROKER_URL) must be running, and no other worker should be "\
+        "using it. Syntax: python3 manage.py benchmark_celery_pool "\
+        "--messages 500 --pools prefork threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=500)
+        parser.add_argument("--pools", nargs="+",
+            default=["prefork", "threads"])
+        parser.add_argument("--concurrency", type=int,
+            default=settings.CELERY_WORKER_CONCURRENCY,
+            help="worker concurrency for the \"threads\" pool; other pools "
+                "use one process per CPU, prefork's default")
+        parser.add_argument("--latency", type=float, default=0.2,
+            help="seconds the fake Slack API takes to respond")
+        parser.add_argument("--broker", default=settings.CELERY_BROKER_URL)
+        parser.add_argument("--timeout", type=float, default=300,
+            help="seconds to wait for each worker to send the messages")
+        parser.add_argument("--fake-slack-port", type=int, default=8001)
+
+    def handle(self, *args, **options):
+        app.conf.broker_url = options["broker"]
+        fake = FakeSlackAPI(port=options["fake_slack_port"],
+            latency=options["latency"])
+        fake.start()
+        try:
+            for pool in options["pools"]:
+                concurrency = options["concurrency"] \
+                    if pool == "threads" else 0
+                self.run(pool, concurrency or os.cpu_count(), fake, options)
+        finally:
+            fake.stop()
+            OutboundMessage.objects.filter(purpose=PURPOSE).delete()
+
+    def run(self, pool, concurrency, fake, options):
+        """time a worker with `pool` sending `--messages` messages"""
+        OutboundMessage.objects.filter(purpose=PURPOSE).delete()
+        now = timezone.now()
+        OutboundMessage.objects.bulk_create((
+            OutboundMessage(channel_id=f"UBENCH{index:05d}", purpose=PURPOSE,
+                message={"text": "Hi!"}, send_after=now)
+            for index in range(options["messages"])
+        ), batch_size=500)
+        command = [sys.executable, "-m", "celery", "-A", "matcher.tasks",
+            "-b", options["broker"], "worker", "--pool", pool,
+            "--loglevel", "warning", "--without-gossip", "--without-mingle",
+            "--without-heartbeat", "--concurrency", str(concurrency)]
+        worker = subprocess.Popen(command, env={**os.environ,
+            "SLACK_API_URL": f"{fake.url}api/",
+            "SLACK_API_TOKEN": "xoxb-benchmark"})
+        try:
+            messages = OutboundMessage.objects.filter(purpose=PURPOSE)
+            # hand them all off at once, to time the worker alone
+            while dispatch_due_messages(options["messages"], throttle=False):
+                pass
+            deadline = time.monotonic() + options["timeout"]
+            while messages.filter(delivered__isnull=True).exists():
+                if worker.poll() is not None:
+                    raise CommandError(f"The {pool} worker exited.")
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.2)
+        finally:
+            worker.terminate()
+            worker.wait()
+        # timed from the first message sent rather than dispatched, so the
+        # worker's startup time isn't counted
+        times = messages.aggregate(first=Min("delivered"),
+            last=Max("delivered"))
+        delivered = messages.filter(delivered__isnull=False).count()
+        seconds = (times["last"] - times["first"]).total_seconds() \
+            if times["last"] else 0
+        rate = (delivered - 1) / seconds if seconds else 0
+        self.stdout.write(f"{pool} (concurrency {concurrency}):"
+            f" sent {delivered} of {options['messages']} messages in "
+            f"{seconds:.1f}s, {rate:.1f} messages/s")
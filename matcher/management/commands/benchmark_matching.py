@@ -0,0 +1,94 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from matcher.pairing import (AVOID_SAME, PREFER_DIFFERENT,
+                             compile_constraints, pair_people)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks pairing a synthetic pool in memory, without and with "\
+        "matching rules, and checking pairs against the rules using the "\
+        "precomputed bitmasks versus comparing people's attributes. "\
+        "Doesn't use the database. Syntax: python3 manage.py "\
+        "benchmark_matching --people 5000 --history-rounds 20"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--people", type=int, default=2000)
+        parser.add_argument("--history-rounds", type=int, default=10,
+            help="number of past rounds everyone was matched in")
+        parser.add_argument("--teams", type=int, default=50,
+            help="number of teams, which people on are never paired")
+        parser.add_argument("--offices", type=int, default=5,
+            help="number of offices, which people in are preferably not "
+                "paired")
+        parser.add_argument("--checks", type=int, default=1000000,
+            help="number of random pairs to check against the rules")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        person_ids = list(range(1, options["people"] + 1))
+        attributes = {person_id: {
+            "team": f"Team {rng.randrange(options['teams'])}",
+            "office": f"Office {rng.randrange(options['offices'])}",
+        } for person_id in person_ids}
+        rules = [("team", AVOID_SAME), ("office", PREFER_DIFFERENT)]
+        past_partners = {}
+        for _ in range(options["history_rounds"]):
+            rng.shuffle(person_ids)
+            for person_1_id, person_2_id in zip(person_ids[::2],
+                person_ids[1::2]):
+                past_partners.setdefault(person_1_id, set()).add(person_2_id)
+                past_partners.setdefault(person_2_id, set()).add(person_1_id)
+        rng.shuffle(person_ids)
+        self.stdout.write(f"{len(person_ids)} people, "
+            f"{options['history_rounds']} past rounds, {options['teams']} "
+            f"teams, {options['offices']} offices.")
+
+        start = time.perf_counter()
+        avoid, prefer_different = compile_constraints(attributes, rules)
+        self.stdout.write(f"Compiled rules in "
+            f"{(time.perf_counter() - start) * 1000:.1f}ms.")
+        for label, masks in (("Without rules", ({}, {})),
+                             ("With rules", (avoid, prefer_different))):
+            start = time.perf_counter()
+            pairs, _ = pair_people(person_ids, past_partners, *masks,
+                allow_duplicates=True)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{label}: {len(pairs)} pairs in "
+                f"{elapsed * 1000:.1f}ms, "
+                f"{self.count_duplicates(pairs, past_partners)} duplicates, "
+                f"{self.count_shared(pairs, attributes, 'team')} on the "
+                f"same team, {self.count_shared(pairs, attributes, 'office')}"
+                f" in the same office.")
+
+        checks = [tuple(rng.sample(person_ids, 2))
+            for _ in range(options["checks"])]
+        start = time.perf_counter()
+        by_mask = sum(1 for person_1_id, person_2_id in checks
+            if avoid[person_1_id] & avoid[person_2_id] or
+                prefer_different[person_1_id] &
+                prefer_different[person_2_id])
+        mask_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        by_attributes = sum(1 for person_1_id, person_2_id in checks
+            if any(attributes[person_1_id].get(attribute) ==
+                attributes[person_2_id].get(attribute)
+                for attribute, _ in rules))
+        attributes_elapsed = time.perf_counter() - start
+        assert by_mask == by_attributes
+        self.stdout.write(f"Checked {len(checks)} pairs against the rules: "
+            f"{mask_elapsed * 1000:.1f}ms with bitmasks, "
+            f"{attributes_elapsed * 1000:.1f}ms comparing attributes "
+            f"({attributes_elapsed / mask_elapsed:.1f}x).")
+
+    def count_duplicates(self, pairs, past_partners):
+        return sum(1 for person_1_id, person_2_id in pairs
+            if person_2_id in past_partners.get(person_1_id, ()))
+
+    def count_shared(self, pairs, attributes, attribute):
+        return sum(1 for person_1_id, person_2_id in pairs
+            if attributes[person_1_id][attribute] ==
+                attributes[person_2_id][attribute])
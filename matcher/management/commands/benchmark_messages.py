@@ -0,0 +1,91 @@
+import copy
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from matcher import messages
+from matcher.models import Match, Person, Pool
+from matcher.utils import blockquote
+
+
+INTRO = "I'm on the platform team and have been here two years.\n\n"\
+    "Outside work I like climbing, board games, and baking bread."
+
+
+class Command(BaseCommand):
+    help = "Benchmarks rendering the messages sent to everyone in a round: "\
+        "the availability and met prompts, with the compiled block "\
+        "templates versus deep copying the template, and match intros, with"\
+        " cached versus regex blockquoted intros. Doesn't use the database."\
+        " Syntax: python3 manage.py benchmark_messages --people 10000"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--people", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        pool = Pool(id=1, name="Coffee", channel_id="C0000000001",
+            channel_name="coffee")
+        people = [Person(id=index, user_id=f"U{index:010d}",
+            full_name=f"Person {index}", casual_name="Person",
+            intro=f"{INTRO} ({index})")
+            for index in range(options["people"])]
+        matches = [Match(id=index, person_1=person_1, person_2=person_2)
+            for index, (person_1, person_2)
+            in enumerate(zip(people[::2], people[1::2]))]
+        self.stdout.write(f"{len(people)} people, {len(matches)} matches.")
+
+        def render_prompts(format_block_text):
+            for person in people:
+                format_block_text("ASK_IF_AVAILABLE", pool.id,
+                    {"person": person, "pool": pool})
+            for match in matches:
+                format_block_text("ASK_IF_MET", match.id,
+                    {"pool": pool, "other_person": match.person_2})
+
+        assert format_block_text_copy("ASK_IF_MET", 1,
+            {"pool": pool, "other_person": people[0]}) == \
+            messages.format_block_text("ASK_IF_MET", 1,
+                {"pool": pool, "other_person": people[0]})
+        self.report("Prompts", len(people) + len(matches),
+            lambda: render_prompts(format_block_text_copy),
+            lambda: render_prompts(messages.format_block_text))
+
+        def render_intros(blockquote):
+            # each person is in a match every round, so time a few rounds
+            for _ in range(3):
+                for match in matches:
+                    messages.MATCH_INTRO.format(person_1=match.person_1,
+                        person_2=match.person_2, pool=pool,
+                        person_1_intro=blockquote(match.person_1.intro),
+                        person_2_intro=blockquote(match.person_2.intro))
+
+        assert blockquote_regex(INTRO) == blockquote(INTRO)
+        blockquote.cache_clear()
+        self.report("Match intros, 3 rounds", len(matches) * 3,
+            lambda: render_intros(blockquote_regex),
+            lambda: render_intros(blockquote))
+
+    def report(self, label, count, before, after):
+        timings = []
+        for render in (before, after):
+            start = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - start)
+        self.stdout.write(f"{label}: {count} messages, "
+            f"{timings[0] / count * 1e6:.1f}µs per message before, "
+            f"{timings[1] / count * 1e6:.1f}µs after "
+            f"({timings[0] / timings[1]:.1f}x).")
+
+
+def format_block_text_copy(block_name, block_id, dictionary):
+    # how `messages.format_block_text` used to render blocks
+    block = copy.deepcopy(messages.BLOCKS[block_name])
+    block[0]["text"]["text"] = block[0]["text"]["text"].format_map(dictionary)
+    block[1]["block_id"] = block[1]["block_id"].format(id=block_id)
+    return block
+
+
+def blockquote_regex(message):
+    # how `blockquote` used to quote messages
+    return re.sub(r"^", "> ", message, flags=re.MULTILINE)
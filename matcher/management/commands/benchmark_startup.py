@@ -0,0 +1,128 @@
+import re
+import sys
+import time
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from matcher.loadtest import percentile
+
+
+# run in a fresh interpreter to time how long a new web server worker takes
+# to load the app and respond to its first request. the request is an
+# unsigned Slack webhook, which loads the views and tasks but is rejected
+# before doing any work
+FIRST_REQUEST_SCRIPT = """
+import io
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "meetups.settings")
+from meetups.wsgi import application
+environ = {
+    "REQUEST_METHOD": "POST",
+    "PATH_INFO": "/slack/message/",
+    "SERVER_NAME": "localhost",
+    "SERVER_PORT": "8000",
+    "HTTP_HOST": "localhost",
+    "CONTENT_TYPE": "application/json",
+    "CONTENT_LENGTH": "2",
+    "wsgi.input": io.BytesIO(b"{}"),
+    "wsgi.url_scheme": "http",
+    "wsgi.errors": io.StringIO(),
+}
+application(environ, lambda status, headers: None)
+"""
+
+# modules which are slow to import and shouldn't be needed by every process
+HEAVY_MODULES = ("slack", "aiohttp", "celery", "kombu")
+
+
+class Command(BaseCommand):
+    help = "Benchmark how long management commands (like the ones cron "\
+        "runs) take to start, and how long a new web server worker takes to "\
+        "respond to its first request, each in a fresh Python process. "\
+        "Syntax: python3 manage.py benchmark_startup [--runs 5] "\
+        "[--max-ms 1000]"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5,
+            help="number of times to start each process")
+        parser.add_argument("--command", action="append", dest="commands",
+            help="management command to time, e.g. \"check\". repeat for "
+            "several. commands are timed with `help <command>` so that they "
+            "load without running. defaults to the commands run by cron")
+        parser.add_argument("--max-ms", type=float,
+            help="fail if any median startup time exceeds this many "
+            "milliseconds")
+
+    def handle(self, *args, **options):
+        commands = options["commands"] or ["run_schedules",
+            "send_queued_messages", "archive_rounds"]
+        benchmarks = [("python (baseline)", [sys.executable, "-c", "pass"])]
+        benchmarks += [
+            (f"manage.py {command}",
+                [sys.executable, "manage.py", "help", command])
+            for command in commands
+        ]
+        benchmarks.append(("first request",
+            [sys.executable, "-c", FIRST_REQUEST_SCRIPT]))
+
+        slow = []
+        for name, args in benchmarks:
+            timings = [self.time_process(args)
+                for _ in range(options["runs"])]
+            median = percentile(timings, 50) * 1000
+            self.stdout.write(f"{name}: median {median:.0f}ms, "
+                f"min {min(timings) * 1000:.0f}ms, "
+                f"max {max(timings) * 1000:.0f}ms")
+            if options["max_ms"] and median > options["max_ms"]:
+                slow.append(name)
+
+        # report slow-to-import modules which management commands load, which
+        # usually means something imports them at module level
+        for command in commands:
+            heavy_imports = self.get_heavy_imports(
+                ["manage.py", "help", command])
+            if heavy_imports:
+                self.stdout.write(self.style.WARNING(f"manage.py {command} "
+                    f"imports: " + ", ".join(
+                        f"{module} ({ms:.0f}ms)"
+                        for module, ms in heavy_imports)))
+
+        if slow:
+            raise CommandError(f"Startup took longer than "
+                f"{options['max_ms']:.0f}ms for: {', '.join(slow)}")
+        self.stdout.write(self.style.SUCCESS("Benchmark finished."))
+
+    def time_process(self, args):
+        """run a process to completion and return how long it took in
+        seconds
+        """
+        start = time.monotonic()
+        process = subprocess.run(args, cwd=settings.BASE_DIR,
+            capture_output=True)
+        elapsed = time.monotonic() - start
+        if process.returncode != 0:
+            raise CommandError(f"\"{' '.join(args)}\" failed: "
+                f"{process.stderr.decode('utf-8')}")
+        return elapsed
+
+    def get_heavy_imports(self, args):
+        """return a list of (package, milliseconds) for the `HEAVY_MODULES`
+        a process imports and how long their modules took to import, using
+        `-X importtime`
+        """
+        process = subprocess.run([sys.executable, "-X", "importtime", *args],
+            cwd=settings.BASE_DIR, capture_output=True)
+        import_times = {}
+        # lines look like "import time: self [us] | cumulative | module"
+        for line in process.stderr.decode("utf-8").splitlines():
+            match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)",
+                line)
+            if not match:
+                continue
+            package = match.group(2).split(".")[0]
+            if package in HEAVY_MODULES:
+                import_times[package] = import_times.get(package, 0) + \
+                    int(match.group(1)) / 1000
+        return list(import_times.items())
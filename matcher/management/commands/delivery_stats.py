@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from matcher.models import OutboundMessage
+
+
+class Command(BaseCommand):
+    help = "Reports how many queued messages have been sent, retried and "\
+        "delivered, and how many were cancelled or skipped as duplicates, "\
+        "for monitoring. Syntax: python3 manage.py delivery_stats "\
+        "[--hours 24]"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int,
+            help="only include messages due in the last this many hours")
+
+    def handle(self, *args, **options):
+        messages = OutboundMessage.objects.all()
+        if options["hours"]:
+            messages = messages.filter(send_after__gte=timezone.now() -
+                timedelta(hours=options["hours"]))
+        stats = messages.aggregate(
+            total=Count("pk"),
+            queued=Count("pk", filter=Q(dispatched__isnull=True,
+                cancelled__isnull=True)),
+            in_flight=Count("pk", filter=Q(dispatched__isnull=False,
+                delivered__isnull=True, cancelled__isnull=True)),
+            delivered=Count("pk", filter=Q(delivered__isnull=False)),
+            retried=Count("pk", filter=Q(attempts__gt=1)),
+            cancelled=Count("pk", filter=Q(cancelled__isnull=False)),
+            duplicates_suppressed=Sum("duplicates_suppressed", default=0),
+        )
+        for name, value in stats.items():
+            self.stdout.write(f"{name.replace('_', ' ')}: {value}")
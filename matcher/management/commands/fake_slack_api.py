@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from matcher.loadtest import FakeSlackAPI
+
+
+class Command(BaseCommand):
+    help = "Runs a local stand-in for the Slack Web API which records the "\
+        "bot's API calls, optionally adding latency and rate limit errors. "\
+        "Point the bot at it by setting SLACK_API_URL to the printed URL. "\
+        "Syntax: python3 manage.py fake_slack_api [--port 8001] "\
+        "[--latency 0.1] [--rate-limit-ratio 0.05]"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument("--latency", type=float, default=0,
+            help="seconds to wait before responding to each call")
+        parser.add_argument("--rate-limit-ratio", type=float, default=0,
+            help="fraction of calls (0–1) to respond to with HTTP 429")
+        parser.add_argument("--retry-after", type=int, default=1,
+            help="Retry-After header value for rate limited calls")
+        parser.add_argument("--members", nargs="*", default=[],
+            help="user IDs to return as the members of any channel")
+
+    def handle(self, *args, **options):
+        fake = FakeSlackAPI(host=options["host"], port=options["port"],
+            latency=options["latency"],
+            rate_limit_ratio=options["rate_limit_ratio"],
+            retry_after=options["retry_after"], members=options["members"])
+        fake.start()
+        self.stdout.write(f"Fake Slack API running. Set "
+            f"SLACK_API_URL={fake.url}api/ for the web server and Celery "
+            "worker. Press Ctrl-C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        fake.stop()
+        for method, calls in sorted(fake.calls.items()):
+            self.stdout.write(f"{method}: {len(calls)} calls")
+        self.stdout.write(f"rate limited: {fake.rate_limited_count} calls")
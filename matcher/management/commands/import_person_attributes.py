@@ -0,0 +1,45 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from matcher.models import Person
+
+
+class Command(BaseCommand):
+    help = "Sets people's attributes, used by pools' matching rules, from a "\
+        "CSV file with a \"user_id\" column and a column per attribute, like"\
+        " \"team\" and \"office\". Values separated by \"|\" are saved as a "\
+        "list, and empty values are removed. Other attributes are left "\
+        "alone. Syntax: python3 manage.py import_person_attributes <path>"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str)
+
+    def handle(self, *args, **options):
+        with open(options["path"], newline="") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        if rows and "user_id" not in rows[0]:
+            raise CommandError("The CSV file must have a \"user_id\" column.")
+        people = Person.objects.in_bulk([row["user_id"] for row in rows],
+            field_name="user_id")
+        missing = 0
+        for row in rows:
+            person = people.get(row.pop("user_id"))
+            if not person:
+                missing += 1
+                continue
+            for attribute, value in row.items():
+                values = [part.strip() for part in value.split("|")
+                    if part.strip()]
+                if not values:
+                    person.attributes.pop(attribute, None)
+                else:
+                    person.attributes[attribute] = values if \
+                        len(values) > 1 else values[0]
+        Person.objects.bulk_update(people.values(), ["attributes"],
+            batch_size=500)
+        if missing:
+            self.stdout.write(self.style.WARNING(f"Skipped {missing} "
+                "rows for user IDs with no person."))
+        self.stdout.write(self.style.SUCCESS(f"Updated {len(people)} "
+            "people's attributes."))
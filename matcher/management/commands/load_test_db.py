@@ -0,0 +1,170 @@
+import os
+import time
+import random
+import tempfile
+import multiprocessing
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, OperationalError
+
+from matcher.loadtest import percentile
+from matcher.lookups import get_person, get_pool
+from matcher.models import Pool, Person, PoolMembership, Round, Match
+
+
+def webhook_write(pool_id, user_id):
+    """the database reads and writes `update_availability` does to record
+    someone's answer when they click an availability button: the Pool and
+    Person usually come from the per-process caches, see
+    `matcher/lookups.py`, then the membership is updated in a single UPDATE
+    """
+    pool = get_pool(pk=pool_id)
+    person = get_person(user_id)
+    PoolMembership.objects.filter(pool=pool, person=person)\
+        .update(available=random.choice([True, False]))
+
+
+def worker_write(match_id):
+    """the database reads and writes `open_match_dm` does when it opens a
+    conversation for a match
+    """
+    match = Match.objects.get(pk=match_id)
+    Match.objects.filter(pk=match.pk)\
+        .update(conversation_id=f"D{random.randrange(10 ** 9):09d}")
+
+
+def run_writer(kind, ids, rate, duration, results):
+    """perform writes of the given kind at `rate` per second for `duration`
+    seconds, reporting latencies and errors to the `results` queue
+    """
+    # each process needs its own database connection
+    connections.close_all()
+    latencies = []
+    lock_errors = 0
+    other_errors = 0
+    interval = 1 / rate
+    start = time.monotonic()
+    next_write = start
+    while time.monotonic() - start < duration:
+        write_start = time.monotonic()
+        try:
+            if kind == "webhook":
+                webhook_write(*random.choice(ids))
+            else:
+                worker_write(random.choice(ids))
+        except OperationalError as exception:
+            if "locked" in str(exception):
+                lock_errors += 1
+            else:
+                other_errors += 1
+        else:
+            latencies.append(time.monotonic() - write_start)
+        # pace writes to the target rate rather than going as fast as
+        # possible, like real traffic
+        next_write += interval
+        time.sleep(max(0, next_write - time.monotonic()))
+    connections.close_all()
+    results.put((kind, latencies, lock_errors, other_errors,
+        time.monotonic() - start))
+
+
+class Command(BaseCommand):
+    help = "Load test concurrent database writes from the web server and "\
+        "Celery workers against a scratch copy of the database schema, to "\
+        "check that the configured SQLite settings sustain a target write "\
+        "rate without \"database is locked\" errors. Syntax: python3 "\
+        "manage.py load_test_db [--rate 200] [--duration 10]"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--people", type=int, default=2000,
+            help="number of people in the test pool")
+        parser.add_argument("--webhook-processes", type=int, default=4,
+            help="number of processes simulating web server workers")
+        parser.add_argument("--worker-processes", type=int, default=4,
+            help="number of processes simulating Celery workers")
+        parser.add_argument("--rate", type=int, default=200,
+            help="target total writes per second across all processes")
+        parser.add_argument("--duration", type=int, default=10,
+            help="seconds to run the load test for")
+
+    def handle(self, *args, **options):
+        if connections["default"].vendor != "sqlite":
+            raise CommandError("This load test only supports SQLite.")
+        # never touch the real database; run against a temporary file with
+        # the same connection settings
+        scratch_dir = tempfile.mkdtemp()
+        connections.close_all()
+        connections["default"].settings_dict["NAME"] = \
+            os.path.join(scratch_dir, "load-test.db")
+        call_command("migrate", run_syncdb=True, verbosity=0)
+
+        pool_ids, match_ids = self.seed(options["people"])
+        process_count = options["webhook_processes"] + \
+            options["worker_processes"]
+        rate_per_process = options["rate"] / process_count
+
+        # fork so child processes inherit the scratch database settings
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        connections.close_all()
+        processes = [
+            context.Process(target=run_writer, args=(kind, ids,
+                rate_per_process, options["duration"], results))
+            for kind, ids, count in (
+                ("webhook", pool_ids, options["webhook_processes"]),
+                ("worker", match_ids, options["worker_processes"]),
+            )
+            for _ in range(count)
+        ]
+        self.stdout.write(f"Running {process_count} processes at "
+            f"{options['rate']} writes/s for {options['duration']}s…")
+        for process in processes:
+            process.start()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        latencies = [l for report in reports for l in report[1]]
+        lock_errors = sum(report[2] for report in reports)
+        other_errors = sum(report[3] for report in reports)
+        elapsed = max(report[4] for report in reports)
+        achieved_rate = len(latencies) / elapsed
+        self.stdout.write(
+            f"writes: {len(latencies)}, rate: {achieved_rate:.1f}/s, "
+            f"p50: {percentile(latencies, 50) * 1000:.1f}ms, "
+            f"p99: {percentile(latencies, 99) * 1000:.1f}ms, "
+            f"max: {percentile(latencies, 100) * 1000:.1f}ms, "
+            f"lock errors: {lock_errors}, other errors: {other_errors}"
+        )
+        if lock_errors or other_errors:
+            raise CommandError("Writes failed during the load test.")
+        # allow some slack for process startup and pacing jitter
+        if achieved_rate < options["rate"] * 0.9:
+            raise CommandError(f"Achieved write rate ({achieved_rate:.1f}/s)"
+                f" is below the target rate ({options['rate']}/s).")
+        self.stdout.write(self.style.SUCCESS("Load test passed."))
+
+    def seed(self, people_count):
+        """create a pool of people with a round of matches to write to,
+        returning (pool ID, user ID) pairs and match IDs
+        """
+        pool = Pool.objects.create(name="Load test", channel_id="CLOADTEST",
+            channel_name="load-test")
+        people = Person.objects.bulk_create(
+            Person(user_id=f"U{i:09d}", user_name=f"user{i}",
+                full_name=f"Person {i}", casual_name="Person", intro="Hi!")
+            for i in range(people_count)
+        )
+        PoolMembership.objects.bulk_create(
+            PoolMembership(person=person, pool=pool) for person in people
+        )
+        # bulk creation skips `Round.save` and the `Match` post-save signal,
+        # so no Slack messages are sent
+        round = Round.objects.bulk_create([Round(pool=pool)])[0]
+        matches = Match.objects.bulk_create(
+            Match(person_1=people[i], person_2=people[i + 1], round=round)
+            for i in range(0, people_count - 1, 2)
+        )
+        return ([(pool.pk, person.user_id) for person in people],
+            [match.pk for match in matches])
@@ -0,0 +1,170 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from matcher.loadtest import (FakeSlackAPI, build_block_action,
+                              build_message_event, fire_at_rate, percentile,
+                              post_signed)
+from matcher.models import Pool, Person, PoolMembership, Round, Match
+from meetups import settings
+
+
+class Command(BaseCommand):
+    help = "Load tests a running instance of the bot by sending it signed "\
+        "Slack webhook requests at a steady rate, while running a fake Slack"\
+        " API to record the bot's replies. The instance's web server and "\
+        "Celery worker must use this database and have SLACK_API_URL set to"\
+        " the fake Slack API. Syntax: python3 manage.py load_test_webhooks "\
+        "--scenario availability --people 5000 --duration 600"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://localhost:8000",
+            help="base URL of the running instance")
+        parser.add_argument("--scenario", default="availability",
+            choices=["availability", "met", "message"],
+            help="which webhook to send: availability button clicks, "
+                "\"met\" button clicks, or direct messages to the bot")
+        parser.add_argument("--people", type=int, default=1000,
+            help="number of people (and requests) in the test pool")
+        parser.add_argument("--duration", type=float, default=60,
+            help="seconds over which to send the requests")
+        parser.add_argument("--rate", type=float,
+            help="requests per second (overrides --duration)")
+        parser.add_argument("--concurrency", type=int, default=50,
+            help="maximum requests in flight at once")
+        parser.add_argument("--reply-timeout", type=float, default=60,
+            help="seconds to wait for the bot's replies after the last "
+                "request")
+        parser.add_argument("--fake-slack-port", type=int, default=8001)
+        parser.add_argument("--latency", type=float, default=0,
+            help="seconds the fake Slack API waits before each response")
+        parser.add_argument("--rate-limit-ratio", type=float, default=0,
+            help="fraction of fake Slack API calls (0–1) to rate limit")
+
+    def handle(self, *args, **options):
+        if not settings.SLACK_SIGNING_SECRET:
+            raise CommandError("SLACK_SIGNING_SECRET must be set to the "
+                "same value as the running instance's.")
+        fake = FakeSlackAPI(port=options["fake_slack_port"],
+            latency=options["latency"],
+            rate_limit_ratio=options["rate_limit_ratio"])
+        fake.start()
+        requests = self.build_requests(options["scenario"],
+            options["people"], fake.url)
+        rate = options["rate"] or len(requests) / options["duration"]
+        endpoint = "message" if options["scenario"] == "message" else \
+            "action"
+        url = f"{options['url'].rstrip('/')}/slack/{endpoint}/"
+        self.stdout.write(f"Sending {len(requests)} requests to {url} at "
+            f"{rate:.1f}/s. Fake Slack API at {fake.url}api/")
+
+        def send(request):
+            user_id, body, content_type = request
+            return post_signed(url, body, content_type,
+                settings.SLACK_SIGNING_SECRET)
+
+        start = time.time()
+        results = fire_at_rate(requests, rate, send,
+            concurrency=options["concurrency"])
+        send_duration = time.time() - start
+        latencies = [result[1] for _, _, result in results]
+        statuses = {}
+        for _, _, (status, _) in results:
+            statuses[status] = statuses.get(status, 0) + 1
+
+        # wait for the bot to reply to everyone (or give up)
+        sent_at = {request[0]: start_time
+            for request, start_time, _ in results}
+        deadline = time.time() + options["reply_timeout"]
+        while True:
+            reply_times = self.get_reply_times(fake, sent_at)
+            if len(reply_times) == len(sent_at) or time.time() > deadline:
+                break
+            time.sleep(0.5)
+        fake.stop()
+
+        self.stdout.write(f"sent {len(results)} requests in "
+            f"{send_duration:.1f}s, status codes: {statuses}")
+        self.report("webhook latency", latencies)
+        self.report("time to reply", list(reply_times.values()))
+        self.stdout.write(f"no reply: {len(sent_at) - len(reply_times)}, "
+            f"Slack API calls: "
+            f"{ {method: len(calls) for method, calls in fake.calls.items()} }"
+            f", rate limited: {fake.rate_limited_count}")
+
+    def report(self, label, values):
+        self.stdout.write(f"{label}: "
+            f"p50 {percentile(values, 50) * 1000:.0f}ms, "
+            f"p95 {percentile(values, 95) * 1000:.0f}ms, "
+            f"p99 {percentile(values, 99) * 1000:.0f}ms, "
+            f"max {percentile(values, 100) * 1000:.0f}ms")
+
+    def get_reply_times(self, fake, sent_at):
+        """return a dict of user ID -> seconds from sending a request as that
+        user to the bot's first reply to them afterward
+        """
+        reply_times = {}
+        for user_id, times in fake.get_replies().items():
+            if user_id not in sent_at:
+                continue
+            after = [t for t in times if t >= sent_at[user_id]]
+            if after:
+                reply_times[user_id] = min(after) - sent_at[user_id]
+        return reply_times
+
+    def build_requests(self, scenario, people_count, fake_url):
+        """seed the database with a test pool and return a list of (user ID,
+        body, content type) for each request to send
+        """
+        pool, people = self.seed(people_count)
+        requests = []
+        if scenario == "availability":
+            for person in people:
+                requests.append((person.user_id, *build_block_action(
+                    person.user_id, f"availability-{pool.pk}", "yes",
+                    f"{fake_url}response/{person.user_id}")))
+        elif scenario == "met":
+            # bulk creation skips `Round.save` and the `Match` post-save
+            # signal, so no Slack messages are sent
+            round = Round.objects.bulk_create([Round(pool=pool)])[0]
+            matches = Match.objects.bulk_create(
+                Match(person_1=people[i], person_2=people[i + 1],
+                    round=round)
+                for i in range(0, len(people) - 1, 2)
+            )
+            for match in matches:
+                for person in (match.person_1, match.person_2):
+                    requests.append((person.user_id, *build_block_action(
+                        person.user_id, f"met-{match.pk}", "yes",
+                        f"{fake_url}response/{person.user_id}")))
+        else:
+            for person in people:
+                requests.append((person.user_id, *build_message_event(
+                    person.user_id, "Can I update my intro?")))
+        return requests
+
+    def seed(self, people_count):
+        """get or create a load test pool with `people_count` members
+        """
+        pool, _ = Pool.objects.get_or_create(channel_id="CLOADTEST",
+            defaults={"name": "Load test", "channel_name": "load-test"})
+        user_ids = [f"ULOAD{i:06d}" for i in range(people_count)]
+        existing = set(Person.objects.filter(user_id__in=user_ids)\
+            .values_list("user_id", flat=True))
+        Person.objects.bulk_create(
+            Person(user_id=user_id, user_name=user_id.lower(),
+                full_name=f"Test {user_id}", casual_name="Test", intro="Hi!")
+            for user_id in user_ids if user_id not in existing
+        )
+        people = list(Person.objects.filter(user_id__in=user_ids)\
+            .order_by("user_id"))
+        member_ids = set(PoolMembership.objects.filter(pool=pool)\
+            .values_list("person", flat=True))
+        PoolMembership.objects.bulk_create(
+            PoolMembership(person=person, pool=pool)
+            for person in people if person.pk not in member_ids
+        )
+        # reset state from any previous run so every request gets a reply
+        Person.objects.filter(pk__in=[person.pk for person in people])\
+            .update(last_query=None)
+        return pool, people
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from matcher.admin import rematch_dropouts
+from matcher.models import Person, Round
+
+
+class Command(BaseCommand):
+    help = "Re-pairs the people matched with people who can no longer take "\
+        "part in a round, without redoing the rest of the round's matches. "\
+        "Syntax: python3 manage.py rematch_dropouts <round ID> <user_ids> "\
+        "(separate user_ids with spaces)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("round_id", type=int)
+        parser.add_argument("user_ids", nargs="+", type=str)
+
+    def handle(self, *args, **options):
+        try:
+            round = Round.objects.select_related("pool")\
+                .get(pk=options["round_id"])
+        except Round.DoesNotExist:
+            raise CommandError(f"Round \"{options['round_id']}\" does not "
+                "exist.")
+        dropouts = Person.objects.filter(user_id__in=options["user_ids"])
+        missing = set(options["user_ids"]) - \
+            set(dropouts.values_list("user_id", flat=True))
+        if missing:
+            raise CommandError(f"No people with user IDs: "
+                f"{', '.join(sorted(missing))}.")
+        new_matches, left_out = rematch_dropouts(round, dropouts)
+        for new_match in new_matches:
+            self.stdout.write(f"Matched: {new_match}")
+        if left_out:
+            self.stdout.write(self.style.WARNING(f"Left out {left_out} "
+                "because there were an odd number of people."))
+        self.stdout.write(self.style.SUCCESS(f"Made {len(new_matches)} new "
+            f"matches for round \"{round}\"."))
@@ -0,0 +1,80 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from matcher.delivery import replay_failed_delivery
+from matcher.models import FailedDelivery, Pool
+
+
+class Command(BaseCommand):
+    help = "Replays Slack deliveries which failed after using up their "\
+        "retries, like messages that couldn't be sent during a Slack "\
+        "outage, in rate-limited batches. Only deliveries which haven't "\
+        "been replayed yet are replayed unless --include-replayed is "\
+        "passed. Syntax: python3 manage.py replay_failed [--round <ID>] "\
+        "[--pool <channel ID>] [--error-type <exception name>] "\
+        "[--task <task name>] [--dry-run]"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--round", type=int,
+            help="only replay deliveries for the round with this ID")
+        parser.add_argument("--pool",
+            help="only replay deliveries for the pool with this channel ID")
+        parser.add_argument("--error-type",
+            help="only replay deliveries which failed with this exception, "
+            "like \"SlackApiError\"")
+        parser.add_argument("--task",
+            help="only replay this task, like \"matcher.tasks.send_msg\"")
+        parser.add_argument("--include-replayed", action="store_true",
+            help="also replay deliveries which were already replayed")
+        parser.add_argument("--limit", type=int,
+            help="maximum number of deliveries to replay")
+        parser.add_argument("--batch-size", type=int, default=50,
+            help="number of deliveries to replay at a time")
+        parser.add_argument("--rate", type=float, default=1,
+            help="maximum deliveries to replay per second")
+        parser.add_argument("--dry-run", action="store_true",
+            help="list the deliveries which would be replayed")
+
+    def handle(self, *args, **options):
+        failed_deliveries = FailedDelivery.objects.order_by("failed")
+        if options["round"]:
+            failed_deliveries = failed_deliveries\
+                .filter(round=options["round"])
+        if options["pool"]:
+            try:
+                pool = Pool.objects.get(channel_id=options["pool"])
+            except Pool.DoesNotExist:
+                raise CommandError(f"Pool \"{options['pool']}\" does not "
+                    "exist.")
+            failed_deliveries = failed_deliveries.filter(pool=pool)
+        if options["error_type"]:
+            failed_deliveries = failed_deliveries\
+                .filter(error_type=options["error_type"])
+        if options["task"]:
+            failed_deliveries = failed_deliveries.filter(task=options["task"])
+        if not options["include_replayed"]:
+            failed_deliveries = failed_deliveries.filter(replayed__isnull=True)
+        failed_deliveries = list(failed_deliveries[:options["limit"]])
+
+        if options["dry_run"]:
+            for failed_delivery in failed_deliveries:
+                self.stdout.write(str(failed_delivery))
+            self.stdout.write(f"Would replay {len(failed_deliveries)} "
+                "deliveries.")
+            return
+
+        batch_size = options["batch_size"]
+        for start in range(0, len(failed_deliveries), batch_size):
+            batch = failed_deliveries[start:start + batch_size]
+            batch_start = time.monotonic()
+            for failed_delivery in batch:
+                replay_failed_delivery(failed_delivery)
+            self.stdout.write(f"Replayed {start + len(batch)} of "
+                f"{len(failed_deliveries)} deliveries")
+            # wait long enough for the batch to stay under the rate limit
+            if start + batch_size < len(failed_deliveries):
+                time.sleep(max(0, len(batch) / options["rate"] -
+                    (time.monotonic() - batch_start)))
+        self.stdout.write(self.style.SUCCESS(f"Replayed "
+            f"{len(failed_deliveries)} deliveries."))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from matcher.feedback import get_ended_rounds, request_met_feedback
+from matcher.models import Round
+
+
+class Command(BaseCommand):
+    help = "Asks people in rounds which have ended whether they met their "\
+        "match, if they haven't said yet. Meant to be run regularly by "\
+        "cron. Syntax: python3 manage.py request_met_feedback "\
+        "[--round <round ID>]"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--round", type=int,
+            help="ask people in this round now, even if it hasn't ended or "
+                "they were asked already (each person is still only asked "
+                "once per match)")
+
+    def handle(self, *args, **options):
+        if options["round"]:
+            try:
+                rounds = [Round.objects.select_related("pool")\
+                    .get(pk=options["round"])]
+            except Round.DoesNotExist:
+                raise CommandError(f"Round \"{options['round']}\" does not "
+                    "exist.")
+        else:
+            rounds = get_ended_rounds()
+        for round in rounds:
+            count = request_met_feedback(round)
+            self.stdout.write(f"Queued {count} messages for round "
+                f"\"{round}\".")
+        self.stdout.write(self.style.SUCCESS(f"Requested feedback for "
+            f"{len(rounds)} rounds."))
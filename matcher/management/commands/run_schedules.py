@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from matcher.scheduling import run_due_schedules
+
+
+class Command(BaseCommand):
+    help = "Creates rounds and does matching for pools whose schedules are "\
+        "due. Meant to be run every minute, e.g. from cron. Syntax: python3 "\
+        "manage.py run_schedules"
+
+    def handle(self, *args, **options):
+        for run in run_due_schedules():
+            if run.succeeded:
+                self.stdout.write(self.style.SUCCESS(f"Ran \"{run}\""))
+            else:
+                self.stdout.write(
+                    self.style.ERROR(f"Failed \"{run}\": {run.error}")
+                )
@@ -0,0 +1,56 @@
+import time
+import logging
+
+from django.core.management.base import BaseCommand
+
+from matcher.delivery import dispatch_due_messages
+from matcher.models import Round
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Sends queued messages, like the messages asking for "\
+        "availability when a round is created or replies to people's "\
+        "messages, as they become due. Runs continuously unless --once is "\
+        "passed. Syntax: python3 manage.py send_queued_messages [--once]"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+            help="send the messages that are due now, then exit")
+        parser.add_argument("--batch-size", type=int, default=100,
+            help="maximum number of messages to send at a time")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                dispatched = dispatch_due_messages(options["batch_size"])
+            except Exception as exception: # see [1] in matcher/tasks.py
+                # messages stay queued until the task queue is back
+                if options["once"]:
+                    raise
+                logger.warning(f"Failed to send queued messages, retrying. "
+                    f"Error: {exception}")
+                time.sleep(1)
+                continue
+            self.report_progress(dispatched)
+            # messages over a workspace's send budget (see
+            # `settings.SLACK_SEND_RATE`) are sent on a later pass
+            if options["once"] and not dispatched:
+                break
+            # keep going immediately if there may be more messages due
+            if len(dispatched) < options["batch_size"]:
+                time.sleep(1)
+
+    def report_progress(self, dispatched):
+        """write how many messages have been sent for each round with
+        messages in `dispatched`
+        """
+        round_ids = {message.round_id for message in dispatched
+            if message.round_id}
+        for round in Round.objects.filter(pk__in=round_ids)\
+            .select_related("pool"):
+            sent, total = round.get_fanout_progress()
+            self.stdout.write(f"Sent {sent} of {total} messages for round "
+                f"\"{round}\"")
@@ -130,11 +130,51 @@ BLOCKS = {
     ]
 }
 
+class BlockTemplate:
+    """a 2-element block template from `BLOCKS`, where the first item is a
+    text block and the second item is an action block, compiled once so
+    rendering it only formats its text and block ID. rendered blocks share
+    the template's unchanging parts, like the buttons, so they mustn't be
+    mutated (`format_action_response` makes a copy)
+    """
+
+    def __init__(self, blocks):
+        self.text_block, self.action_block = blocks
+        self.text = self.text_block["text"]["text"]
+        self.block_id = self.action_block["block_id"]
+
+    def render(self, block_id, dictionary):
+        return [
+            {**self.text_block, "text": {**self.text_block["text"],
+                "text": self.text.format_map(dictionary)}},
+            {**self.action_block, "block_id": self.block_id.format(
+                id=block_id)},
+        ]
+
+
+BLOCK_TEMPLATES = {name: BlockTemplate(blocks)
+    for name, blocks in BLOCKS.items()}
+
+
 def format_block_text(block_name, block_id, dictionary):
     """Format a 2-element block where the first item is a text block and the
-    second item is an action block"""
-    # make a deep copy so we don't mutate the block template
-    block = copy.deepcopy(BLOCKS[block_name])
-    block[0]["text"]["text"] = block[0]["text"]["text"].format_map(dictionary)
-    block[1]["block_id"] = block[1]["block_id"].format(id=block_id)
-    return block
+    second item is an action block, see `BlockTemplate`"""
+    return BLOCK_TEMPLATES[block_name].render(block_id, dictionary)
+
+
+def format_action_response(message, text):
+    """Format the blocks to replace an interactive message with after someone
+    clicks one of its buttons: the original message's blocks with the action
+    blocks swapped for `text`, so the buttons can't be clicked again"""
+    blocks = [
+        block for block in copy.deepcopy(message.get("blocks", []))
+        if block.get("type") != "actions"
+    ]
+    blocks.append({
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": text
+        }
+    })
+    return blocks
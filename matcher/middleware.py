@@ -1,15 +1,67 @@
+import os
+import re
 import hmac
+import json
+import time
+import random
+import cProfile
+import contextvars
 import hashlib
 import logging
+from functools import wraps
 
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
 from django.http import JsonResponse
+from whitenoise.middleware import WhiteNoiseMiddleware
 
 from meetups import settings
+from .lookups import get_workspace
 
 
 logger = logging.getLogger(__name__)
 
 
+def get_team_id(request):
+    """get the Slack team ID a request says it's from, before it's verified,
+    so it can be verified with that workspace's signing secret. events have
+    it at the top level of their JSON body, and interactions in the "team"
+    of their "payload" form field
+    """
+    try:
+        if request.content_type == "application/json":
+            return json.loads(request.body).get("team_id")
+        return json.loads(request.POST["payload"])["team"]["id"]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def get_request_workspace(request):
+    """get the Workspace a request says it's from, or None for the default
+    workspace, see `get_workspace` in `./lookups.py`
+    """
+    team_id = get_team_id(request)
+    return get_workspace(team_id) if team_id else None
+
+
+def with_workspace(view):
+    """look up the Workspace an async view's request says it's from, as
+    `request.workspace`, before `VerifySlackRequest` verifies the request
+    with its signing secret. the lookup may query the database, which can't
+    be done in the event loop where `VerifySlackRequest` runs in front of
+    async views, so it's done here in a thread
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.workspace = await sync_to_async(get_request_workspace)(
+            request)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
 class VerifySlackRequest:
     """verify that a request came from Slack
     https://api.slack.com/docs/verifying-requests-from-slack
@@ -19,11 +71,21 @@ class VerifySlackRequest:
     # (we only want this verification on Slack views, not places like admin)
     # see: https://docs.djangoproject.com/en/2.2/ref/utils/#django.utils.decorators.decorator_from_middleware
 
+    # verification only does CPU work on the already-read request body, so
+    # it's safe to run in the event loop in front of async views
+    # https://docs.djangoproject.com/en/5.1/topics/http/middleware/#asynchronous-support
+    sync_capable = True
+    async_capable = True
+
     # added in Django 5 upgrade per fix: https://stackoverflow.com/a/55779583
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        # returns a coroutine for the caller to await if `get_response` is
+        # async
         return self.get_response(request)
     
     # https://docs.djangoproject.com/en/1.9/topics/http/middleware/#process_request
@@ -42,8 +104,17 @@ class VerifySlackRequest:
             return JsonResponse(status=400,
                 data={"error": "missing header \"X-Slack-Signature\""})
 
+        # each workspace may have its own signing secret. async views look
+        # up the workspace first, see `with_workspace`
+        if not hasattr(request, "workspace"):
+            request.workspace = get_request_workspace(request)
+        signing_secret = (request.workspace and
+            request.workspace.signing_secret) or settings.SLACK_SIGNING_SECRET
+        if not signing_secret:
+            return JsonResponse(status=403,
+                data={"error": "unknown workspace"})
         # make the signing secret a bytestring
-        signing_secret = bytes(settings.SLACK_SIGNING_SECRET, "utf-8")
+        signing_secret = bytes(signing_secret, "utf-8")
         request_body = request.body.decode('utf-8')
 
         # form the base string as stated in the Slack API docs. We need to
@@ -63,4 +134,171 @@ class VerifySlackRequest:
                 f"{base_string} Slack signature: {slack_signature}, Request "
                 f"signature: {request_signature}")
             return JsonResponse(status=403, 
-                data={"error": "request verification failed"})
\ No newline at end of file
+                data={"error": "request verification failed"})
+
+
+# (duration, SQL) of the queries run for the request being profiled in this
+# context, see `ProfileRequests`. the threads async views hand off to run in a
+# copy of the request's context, so their queries are added to the same list
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.append((time.perf_counter() - start, sql))
+
+
+def add_query_timer(connection, **kwargs):
+    """time a database connection's queries while a request is profiled"""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class ProfileRequests:
+    """record each request's wall time, database query count and time, and
+    slowest queries to the "matcher.profiling" log, flagging requests over
+    the configured budgets. optionally also saves a cProfile dump of requests
+    with the `settings.PROFILE_HEADER` header set to `settings.PROFILE_TOKEN`,
+    or a random sample of requests. only used if `settings.PROFILE_REQUESTS`
+    is on; otherwise Django removes it from the middleware chain when the
+    server starts. it runs in the event loop in front of async views, so
+    under ASGI a cProfile dump only covers the work done in the event loop,
+    not in the threads the views hand off to
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_REQUESTS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.profile_logger = logging.getLogger("matcher.profiling")
+        # queries can run on any thread's connection, e.g. in the threads
+        # async views hand off to, so time them all. connections opened
+        # later get the timer when they connect
+        connection_created.connect(add_query_timer)
+        for connection in connections.all(initialized_only=True):
+            add_query_timer(connection=connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = []
+        token = _request_queries.set(queries)
+        profiler = self.start_profiler(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+            _request_queries.reset(token)
+        self.record(request, response, elapsed, queries, profiler)
+        return response
+
+    async def __acall__(self, request):
+        queries = []
+        token = _request_queries.set(queries)
+        profiler = self.start_profiler(request)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+            _request_queries.reset(token)
+        self.record(request, response, elapsed, queries, profiler)
+        return response
+
+    def start_profiler(self, request):
+        """start and return a cProfile profiler if the request should be
+        profiled, otherwise return None
+        """
+        # the token stops anyone else from filling the disk with profiles
+        requested = settings.PROFILE_TOKEN and hmac.compare_digest(
+            request.headers.get(settings.PROFILE_HEADER, ""),
+            settings.PROFILE_TOKEN)
+        if not requested and random.random() >= settings.PROFILE_SAMPLE_RATE:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def record(self, request, response, elapsed, queries, profiler):
+        """log a request's timings, see the class docstring"""
+        db_time = sum(duration for duration, _ in queries)
+        slowest = sorted(queries, key=lambda query: query[0],
+            reverse=True)[:settings.PROFILE_SLOWEST_QUERIES]
+        over_budget = elapsed * 1000 > settings.PROFILE_TIME_BUDGET_MS or \
+            len(queries) > settings.PROFILE_QUERY_BUDGET
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "ms": round(elapsed * 1000, 1),
+            "queries": len(queries),
+            "db_ms": round(db_time * 1000, 1),
+            "slowest": [[round(duration * 1000, 1), sql[:200]]
+                for duration, sql in slowest],
+        }
+        if profiler:
+            record["profile"] = self.save_profile(profiler, request)
+        if over_budget:
+            record["over_budget"] = True
+        self.profile_logger.log(logging.WARNING if over_budget else
+            logging.INFO, json.dumps(record))
+
+    def save_profile(self, profiler, request):
+        """save a cProfile dump for a request to `settings.PROFILE_DIR`,
+        returning its path. view it with e.g. `python -m pstats <path>`
+        """
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        name = re.sub(r"[^\w-]+", "-", request.path).strip("-") or "root"
+        path = os.path.join(settings.PROFILE_DIR,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.prof")
+        profiler.dump_stats(path)
+        return path
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise's middleware, which serves static files, made to also run
+    in the event loop in front of async views, so under ASGI requests aren't
+    handed to a thread and back just to pass through it. WhiteNoise finds
+    files in a dict it builds at startup, and the file is read by the
+    response as it's sent
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # looks on disk for files added since startup, e.g. in DEBUG
+            static_file = await sync_to_async(self.find_file)(
+                request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.5 on 2026-10-19 09:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRound',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.IntegerField(help_text='ID of the Round this was archived from', unique=True)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='matcher.pool')),
+            ],
+            options={
+                'ordering': ['-start_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedMatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.IntegerField(help_text='ID of the Match this was archived from', unique=True)),
+                ('conversation_id', models.CharField(blank=True, max_length=11, null=True)),
+                ('met', models.BooleanField(null=True)),
+                ('person_1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='matcher.person')),
+                ('person_2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='matcher.person')),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='matcher.archivedround')),
+            ],
+            options={
+                'verbose_name_plural': 'archived matches',
+            },
+        ),
+        migrations.CreateModel(
+            name='PairHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('match_count', models.PositiveIntegerField(default=0, help_text='Number of archived rounds in which this pair was matched')),
+                ('met_count', models.PositiveIntegerField(default=0, help_text='Number of those matches where the pair met')),
+                ('not_met_count', models.PositiveIntegerField(default=0, help_text='Number of those matches where the pair didn’t meet. Matches that are neither met nor not met are unknown.')),
+                ('person_1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='matcher.person')),
+                ('person_2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='matcher.person')),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='matcher.pool')),
+            ],
+            options={
+                'verbose_name_plural': 'pair histories',
+                'constraints': [models.UniqueConstraint(fields=('pool', 'person_1', 'person_2'), name='unique_pair_history')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.5 on 2026-10-19 09:31
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0002_archiving'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Schedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enabled', models.BooleanField(default=True)),
+                ('interval_weeks', models.PositiveSmallIntegerField(default=1, help_text='Start a round every this many weeks, counting from the start date')),
+                ('start_date', models.DateField(default=datetime.date.today, help_text='Date from which to start scheduling rounds')),
+                ('ask_weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')], default=0, help_text='Day of the week to create a round and ask people for their availability')),
+                ('ask_time', models.TimeField(default=datetime.time(10, 0), help_text='Time to ask for availability, in the pool’s timezone')),
+                ('match_weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')], default=0, help_text='Day of the week to do matching for the round')),
+                ('match_time', models.TimeField(default=datetime.time(14, 0), help_text='Time to do matching, in the pool’s timezone. Matching happens at the first occurrence of this day and time after asking for availability.')),
+                ('round_length_days', models.PositiveSmallIntegerField(default=4, help_text='Number of days from a round’s start date to its end date')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('pool', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='matcher.pool')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScheduleRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('ask', 'Ask availability'), ('match', 'Do matching')], max_length=5)),
+                ('scheduled_for', models.DateTimeField(help_text='When this action was scheduled to run, before staggering with other pools')),
+                ('run_at', models.DateTimeField(help_text='When this action was due to run after staggering with other pools')),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('succeeded', models.BooleanField(null=True)),
+                ('error', models.TextField(blank=True)),
+                ('round', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='matcher.round')),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='matcher.schedule')),
+            ],
+            options={
+                'ordering': ['-started'],
+                'constraints': [models.UniqueConstraint(fields=('schedule', 'kind', 'scheduled_for'), name='unique_schedule_run')],
+            },
+        ),
+    ]
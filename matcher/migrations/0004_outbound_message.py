@@ -0,0 +1,34 @@
+# Generated by Django 5.1.5 on 2026-10-19 09:31
+
+import django.db.models.deletion
+import matcher.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0003_schedules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='round',
+            name='fanout_minutes',
+            field=models.PositiveIntegerField(default=matcher.models.get_default_fanout_minutes, help_text='Number of minutes over which to spread sending the messages asking for availability when this round is created, so people don’t all get (and respond to) them at once. 0 sends them as fast as the maximum sending rate allows.'),
+        ),
+        migrations.CreateModel(
+            name='OutboundMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_id', models.CharField(help_text='Slack user or channel ID to send the message to', max_length=11)),
+                ('message', models.JSONField(help_text='Keyword arguments for the Slack chat.postMessage API method, like “text” or “blocks”')),
+                ('send_after', models.DateTimeField()),
+                ('dispatched', models.DateTimeField(blank=True, help_text='When this message was handed off to be sent', null=True)),
+                ('round', models.ForeignKey(blank=True, help_text='Round whose availability fan-out this message is part of, if any', null=True, on_delete=django.db.models.deletion.CASCADE, to='matcher.round')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dispatched', 'send_after'], name='matcher_out_dispatc_3b9d23_idx')],
+            },
+        ),
+    ]
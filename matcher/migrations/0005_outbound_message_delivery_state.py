@@ -0,0 +1,44 @@
+# Generated by Django 5.1.5 on 2026-10-19 08:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0004_outbound_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='attempts',
+            field=models.IntegerField(default=0, help_text='Number of times sending this message was attempted'),
+        ),
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='delivered',
+            field=models.DateTimeField(blank=True, help_text='When Slack accepted this message', null=True),
+        ),
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='key',
+            field=models.CharField(blank=True, help_text="Identifies this message so the same message isn't queued twice", max_length=128, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='last_error',
+            field=models.TextField(blank=True, help_text='Error from the last failed attempt, if any'),
+        ),
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='purpose',
+            field=models.CharField(blank=True, help_text='What this message is for, like “availability” or “match_intro”', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='outboundmessage',
+            name='round',
+            field=models.ForeignKey(blank=True, help_text='Round this message is about, if any', null=True, on_delete=django.db.models.deletion.CASCADE, to='matcher.round'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-19 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0005_outbound_message_delivery_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='duplicates_suppressed',
+            field=models.IntegerField(default=0, help_text='Number of times this message was queued or sent again and skipped because it was already queued or delivered'),
+        ),
+        migrations.AlterField(
+            model_name='outboundmessage',
+            name='key',
+            field=models.CharField(blank=True, help_text="Idempotency key identifying this message, so the same message isn't queued or sent twice, see `get_message_key`", max_length=128, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.5 on 2026-10-19 08:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0006_outbound_message_duplicates_suppressed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(help_text='Name of the task that failed', max_length=64)),
+                ('args', models.JSONField(default=list)),
+                ('kwargs', models.JSONField(default=dict)),
+                ('error_type', models.CharField(help_text='Class name of the exception that failed the task', max_length=128)),
+                ('error', models.TextField(blank=True)),
+                ('failed', models.DateTimeField(auto_now_add=True)),
+                ('replayed', models.DateTimeField(blank=True, help_text='When this task was last replayed, if ever', null=True)),
+                ('replay_count', models.IntegerField(default=0)),
+                ('match', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='matcher.match')),
+                ('outbound_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='matcher.outboundmessage')),
+                ('pool', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='matcher.pool')),
+                ('round', models.ForeignKey(blank=True, help_text='Round the failed task was about, if any', null=True, on_delete=django.db.models.deletion.SET_NULL, to='matcher.round')),
+            ],
+            options={
+                'verbose_name_plural': 'failed deliveries',
+                'ordering': ['-failed'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-19 08:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0007_failed_delivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoundPhase',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the phase, like “member_sync” or “dm_opening”', max_length=32)),
+                ('started', models.DateTimeField(help_text='When the first span of this phase started')),
+                ('finished', models.DateTimeField(help_text='When the last span of this phase finished')),
+                ('span_count', models.IntegerField(default=0, help_text='Number of spans of work recorded, e.g. one per match for opening match conversations')),
+                ('busy_seconds', models.FloatField(default=0, help_text="Total time spent in this phase's spans")),
+                ('query_count', models.IntegerField(default=0)),
+                ('slack_calls', models.IntegerField(default=0)),
+                ('retries', models.IntegerField(default=0)),
+                ('errors', models.IntegerField(default=0)),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='matcher.round')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('round', 'name'), name='unique_round_phase')],
+            },
+        ),
+    ]
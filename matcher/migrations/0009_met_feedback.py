@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-19 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0008_round_phase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='cancelled',
+            field=models.DateTimeField(blank=True, help_text='When this message was cancelled before it was sent, e.g. because the question it asks was already answered', null=True),
+        ),
+        migrations.AddField(
+            model_name='round',
+            name='met_feedback_requested',
+            field=models.DateTimeField(blank=True, help_text='When people in this round who hadn’t said whether they met their match were asked, after the round ended. see the `request_met_feedback` command', null=True),
+        ),
+    ]
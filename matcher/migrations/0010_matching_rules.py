@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-19 08:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0009_met_feedback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='attributes',
+            field=models.JSONField(blank=True, default=dict, help_text='Attributes used by pools’ matching rules, like {"team": "Payments", "office": "NYC"}. A list of values, like {"team": ["Payments", "Risk"]}, counts as each of them.'),
+        ),
+        migrations.CreateModel(
+            name='MatchingRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attribute', models.CharField(help_text='Name of the attribute in people’s attributes, like “team”', max_length=64)),
+                ('kind', models.CharField(choices=[('avoid_same', 'Don’t pair people with the same value'), ('prefer_different', 'Prefer pairing people with different values')], default='avoid_same', help_text='“Don’t pair” is only broken if there’s no one else left to pair someone with. “Prefer” is broken whenever pairing someone with a person with a different value would mean pairing them with someone they’ve been paired with before.', max_length=16)),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='matcher.pool')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('pool', 'attribute'), name='unique_matching_rule')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-19 08:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0010_matching_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poolmembership',
+            name='rounds_since_excluded',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of rounds in this pool someone else has been left out of, because there were an odd number of people, since this person was last left out. Empty if they’ve never been left out. The person who was left out longest ago is left out next.', null=True),
+        ),
+        migrations.AddField(
+            model_name='round',
+            name='excluded',
+            field=models.ForeignKey(blank=True, help_text='The person left out of this round because there were an odd number of people', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='excluded_rounds', to='matcher.person'),
+        ),
+        migrations.AddIndex(
+            model_name='poolmembership',
+            index=models.Index(fields=['pool', 'available', 'rounds_since_excluded'], name='pool_membership_exclusion'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.5 on 2026-10-19 08:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0011_odd_person_exclusion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Workspace',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('team_id', models.CharField(help_text='Slack team ID, like “T0123ABCD”, which Slack sends with every request from the workspace', max_length=16, unique=True)),
+                ('api_token', models.CharField(help_text='Bot user OAuth token from the app’s “OAuth & Permissions” page for this workspace', max_length=255)),
+                ('signing_secret', models.CharField(blank=True, help_text='Signing secret of the Slack app installed in this workspace. Leave empty if it’s the same app as the SLACK_SIGNING_SECRET setting.', max_length=255)),
+                ('admin_user_id', models.CharField(blank=True, help_text='Slack user ID of the admin people in this workspace should reach out to. Leave empty to use the ADMIN_SLACK_USER_ID setting.', max_length=11)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='workspace',
+            field=models.ForeignKey(blank=True, help_text='Slack workspace to send the message in, or empty for the workspace in the SLACK_API_TOKEN setting', null=True, on_delete=django.db.models.deletion.CASCADE, to='matcher.workspace'),
+        ),
+        migrations.AddField(
+            model_name='pool',
+            name='workspace',
+            field=models.ForeignKey(blank=True, help_text='Slack workspace the channel is in. Leave empty for the workspace in the SLACK_API_TOKEN setting.', null=True, on_delete=django.db.models.deletion.PROTECT, to='matcher.workspace'),
+        ),
+        migrations.AddIndex(
+            model_name='outboundmessage',
+            index=models.Index(fields=['workspace', 'dispatched', 'send_after'], name='outbound_message_workspace'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-19 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0012_workspaces'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='round',
+            name='excluded_rounds_since_excluded',
+            field=models.PositiveIntegerField(blank=True, help_text="How many rounds it had been since the excluded person was last excluded, before this round, so it can be restored if they're matched in this round after all", null=True),
+        ),
+    ]
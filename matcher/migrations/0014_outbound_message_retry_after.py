@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-19 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0013_round_excluded_rounds_since_excluded'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='retry_after',
+            field=models.DateTimeField(blank=True, help_text='When to try sending this message again after the last failed attempt, if any', null=True),
+        ),
+    ]
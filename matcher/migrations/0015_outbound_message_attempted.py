@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-19 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0014_outbound_message_retry_after'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='attempted',
+            field=models.DateTimeField(blank=True, help_text='When the last attempt to send this message started', null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.5 on 2026-10-19 09:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matcher', '0015_outbound_message_attempted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedround',
+            name='excluded',
+            field=models.ForeignKey(blank=True, help_text='The person left out of this round because there were an odd number of people', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='excluded_archived_rounds', to='matcher.person'),
+        ),
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='archived_round',
+            field=models.ForeignKey(blank=True, help_text='Archived round this message was about, if its round was archived', null=True, on_delete=django.db.models.deletion.CASCADE, to='matcher.archivedround'),
+        ),
+        migrations.AddField(
+            model_name='roundphase',
+            name='archived_round',
+            field=models.ForeignKey(blank=True, help_text='Archived round this phase was part of, if its round was archived', null=True, on_delete=django.db.models.deletion.CASCADE, to='matcher.archivedround'),
+        ),
+        migrations.AlterField(
+            model_name='roundphase',
+            name='round',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='matcher.round'),
+        ),
+    ]
@@ -1,13 +1,16 @@
-from datetime import date, timedelta
+from datetime import date, time, timedelta
 import logging
 import pytz
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.db.models.signals import post_save
+from django.utils import timezone
 
 import matcher.messages as messages
-from .tasks import client, send_msg, open_match_dm
+from meetups import settings
 from .constants import QUESTIONS
+from .tracing import trace, record_span
 
 
 logger = logging.getLogger(__name__)
@@ -21,17 +24,68 @@ def get_default_end_date():
     return date.today() + timedelta(days=4)
 
 
+def get_default_fanout_minutes():
+    """get the default number of minutes over which to spread a Round's
+    availability messages
+    """
+    return settings.AVAILABILITY_FANOUT_MINUTES
+
+
 def handle_match_save(sender, instance, created, **kwargs):
     """helper function to call `open_match_dm.delay` with the right arguments
     """
+    # import within the function so that importing the models (e.g. for every
+    # management command) doesn't also import Celery
+    from .tasks import open_match_dm
     if created:
-        open_match_dm.delay(instance.pk)
+        # matches are often made in a transaction, so wait for it to commit,
+        # otherwise the task can run before the match is visible to it
+        match_id = instance.pk
+        transaction.on_commit(lambda: open_match_dm.delay(match_id))
+
+
+class Workspace(models.Model):
+    """a Slack workspace the bot is installed in, with its own credentials,
+    so one deployment can serve several workspaces. Pools without a
+    workspace use the SLACK_API_TOKEN, SLACK_SIGNING_SECRET and
+    ADMIN_SLACK_USER_ID settings
+    """
+    name = models.CharField(max_length=64, unique=True)
+    team_id = models.CharField(max_length=16, unique=True)
+    team_id.help_text = "Slack team ID, like “T0123ABCD”, which Slack sends "\
+        "with every request from the workspace"
+    api_token = models.CharField(max_length=255)
+    api_token.help_text = "Bot user OAuth token from the app’s “OAuth & "\
+        "Permissions” page for this workspace"
+    signing_secret = models.CharField(max_length=255, blank=True)
+    signing_secret.help_text = "Signing secret of the Slack app installed in"\
+        " this workspace. Leave empty if it’s the same app as the "\
+        "SLACK_SIGNING_SECRET setting."
+    admin_user_id = models.CharField(max_length=11, blank=True)
+    admin_user_id.help_text = "Slack user ID of the admin people in this "\
+        "workspace should reach out to. Leave empty to use the "\
+        "ADMIN_SLACK_USER_ID setting."
+
+    def __str__(self):
+        return self.name
+
+
+def get_admin_user_id(workspace):
+    """get the Slack user ID of the admin for a Workspace, or the default
+    admin if `workspace` is None or doesn't have its own
+    """
+    return (workspace and workspace.admin_user_id) or \
+        settings.ADMIN_SLACK_USER_ID
 
 
 class Pool(models.Model):
     """a group of People in a Slack channel who are interested in meeting each
     other
     """
+    workspace = models.ForeignKey(Workspace, on_delete=models.PROTECT,
+        null=True, blank=True)
+    workspace.help_text = "Slack workspace the channel is in. Leave empty "\
+        "for the workspace in the SLACK_API_TOKEN setting."
     name = models.CharField(max_length=64, unique=True)
     name.help_text = "A human-readable name for this pool, like “2020 "\
         "interns”"
@@ -101,6 +155,10 @@ class Person(models.Model):
         null=True, blank=True)
     last_query.help_text = "The last question the bot asked the user, so "\
         "when they reply we know what question they responded to."
+    attributes = models.JSONField(default=dict, blank=True)
+    attributes.help_text = "Attributes used by pools’ matching rules, like "\
+        "{\"team\": \"Payments\", \"office\": \"NYC\"}. A list of values, "\
+        "like {\"team\": [\"Payments\", \"Risk\"]}, counts as each of them."
 
     class Meta:
         verbose_name_plural = "people"
@@ -135,11 +193,59 @@ class PoolMembership(models.Model):
     available = models.BooleanField(null=True) # null corresponds to unknown
     available.help_text = "Whether or not this person is available to be "\
         "paired with someone in this pool"
+    rounds_since_excluded = models.PositiveIntegerField(null=True,
+        blank=True)
+    rounds_since_excluded.help_text = "Number of rounds in this pool "\
+        "someone else has been left out of, because there were an odd "\
+        "number of people, since this person was last left out. Empty if "\
+        "they’ve never been left out. The person who was left out longest "\
+        "ago is left out next."
+
+    class Meta:
+        indexes = [
+            # for choosing who to leave out of a round, see
+            # `get_person_to_exclude` in `./admin.py`
+            models.Index(fields=["pool", "available", "rounds_since_excluded"],
+                name="pool_membership_exclusion"),
+        ]
 
     def __str__(self):
         return f"{self.person} in {self.pool}"
 
 
+class MatchingRule(models.Model):
+    """a rule for who's paired with whom in a Pool, based on an attribute in
+    People's `attributes`, like "never pair people on the same team". see
+    `compile_constraints` in `./pairing.py`
+    """
+    AVOID_SAME = "avoid_same"
+    PREFER_DIFFERENT = "prefer_different"
+    KIND_CHOICES = [
+        (AVOID_SAME, "Don’t pair people with the same value"),
+        (PREFER_DIFFERENT, "Prefer pairing people with different values"),
+    ]
+    pool = models.ForeignKey(Pool, on_delete=models.CASCADE)
+    attribute = models.CharField(max_length=64)
+    attribute.help_text = "Name of the attribute in people’s attributes, "\
+        "like “team”"
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES,
+        default=AVOID_SAME)
+    kind.help_text = "“Don’t pair” is only broken if there’s no one else "\
+        "left to pair someone with. “Prefer” is broken whenever pairing "\
+        "someone with a person with a different value would mean pairing "\
+        "them with someone they’ve been paired with before."
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["pool", "attribute"],
+                name="unique_matching_rule"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for “{self.attribute}” in "\
+            f"{self.pool}"
+
+
 class Round(models.Model):
     """a time interval for a Pool in which specific People are paired together
     in a Match to meet each other
@@ -147,6 +253,25 @@ class Round(models.Model):
     pool = models.ForeignKey(Pool, on_delete=models.CASCADE)
     start_date = models.DateField(default=date.today)
     end_date = models.DateField(default=get_default_end_date)
+    fanout_minutes = models.PositiveIntegerField(
+        default=get_default_fanout_minutes)
+    fanout_minutes.help_text = "Number of minutes over which to spread "\
+        "sending the messages asking for availability when this round is "\
+        "created, so people don’t all get (and respond to) them at once. 0 "\
+        "sends them as fast as the maximum sending rate allows."
+    met_feedback_requested = models.DateTimeField(null=True, blank=True)
+    met_feedback_requested.help_text = "When people in this round who "\
+        "hadn’t said whether they met their match were asked, after the "\
+        "round ended. see the `request_met_feedback` command"
+    excluded = models.ForeignKey(Person, on_delete=models.SET_NULL,
+        null=True, blank=True, related_name="excluded_rounds")
+    excluded.help_text = "The person left out of this round because there "\
+        "were an odd number of people"
+    excluded_rounds_since_excluded = models.PositiveIntegerField(null=True,
+        blank=True)
+    excluded_rounds_since_excluded.help_text = "How many rounds it had been "\
+        "since the excluded person was last excluded, before this round, so "\
+        "it can be restored if they're matched in this round after all"
 
     class Meta:
         ordering = ["-start_date"]
@@ -154,8 +279,26 @@ class Round(models.Model):
     def save(self, *args, **kwargs):
         if not self.pk:
             # automatically ask availability when a round is created
-            ask_availability(self)
-        super(Round, self).save(*args, **kwargs)
+            with trace("member_sync") as member_sync:
+                outbound_messages = ask_availability(self)
+            # save the round and queue its messages together, so the messages
+            # are only sent if the round is saved
+            with transaction.atomic():
+                super(Round, self).save(*args, **kwargs)
+                queue_fanout(self, outbound_messages)
+            record_span(self.pk, member_sync)
+        else:
+            super(Round, self).save(*args, **kwargs)
+
+    def get_fanout_progress(self):
+        """return a tuple of (number of messages sent, total number of
+        messages) for this round's availability fan-out
+        """
+        progress = OutboundMessage.objects.filter(round=self,
+            purpose__in=("availability", "welcome", "missing_name")).aggregate(
+            sent=models.Count("pk", filter=models.Q(dispatched__isnull=False)),
+            total=models.Count("pk"))
+        return (progress["sent"], progress["total"])
 
     def __str__(self):
         # example: "Monday, Jan 9, 2019"
@@ -188,11 +331,389 @@ class Match(models.Model):
 post_save.connect(handle_match_save, sender=Match)
 
 
+class OutboundMessage(models.Model):
+    """a Slack message queued to be sent at or after `send_after`. messages
+    are queued in the same database transaction as the change they're about
+    (see `queue_message`), and the `send_queued_messages` command hands them
+    off to the `send_msg` task as they become due. this means a message isn't
+    lost if the task queue is down, and sending resumes where it left off
+    after a restart
+    """
+    round = models.ForeignKey(Round, on_delete=models.CASCADE, null=True,
+        blank=True)
+    round.help_text = "Round this message is about, if any"
+    archived_round = models.ForeignKey("ArchivedRound",
+        on_delete=models.CASCADE, null=True, blank=True)
+    archived_round.help_text = "Archived round this message was about, if "\
+        "its round was archived"
+    workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE,
+        null=True, blank=True)
+    workspace.help_text = "Slack workspace to send the message in, or empty"\
+        " for the workspace in the SLACK_API_TOKEN setting"
+    purpose = models.CharField(max_length=32, blank=True)
+    purpose.help_text = "What this message is for, like “availability” or "\
+        "“match_intro”"
+    key = models.CharField(max_length=128, null=True, blank=True,
+        unique=True)
+    key.help_text = "Idempotency key identifying this message, so the same "\
+        "message isn't queued or sent twice, see `get_message_key`"
+    channel_id = models.CharField(max_length=11)
+    channel_id.help_text = "Slack user or channel ID to send the message to"
+    message = models.JSONField()
+    message.help_text = "Keyword arguments for the Slack chat.postMessage "\
+        "API method, like “text” or “blocks”"
+    send_after = models.DateTimeField()
+    dispatched = models.DateTimeField(null=True, blank=True)
+    dispatched.help_text = "When this message was handed off to be sent"
+    attempts = models.IntegerField(default=0)
+    attempts.help_text = "Number of times sending this message was attempted"
+    attempted = models.DateTimeField(null=True, blank=True)
+    attempted.help_text = "When the last attempt to send this message started"
+    last_error = models.TextField(blank=True)
+    last_error.help_text = "Error from the last failed attempt, if any"
+    retry_after = models.DateTimeField(null=True, blank=True)
+    retry_after.help_text = "When to try sending this message again after "\
+        "the last failed attempt, if any"
+    delivered = models.DateTimeField(null=True, blank=True)
+    delivered.help_text = "When Slack accepted this message"
+    duplicates_suppressed = models.IntegerField(default=0)
+    duplicates_suppressed.help_text = "Number of times this message was "\
+        "queued or sent again and skipped because it was already queued or "\
+        "delivered"
+    cancelled = models.DateTimeField(null=True, blank=True)
+    cancelled.help_text = "When this message was cancelled before it was "\
+        "sent, e.g. because the question it asks was already answered"
+
+    class Meta:
+        indexes = [
+            # used to find the next messages due to be sent
+            models.Index(fields=["dispatched", "send_after"]),
+            # and the next ones in each workspace, see
+            # `dispatch_due_messages` in `./delivery.py`
+            models.Index(fields=["workspace", "dispatched", "send_after"],
+                name="outbound_message_workspace"),
+        ]
+
+    def get_key(self):
+        """get this message's idempotency key, which is unique to this
+        message if it wasn't queued with one
+        """
+        return self.key or f"message-{self.pk}"
+
+    def __str__(self):
+        return f"Message to {self.channel_id} after {self.send_after}"
+
+
+class RoundPhase(models.Model):
+    """how long a phase of a Round, like syncing members or opening match
+    conversations, took and what it did, totalled across every span of work
+    recorded for the phase, see `matcher/tracing.py`
+    """
+    round = models.ForeignKey(Round, on_delete=models.CASCADE, null=True,
+        blank=True)
+    archived_round = models.ForeignKey("ArchivedRound",
+        on_delete=models.CASCADE, null=True, blank=True)
+    archived_round.help_text = "Archived round this phase was part of, if "\
+        "its round was archived"
+    name = models.CharField(max_length=32)
+    name.help_text = "Name of the phase, like “member_sync” or “dm_opening”"
+    started = models.DateTimeField()
+    started.help_text = "When the first span of this phase started"
+    finished = models.DateTimeField()
+    finished.help_text = "When the last span of this phase finished"
+    span_count = models.IntegerField(default=0)
+    span_count.help_text = "Number of spans of work recorded, e.g. one per "\
+        "match for opening match conversations"
+    busy_seconds = models.FloatField(default=0)
+    busy_seconds.help_text = "Total time spent in this phase's spans"
+    query_count = models.IntegerField(default=0)
+    slack_calls = models.IntegerField(default=0)
+    retries = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["round", "name"],
+                name="unique_round_phase"),
+        ]
+
+    def __str__(self):
+        return f"{self.round}: {self.name}"
+
+
+class FailedDelivery(models.Model):
+    """a Celery task which sends to Slack, like `send_msg` or
+    `open_match_dm`, that failed after using up its retries, kept so it can
+    be replayed with the `replay_failed` command or from the admin
+    """
+    task = models.CharField(max_length=64)
+    task.help_text = "Name of the task that failed"
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    outbound_message = models.ForeignKey(OutboundMessage,
+        on_delete=models.SET_NULL, null=True, blank=True)
+    match = models.ForeignKey(Match, on_delete=models.SET_NULL, null=True,
+        blank=True)
+    round = models.ForeignKey(Round, on_delete=models.SET_NULL, null=True,
+        blank=True)
+    round.help_text = "Round the failed task was about, if any"
+    pool = models.ForeignKey(Pool, on_delete=models.SET_NULL, null=True,
+        blank=True)
+    error_type = models.CharField(max_length=128)
+    error_type.help_text = "Class name of the exception that failed the task"
+    error = models.TextField(blank=True)
+    failed = models.DateTimeField(auto_now_add=True)
+    replayed = models.DateTimeField(null=True, blank=True)
+    replayed.help_text = "When this task was last replayed, if ever"
+    replay_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["-failed"]
+        verbose_name_plural = "failed deliveries"
+
+    def __str__(self):
+        return f"{self.task} failed at {self.failed}: {self.error_type}"
+
+
+class ArchivedRound(models.Model):
+    """a Round older than the archival horizon, moved out of the Round table
+    by `matcher.archive.archive_rounds`
+    """
+    original_id = models.IntegerField(unique=True)
+    original_id.help_text = "ID of the Round this was archived from"
+    pool = models.ForeignKey(Pool, on_delete=models.CASCADE)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    excluded = models.ForeignKey(Person, on_delete=models.SET_NULL,
+        null=True, blank=True, related_name="excluded_archived_rounds")
+    excluded.help_text = "The person left out of this round because there "\
+        "were an odd number of people"
+
+    class Meta:
+        ordering = ["-start_date"]
+
+    def __str__(self):
+        return f"{self.pool}: {self.start_date} – {self.end_date} (archived)"
+
+
+class ArchivedMatch(models.Model):
+    """the raw row of a Match from an ArchivedRound. Not used for matching or
+    stats, which use PairHistory instead
+    """
+    original_id = models.IntegerField(unique=True)
+    original_id.help_text = "ID of the Match this was archived from"
+    round = models.ForeignKey(ArchivedRound, on_delete=models.CASCADE)
+    person_1 = models.ForeignKey(Person, on_delete=models.CASCADE,
+        related_name="+")
+    person_2 = models.ForeignKey(Person, on_delete=models.CASCADE,
+        related_name="+")
+    conversation_id = models.CharField(max_length=11, null=True, blank=True)
+    met = models.BooleanField(null=True)
+
+    class Meta:
+        verbose_name_plural = "archived matches"
+
+    def __str__(self):
+        return f"{self.person_1} ↔ {self.person_2} for round "\
+            f"“{self.round}”"
+
+
+class PairHistory(models.Model):
+    """summary of all archived Matches between two People in a Pool.
+    `person_1` is always the Person with the lower ID
+    """
+    pool = models.ForeignKey(Pool, on_delete=models.CASCADE)
+    person_1 = models.ForeignKey(Person, on_delete=models.CASCADE,
+        related_name="+")
+    person_2 = models.ForeignKey(Person, on_delete=models.CASCADE,
+        related_name="+")
+    match_count = models.PositiveIntegerField(default=0)
+    match_count.help_text = "Number of archived rounds in which this pair "\
+        "was matched"
+    met_count = models.PositiveIntegerField(default=0)
+    met_count.help_text = "Number of those matches where the pair met"
+    not_met_count = models.PositiveIntegerField(default=0)
+    not_met_count.help_text = "Number of those matches where the pair "\
+        "didn’t meet. Matches that are neither met nor not met are unknown."
+
+    class Meta:
+        verbose_name_plural = "pair histories"
+        constraints = [
+            models.UniqueConstraint(fields=["pool", "person_1", "person_2"],
+                name="unique_pair_history"),
+        ]
+
+    def __str__(self):
+        return f"{self.person_1} ↔ {self.person_2} in {self.pool}"
+
+
+class Schedule(models.Model):
+    """when to automatically create Rounds and do matching for a Pool, in the
+    Pool's timezone. see `matcher/scheduling.py`
+    """
+    WEEKDAY_CHOICES = [
+        (0, "Monday"),
+        (1, "Tuesday"),
+        (2, "Wednesday"),
+        (3, "Thursday"),
+        (4, "Friday"),
+        (5, "Saturday"),
+        (6, "Sunday"),
+    ]
+    pool = models.OneToOneField(Pool, on_delete=models.CASCADE)
+    enabled = models.BooleanField(default=True)
+    interval_weeks = models.PositiveSmallIntegerField(default=1)
+    interval_weeks.help_text = "Start a round every this many weeks, "\
+        "counting from the start date"
+    start_date = models.DateField(default=date.today)
+    start_date.help_text = "Date from which to start scheduling rounds"
+    ask_weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES,
+        default=0)
+    ask_weekday.help_text = "Day of the week to create a round and ask "\
+        "people for their availability"
+    ask_time = models.TimeField(default=time(10))
+    ask_time.help_text = "Time to ask for availability, in the pool’s "\
+        "timezone"
+    match_weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES,
+        default=0)
+    match_weekday.help_text = "Day of the week to do matching for the round"
+    match_time = models.TimeField(default=time(14))
+    match_time.help_text = "Time to do matching, in the pool’s timezone. "\
+        "Matching happens at the first occurrence of this day and time after "\
+        "asking for availability."
+    round_length_days = models.PositiveSmallIntegerField(default=4)
+    round_length_days.help_text = "Number of days from a round’s start "\
+        "date to its end date"
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Schedule for {self.pool}"
+
+
+class ScheduleRun(models.Model):
+    """a record of a scheduled action (asking availability or matching) for a
+    Schedule, which also prevents running the same action twice
+    """
+    KIND_CHOICES = [
+        ("ask", "Ask availability"),
+        ("match", "Do matching"),
+    ]
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    scheduled_for = models.DateTimeField()
+    scheduled_for.help_text = "When this action was scheduled to run, before "\
+        "staggering with other pools"
+    run_at = models.DateTimeField()
+    run_at.help_text = "When this action was due to run after staggering "\
+        "with other pools"
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    succeeded = models.BooleanField(null=True) # null while running
+    error = models.TextField(blank=True)
+    round = models.ForeignKey(Round, on_delete=models.SET_NULL, null=True,
+        blank=True)
+
+    class Meta:
+        ordering = ["-started"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["schedule", "kind", "scheduled_for"],
+                name="unique_schedule_run"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.schedule.pool} at "\
+            f"{self.scheduled_for}"
+
+
+def get_message_key(purpose, channel_id, round=None, match=None):
+    """get the idempotency key for a message with `purpose` to `channel_id`
+    about a Round or Match, so the same message about the same round or match
+    to the same person always has the same key. returns None for messages
+    which aren't about a round or match, like replies to people's messages
+    """
+    if match:
+        about = f"match-{match.pk}"
+    elif round:
+        about = f"round-{round.pk}"
+    else:
+        return None
+    return f"{purpose}:{about}:{channel_id}"
+
+
+def queue_message(channel_id, purpose, round=None, match=None,
+                  workspace=None, **kwargs):
+    """queue a Slack message to `channel_id` to be sent as soon as possible.
+    call this in the same transaction as the change the message is about, so
+    the message is only sent if the change is saved. the message is sent in
+    `workspace`, or the workspace of the round's (or match's round's) pool
+    if not passed. `kwargs` are keyword arguments for chat.postMessage.
+    returns the OutboundMessage, or None if the same message (see
+    `get_message_key`) was already queued
+    """
+    key = get_message_key(purpose, channel_id, round=round, match=match)
+    round = round or (match and match.round)
+    workspace_id = workspace.pk if workspace else \
+        (round and round.pool.workspace_id)
+    try:
+        # use a savepoint so a duplicate doesn't break the caller's
+        # transaction
+        with transaction.atomic():
+            return OutboundMessage.objects.create(channel_id=channel_id,
+                purpose=purpose, round=round, workspace_id=workspace_id,
+                key=key, message=kwargs, send_after=timezone.now())
+    except IntegrityError:
+        OutboundMessage.objects.filter(key=key)\
+            .update(duplicates_suppressed=F("duplicates_suppressed") + 1)
+        logger.info(f"Skipped queueing duplicate message \"{key}\".")
+        return None
+
+
+def get_fanout_interval(count, minutes):
+    """get the time between sending each of `count` messages spread evenly
+    over `minutes`, but no faster than `settings.AVAILABILITY_FANOUT_RATE`
+    messages per second
+    """
+    return max(timedelta(minutes=minutes) / count,
+        timedelta(seconds=1 / settings.AVAILABILITY_FANOUT_RATE))
+
+
+def queue_fanout(round, outbound_messages):
+    """queue a Round's (channel ID, purpose, message keyword arguments)
+    messages to be sent evenly spaced over its `fanout_minutes`, but no faster than
+    `settings.AVAILABILITY_FANOUT_RATE` messages per second
+    """
+    if not outbound_messages:
+        return
+    start = timezone.now()
+    interval = get_fanout_interval(len(outbound_messages),
+        round.fanout_minutes)
+    OutboundMessage.objects.bulk_create((
+        OutboundMessage(round=round, channel_id=channel_id, purpose=purpose,
+            workspace_id=round.pool.workspace_id,
+            key=get_message_key(purpose, channel_id, round=round),
+            message=message, send_after=start + index * interval)
+        for index, (channel_id, purpose, message)
+        in enumerate(outbound_messages)
+    ), batch_size=500)
+    logger.info(f"Queued {len(outbound_messages)} messages for round "
+        f"\"{round}\", to be sent over "
+        f"{interval * len(outbound_messages)}.")
+
+
 def ask_availability(round):
-    """message all members of a Round's Pool to ask if they're available for
-    the upcoming round, adding and removing Pool members based on the current
-    Slack channel membership
+    """ask all members of a Round's Pool if they're available for the
+    upcoming round, adding and removing Pool members based on the current
+    Slack channel membership. returns a list of (channel ID, purpose, message
+    keyword arguments) to send, see `queue_fanout`
     """
+    # import within the function, see `handle_match_save`
+    from .tasks import get_client
+    outbound_messages = []
+
+    def queue_msg(channel_id, purpose, **kwargs):
+        """add a message to the list of messages to send"""
+        outbound_messages.append((channel_id, purpose, kwargs))
 
     def send_availability_question(person, pool):
         """actually send a direct message to ask if a person is available"""
@@ -201,14 +722,12 @@ def ask_availability(round):
             pool.id,
             {"person": person, "pool": pool}
         )
-        send_msg.delay(person.user_id, blocks=blocks)
-        # clear any existing last query because this field is only used for
-        # text-based queries, not block-based queries
-        person.last_query = None
-        person.save()
+        queue_msg(person.user_id, "availability", blocks=blocks)
     
     pool = round.pool
-    channel_members = get_channel_members(pool.channel_id)
+    # set for constant-time membership checks below
+    channel_members = set(get_channel_members(pool.channel_id,
+        workspace=pool.workspace))
     # Get the People in the DB for this Pool, excluding anyone who hasn't
     # written an intro yet. We're considering them excluded, partially for
     # technical reasons: We don't currently keep track of the last message
@@ -218,18 +737,22 @@ def ask_availability(round):
     # reasons: it seems reasonable that someone who didn't respond to the
     # bot's initial query is not interested enough to participate.
     people = Person.objects.filter(pools=pool).exclude(intro="")
+    # initially set everyone's availability to unknown (None). this and the
+    # other writes in this function are single statements rather than a save
+    # per person, so no write holds the database lock for long
+    PoolMembership.objects.filter(pool=pool, person__in=people)\
+        .update(available=None)
+    departed_ids = []
     for person in people:
-        # initially set everyone's availability to unknown (None)
-        pool_membership = PoolMembership.objects.get(person=person, pool=pool)
-        pool_membership.available = None
-        pool_membership.save()
         # if this person has left this pool, update the database to reflect
         # this and don't send them a request for availability
         if person.user_id not in channel_members:
-            person.pools.remove(pool)
+            departed_ids.append(person.pk)
             logger.info(f"Removed {person} from pool \"{pool}\".")
         else:
             send_availability_question(person, pool)
+    PoolMembership.objects.filter(pool=pool, person__in=departed_ids)\
+        .delete()
     for user_id in channel_members:
         try:
             person = Person.objects.get(user_id=user_id)
@@ -241,18 +764,18 @@ def ask_availability(round):
                 if person.has_intro():
                     send_availability_question(person, pool)
                 else:
-                    send_msg.delay(user_id,
+                    queue_msg(user_id, "welcome",
                         text=messages.WELCOME_INTRO.format(person=person,
                         pool=pool))
-                    person.last_query = QUESTIONS["add_intro"]
-                    person.save()
+                    Person.objects.filter(pk=person.pk)\
+                        .update(last_query=QUESTIONS["add_intro"])
         # if a person has joined the pool, create a Person in the database and
         # ask them to introduce themselves
         except Person.DoesNotExist:
             # get the user's Slack profile
             # https://api.slack.com/methods/users.info
             try:
-                user = client.users_info(user=user_id)
+                user = get_client(pool.workspace).users_info(user=user_id)
             except Exception as exception: # see note [1] in ./tasks.py
                 logger.error(f"Failed to retrieve Slack user info and create "
                     f"Person for new user ID:  {user_id}. Error: {exception}."
@@ -265,32 +788,42 @@ def ask_availability(round):
                 # keys on "profile" are not guaranteed to exist
                 full_name = user["user"]["profile"]["real_name"]
             except KeyError:
-                send_msg.delay(user_id, text=messages.PERSON_MISSING_NAME)
+                queue_msg(user_id, "missing_name",
+                    text=messages.PERSON_MISSING_NAME)
                 logger.warning("Slack \"real_name\" field missing for user: "
                     f"{user_id}")
                 continue
             person = Person(user_id=user_id, user_name=user["user"]["name"],
                 full_name=full_name,
-                casual_name=Person.get_first_name(full_name))
+                casual_name=Person.get_first_name(full_name),
+                last_query=QUESTIONS["add_intro"])
             person.save()
             PoolMembership.objects.create(person=person, pool=pool)
             logger.info(f"Added {person} to pool \"{pool}\".")
-            send_msg.delay(user_id,
+            queue_msg(user_id, "welcome",
                 text=messages.WELCOME_INTRO.format(person=person, pool=pool))
-            person.last_query = QUESTIONS["add_intro"]
-            person.save()
-    logger.info(f"Sent messages to ask availability for round \"{round}\".")
-
-
-def get_channel_members(channel_id, limit=200):
-    """get members from a Slack channel, using pagination as necessary
+    # clear any existing last query for everyone who was asked (all current
+    # members with an intro) because this field is only used for text-based
+    # queries, not block-based queries
+    Person.objects.filter(pools=pool).exclude(intro="")\
+        .update(last_query=None)
+    logger.info(f"Prepared messages to ask availability for round "
+        f"\"{round}\".")
+    return outbound_messages
+
+
+def get_channel_members(channel_id, limit=200, workspace=None):
+    """get members from a Slack channel in a Workspace (or the default
+    workspace), using pagination as necessary
     """
+    # import within the function, see `handle_match_save`
+    from .tasks import get_client
     members = []
     cursor = ""
     while True:
         # https://api.slack.com/methods/conversations.members
-        response = client.conversations_members(channel=channel_id,
-            cursor=cursor, limit=limit)
+        response = get_client(workspace).conversations_members(
+            channel=channel_id, cursor=cursor, limit=limit)
         members += response.get("members", [])
         cursor = response.get("response_metadata", {}).get("next_cursor")
         if not cursor:
@@ -0,0 +1,192 @@
+"""pairing people for matching, see `create_matches` and
+`create_sharded_matches` in `./admin.py`. these functions work on plain
+Person IDs and don't use the database, so shards can be paired in separate
+processes
+"""
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+# the kinds of `MatchingRule`, duplicated here so this module doesn't import
+# the models
+AVOID_SAME = "avoid_same"
+PREFER_DIFFERENT = "prefer_different"
+
+
+def compile_constraints(attributes, rules):
+    """compile People's attributes and a pool's matching rules into bitmasks
+    for `pair_people`. `attributes` is a dict of Person ID -> dict of
+    attribute -> value (or list of values), and `rules` is a list of
+    (attribute, kind) for the pool's `MatchingRule`s. each (attribute, value)
+    gets its own bit, so two people share a value for any of the rules of a
+    kind exactly when their masks for that kind have a bit in common, which
+    is a single AND however many rules and values there are. returns a tuple
+    of dicts of Person ID -> mask, for the "avoid same" and "prefer
+    different" rules. people without any of the attributes aren't included
+    """
+    bits = {}
+    masks = {AVOID_SAME: {}, PREFER_DIFFERENT: {}}
+    for person_id, person_attributes in attributes.items():
+        for attribute, kind in rules:
+            values = person_attributes.get(attribute)
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                if value is None or value == "":
+                    continue
+                bit = bits.setdefault((attribute, str(value)), 1 << len(bits))
+                masks[kind][person_id] = masks[kind].get(person_id, 0) | bit
+    return masks[AVOID_SAME], masks[PREFER_DIFFERENT]
+
+
+def make_shards(person_ids, shard_size, keys=None):
+    """split a list of Person IDs into shards of at most `shard_size` people,
+    as evenly sized as possible. if `keys` (a dict of Person ID -> value,
+    like an office) is passed, people with the same value are kept in the
+    same shard where they fit, so they're matched with each other. otherwise
+    people are dealt out in order, so pass them in random order
+    """
+    if not keys:
+        shard_count = -(-len(person_ids) // shard_size) # ceiling division
+        return [person_ids[index::shard_count]
+            for index in range(shard_count)]
+    groups = {}
+    for person_id in person_ids:
+        groups.setdefault(keys.get(person_id), []).append(person_id)
+    # split groups bigger than a shard into evenly sized chunks, then fit the
+    # chunks into shards largest first, each into the emptiest shard that
+    # has room (or a new one)
+    chunks = []
+    for group in groups.values():
+        chunks += make_shards(group, shard_size)
+    chunks.sort(key=len, reverse=True)
+    shards = []
+    for chunk in chunks:
+        fits = [shard for shard in shards
+            if len(shard) + len(chunk) <= shard_size]
+        if fits:
+            min(fits, key=len).extend(chunk)
+        else:
+            shards.append(list(chunk))
+    return shards
+
+
+def pair_people(person_ids, past_partners, avoid=None,
+                prefer_different=None, allow_duplicates=False):
+    """pair up a list of Person IDs in order, each with the first person
+    after them they haven't been matched with before, according to
+    `past_partners` (a dict of Person ID -> set of past partners' IDs), and
+    who doesn't break the pool's matching rules, according to the `avoid` and
+    `prefer_different` masks from `compile_constraints`. if there's no one
+    like that, the person is paired with whoever breaks the least important
+    of these: first a "prefer different" rule, then pairing with someone
+    they've met before, then an "avoid same" rule, but only the first is
+    allowed unless `allow_duplicates`. returns a tuple of (list of (Person ID,
+    Person ID) pairs, list of Person IDs left over). people with no one left
+    to pair with are left over, and if `allow_duplicates`, that's only one
+    person if there are an odd number
+    """
+    avoid = avoid or {}
+    prefer_different = prefer_different or {}
+    # a dict rather than a set so it keeps the (random) order
+    available = dict.fromkeys(person_ids)
+    pairs = []
+    leftovers = []
+    for person_id in person_ids:
+        if person_id not in available:
+            # this person is already matched
+            continue
+        del available[person_id]
+        partners = past_partners.get(person_id, ())
+        person_avoid = avoid.get(person_id, 0)
+        person_prefer = prefer_different.get(person_id, 0)
+        # find the first person breaking nothing, or else the first person
+        # breaking the least important thing, ranked as in the docstring
+        other_person_id = None
+        best_rank = 4
+        for candidate_id in available:
+            if person_avoid & avoid.get(candidate_id, 0):
+                rank = 3
+            elif candidate_id in partners:
+                rank = 2
+            elif person_prefer & prefer_different.get(candidate_id, 0):
+                rank = 1
+            else:
+                other_person_id = candidate_id
+                best_rank = 0
+                break
+            if rank < best_rank:
+                other_person_id = candidate_id
+                best_rank = rank
+        if best_rank > 1 and not allow_duplicates:
+            other_person_id = None
+        if other_person_id is None:
+            leftovers.append(person_id)
+            continue
+        if best_rank == 2:
+            logger.warning(f"No non-duplicate matches available for person "
+                f"{person_id}.")
+        elif best_rank == 3:
+            logger.warning(f"Only matches breaking a matching rule available "
+                f"for person {person_id}.")
+        del available[other_person_id]
+        pairs.append((person_id, other_person_id))
+    return pairs, leftovers
+
+
+def pair_shard(shard, past_partners, avoid, prefer_different):
+    # a top-level function so it can be run in another process
+    return pair_people(shard, past_partners, avoid, prefer_different)
+
+
+def get_shard_subset(shard, values):
+    """return the part of a dict keyed by Person ID for the people in a
+    shard, so each process is only sent what it needs
+    """
+    return {person_id: values[person_id] for person_id in shard
+        if person_id in values}
+
+
+def pair_shards(shards, past_partners, avoid=None, prefer_different=None,
+                workers=None):
+    """pair each shard (a list of Person IDs) in parallel, across up to
+    `workers` processes (defaults to the number of CPUs), then pair the
+    people left over from every shard with each other, allowing duplicate
+    pairings (and ones breaking "avoid same" rules) only if there's no other
+    option. see `pair_people` for the other arguments. returns a list of
+    (Person ID, Person ID) pairs, and leaves one person out if there are an
+    odd number
+    """
+    avoid = avoid or {}
+    prefer_different = prefer_different or {}
+    arguments = (
+        shards,
+        [get_shard_subset(shard, past_partners) for shard in shards],
+        [get_shard_subset(shard, avoid) for shard in shards],
+        [get_shard_subset(shard, prefer_different) for shard in shards],
+    )
+    if len(shards) > 1 and workers != 1:
+        # "spawn" rather than forking, which isn't safe in a process with
+        # other threads, like a web server's
+        with ProcessPoolExecutor(max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(pair_shard, *arguments))
+    else:
+        results = list(map(pair_shard, *arguments))
+    pairs = []
+    leftovers = []
+    for shard_pairs, shard_leftovers in results:
+        pairs += shard_pairs
+        leftovers += shard_leftovers
+    # people left over in one shard, e.g. because it had an odd number of
+    # people or they'd met everyone left in it, are paired across shards
+    leftover_pairs, _ = pair_people(leftovers, past_partners, avoid,
+        prefer_different, allow_duplicates=True)
+    logger.info(f"Paired {len(pairs)} pairs in {len(shards)} shards and "
+        f"{len(leftover_pairs)} pairs across shards.")
+    return pairs + leftover_pairs
@@ -0,0 +1,194 @@
+import logging
+from datetime import datetime, timedelta
+
+import pytz
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from meetups import settings
+from .admin import match
+from .models import Round, Schedule, ScheduleRun
+
+
+logger = logging.getLogger(__name__)
+
+# how far back to look for scheduled actions that haven't run yet, e.g.
+# because the scheduler wasn't running at the time. older ones are skipped
+LOOKBACK = timedelta(hours=1)
+
+# actions of the same kind are staggered with the others scheduled in the
+# same UTC day (their "slot"), so how long an action is delayed only depends
+# on its slot, not on when the scheduler looks. delays can run into the next
+# slot, but not past it
+SLOT_LENGTH = timedelta(days=1)
+
+
+def get_slot_start(time):
+    """return the start of the slot (UTC day) an aware datetime is in"""
+    return time.astimezone(pytz.utc).replace(hour=0, minute=0, second=0,
+        microsecond=0)
+
+
+def get_ask_times(schedule, start, end):
+    """return a list of UTC datetimes between `start` and `end` (aware
+    datetimes) at which `schedule` asks for availability
+    """
+    tz = pytz.timezone(schedule.pool.timezone)
+    ask_times = []
+    day = start.astimezone(tz).date() - timedelta(days=1)
+    # weeks are counted from the Monday of the start date's week
+    first_week = schedule.start_date - \
+        timedelta(days=schedule.start_date.weekday())
+    while day <= end.astimezone(tz).date():
+        weeks = (day - first_week).days // 7
+        if day.weekday() == schedule.ask_weekday and \
+            day >= schedule.start_date and \
+            weeks % schedule.interval_weeks == 0:
+            ask_time = tz.localize(datetime.combine(day, schedule.ask_time))\
+                .astimezone(pytz.utc)
+            if start <= ask_time <= end:
+                ask_times.append(ask_time)
+        day += timedelta(days=1)
+    return ask_times
+
+
+def get_match_time(schedule, ask_time):
+    """return the UTC datetime at which `schedule` does matching for the
+    round created at `ask_time`: the first `match_weekday` and `match_time`
+    after it, in the pool's timezone
+    """
+    tz = pytz.timezone(schedule.pool.timezone)
+    local_ask_time = ask_time.astimezone(tz)
+    days_after = (schedule.match_weekday - local_ask_time.weekday()) % 7
+    if days_after == 0 and schedule.match_time <= schedule.ask_time:
+        days_after = 7
+    day = local_ask_time.date() + timedelta(days=days_after)
+    return tz.localize(datetime.combine(day, schedule.match_time))\
+        .astimezone(pytz.utc)
+
+
+def get_scheduled_actions(schedules, start, end, runs=()):
+    """return a list of (run at, scheduled for, kind, schedule, ask time) for
+    all scheduled actions due to run between `start` and `end`, sorted by
+    when they should run. "ask time" is when the action's round was
+    scheduled to be created. actions of the same kind in the same slot (see
+    `SLOT_LENGTH`) are staggered so their Slack messages don't all go out at
+    once: each pool's round starts once the previous one's availability
+    fan-out (see `Round.fanout_minutes`) is over, and each pool's matching
+    `settings.SCHEDULE_STAGGER_MINUTES` after the previous one's, and never
+    less than that apart. actions which already ran, in `runs` (ScheduleRuns
+    with their rounds), keep the time they were due to run at and their
+    round's fan-out length, so later actions in their slot don't move
+    """
+    stagger = timedelta(minutes=settings.SCHEDULE_STAGGER_MINUTES)
+    default_fanout = timedelta(minutes=settings.AVAILABILITY_FANOUT_MINUTES)
+    runs = {(run.schedule_id, run.kind, run.scheduled_for): run
+        for run in runs}
+    # the slots which can have actions running between `start` and `end`
+    slots_start = get_slot_start(start) - SLOT_LENGTH
+    slots_end = get_slot_start(end) + SLOT_LENGTH
+    actions = []
+    for schedule in schedules:
+        # matching happens up to a week after asking, so look back further
+        # for rounds that are due to be matched
+        for ask_time in get_ask_times(schedule,
+                                      slots_start - timedelta(days=7),
+                                      slots_end):
+            if slots_start <= ask_time < slots_end:
+                actions.append((ask_time, "ask", schedule, ask_time))
+            match_time = get_match_time(schedule, ask_time)
+            if slots_start <= match_time < slots_end:
+                actions.append((match_time, "match", schedule, ask_time))
+    # break ties between pools by pool ID so staggering is stable across runs
+    actions.sort(key=lambda action: (action[0], action[2].pool_id))
+    staggered = []
+    # (kind, slot) -> when the next action in the slot can run
+    next_run_at = {}
+    for scheduled_for, kind, schedule, ask_time in actions:
+        slot = (kind, get_slot_start(scheduled_for))
+        run = runs.get((schedule.pk, kind, scheduled_for))
+        if run:
+            run_at = run.run_at
+        else:
+            run_at = max(scheduled_for, next_run_at.get(slot, scheduled_for))
+        gap = stagger
+        if kind == "ask":
+            fanout = timedelta(minutes=run.round.fanout_minutes) \
+                if run and run.round else default_fanout
+            gap = max(gap, fanout)
+        next_run_at[slot] = max(next_run_at.get(slot, run_at), run_at + gap)
+        if start <= run_at <= end:
+            staggered.append((run_at, scheduled_for, kind, schedule,
+                ask_time))
+    staggered.sort(key=lambda action: action[0])
+    return staggered
+
+
+def run_action(schedule, kind, scheduled_for, run_at, ask_time):
+    """run a scheduled action and record it as a ScheduleRun, unless it has
+    already run. returns the ScheduleRun, or None if it already ran
+    """
+    try:
+        with transaction.atomic():
+            run = ScheduleRun.objects.create(schedule=schedule, kind=kind,
+                scheduled_for=scheduled_for, run_at=run_at)
+    # another scheduler process already claimed this action
+    except IntegrityError:
+        return None
+    pool = schedule.pool
+    try:
+        if kind == "ask":
+            today = timezone.now().astimezone(
+                pytz.timezone(pool.timezone)).date()
+            round = Round(pool=pool, start_date=today,
+                end_date=today + timedelta(days=schedule.round_length_days))
+            round.save()
+        else:
+            # match the round this schedule created at `ask_time`
+            ask_run = ScheduleRun.objects.filter(schedule=schedule,
+                kind="ask", scheduled_for=ask_time, succeeded=True,
+                round__isnull=False).first()
+            if not ask_run:
+                raise Exception("No round was created for this schedule at "
+                    f"{ask_time}.")
+            round = ask_run.round
+            match(round)
+    except Exception as exception:
+        logger.error(f"Scheduled action \"{run}\" failed: {exception}")
+        run.succeeded = False
+        run.error = str(exception)
+    else:
+        logger.info(f"Ran scheduled action \"{run}\".")
+        run.round = round
+        run.succeeded = True
+    run.finished = timezone.now()
+    run.save()
+    return run
+
+
+def run_due_schedules(now=None):
+    """run all scheduled actions which are due and haven't run yet, returning
+    a list of the ScheduleRuns
+    """
+    now = now or timezone.now()
+    schedules = list(Schedule.objects.filter(enabled=True)\
+        .select_related("pool"))
+    # the runs in the slots `get_scheduled_actions` staggers the actions in
+    past_runs = list(ScheduleRun.objects.filter(scheduled_for__gte=
+        get_slot_start(now - LOOKBACK) - SLOT_LENGTH).select_related("round"))
+    actions = get_scheduled_actions(schedules, now - LOOKBACK, now,
+        past_runs)
+    already_run = {(run.schedule_id, run.kind, run.scheduled_for)
+        for run in past_runs}
+    runs = []
+    for run_at, scheduled_for, kind, schedule, ask_time in actions:
+        # don't run actions for rounds scheduled before the schedule was
+        # created
+        if ask_time < schedule.created:
+            continue
+        if (schedule.pk, kind, scheduled_for) in already_run:
+            continue
+        run = run_action(schedule, kind, scheduled_for, run_at, ask_time)
+        if run:
+            runs.append(run)
+    return runs
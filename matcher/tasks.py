@@ -1,14 +1,19 @@
 import os
+import json
 import logging
+from datetime import timedelta
 from random import random
 
+from django.db import transaction
+from django.db.models import F
 from django.http import HttpResponse
+from django.utils import timezone
 
-import slack
 from celery import Celery
 
 import matcher.messages as messages
 from meetups import settings
+from .tracing import count_slack_call, traced
 from .utils import get_other_person_from_match, blockquote
 
 
@@ -19,31 +24,123 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "meetups.settings")
 
 
 logger = logging.getLogger(__name__)
-client = slack.WebClient(token=settings.SLACK_API_TOKEN)
+# Slack Web API clients by token, created on first use by `get_client`
+_clients = {}
 
 # maximum time to wait before retrying a request in seconds
 MAX_WAIT_TIME = 60 * 2
+# seconds to wait for Slack to accept a reply to an interaction's
+# `response_url` before sending a new message instead
+RESPONSE_URL_TIMEOUT = 2
 
 # Celery setup
 app = Celery("tasks", broker=settings.CELERY_BROKER_URL)
+# also used as the defaults for the `celery worker` command's options, see
+# "Celery worker pools" in the README. the tasks are safe to run in threads:
+# each thread has its own database connection and timing spans, and
+# `get_client`'s clients make a new HTTP request for each call
+app.conf.update(
+    worker_pool=settings.CELERY_WORKER_POOL,
+    worker_concurrency=settings.CELERY_WORKER_CONCURRENCY or None,
+    worker_prefetch_multiplier=settings.CELERY_WORKER_PREFETCH_MULTIPLIER,
+    task_acks_late=settings.CELERY_TASK_ACKS_LATE,
+    # put a task back on the queue if its worker process dies running it
+    task_reject_on_worker_lost=settings.CELERY_TASK_ACKS_LATE,
+    task_always_eager=settings.CELERY_TASK_ALWAYS_EAGER,
+)
+if settings.CELERY_BROKER_URL.startswith("filesystem://"):
+    # every process on the node shares one directory: senders write each task
+    # to it as a file, and the worker picks them up from it
+    os.makedirs(settings.CELERY_BROKER_DIR, exist_ok=True)
+    app.conf.broker_transport_options = {
+        "data_folder_in": settings.CELERY_BROKER_DIR,
+        "data_folder_out": settings.CELERY_BROKER_DIR,
+        "polling_interval": settings.CELERY_BROKER_POLLING_INTERVAL,
+    }
 # how many times to retry a request
 # https://github.com/celery/celery/issues/976#issuecomment-233663171
 app.Task.max_retries = 5
 
 
+class DeadLetterTask(app.Task):
+    """a task which records a FailedDelivery when it fails for good, e.g.
+    after using up its retries, so it can be replayed later
+    """
+
+    def on_failure(self, exception, task_id, args, kwargs, einfo):
+        # import within the function to avoid a circular ImportError
+        import matcher.models as models
+        failed_delivery = models.FailedDelivery(task=self.name,
+            args=list(args), kwargs=kwargs,
+            error_type=type(exception).__name__, error=str(exception))
+        if self.name == send_msg.name:
+            failed_delivery.outbound_message = models.OutboundMessage.objects\
+                .filter(pk=args[0]).select_related("round").first()
+            failed_delivery.round = getattr(failed_delivery.outbound_message,
+                "round", None)
+        elif self.name == open_match_dm.name:
+            failed_delivery.match = models.Match.objects.filter(pk=args[0])\
+                .select_related("round").first()
+            failed_delivery.round = getattr(failed_delivery.match, "round",
+                None)
+        if failed_delivery.round:
+            failed_delivery.pool_id = failed_delivery.round.pool_id
+        failed_delivery.save()
+        logger.error(f"Task {self.name} failed for good, saved for replay: "
+            f"{failed_delivery}")
+
+    def retry(self, *args, exc=None, **kwargs):
+        # Celery runs the retries of an eager task (see
+        # `settings.CELERY_TASK_ALWAYS_EAGER`) right away, in the process
+        # that sent it, like an admin request saving a match. rather than
+        # wait there, fail for good, saving the task for replay
+        if self.request.is_eager and exc is not None:
+            raise exc
+        return super().retry(*args, exc=exc, **kwargs)
+
+def get_client(workspace=None):
+    """get the Slack Web API client for a Workspace, or for the default
+    workspace in `settings.SLACK_API_TOKEN` if None, creating it on first
+    use. each workspace's token gets its own client, which is reused for
+    every call in this process, so workspaces don't share a client (or its
+    rate limit handling) and a new token gets a new client. the Slack SDK
+    (and the HTTP libraries it pulls in) is slow to import, so it's only
+    imported by processes that actually call the API
+    """
+    token = workspace.api_token if workspace else settings.SLACK_API_TOKEN
+    client = _clients.get(token)
+    if client is None:
+        # two threads may both create a client for the same token, which is
+        # harmless: the last one is kept
+        client = _clients[token] = create_client(token)
+    return client
+
+
+def create_client(token):
+    import slack
+
+    class TracedWebClient(slack.WebClient):
+        """counts API calls on the round timing spans in progress"""
+
+        def api_call(self, *args, **kwargs):
+            count_slack_call()
+            return super().api_call(*args, **kwargs)
 
-def get_wait_time(exception, request):
+    return TracedWebClient(token=token, base_url=settings.SLACK_API_URL)
+
+
+def get_wait_time(exception, retries):
     """get how long a request should wait before retrying, from the Slack API
     response's Retry-After header, if available, or using an exponential
-    backoff based on the current retry number
+    backoff based on the number of `retries` so far
     """
     try:
-        return exception.response["headers"]["Retry-After"]
-    except (KeyError, AttributeError):
+        return int(exception.response.headers["Retry-After"])
+    except (KeyError, AttributeError, ValueError):
         # wait exponentially longer before reattempting the request with
         # random jitter. adapted from:
         # https://github.com/slackapi/python-slackclient/blob/647f7ab4182ae6055dee80d6c4e062f30fa45078/slack/rtm/client.py#L510
-        return min((2 ** request.retries) + random(), MAX_WAIT_TIME)
+        return min((2 ** retries) + random(), MAX_WAIT_TIME)
 
 
 def get_retries_remaining(self):
@@ -52,23 +149,112 @@ def get_retries_remaining(self):
     return self.max_retries - self.request.retries
 
 
-@app.task(bind=True)
-def send_msg(self, channel_id, **kwargs):
-    """send a message to a user or channel as the bot
+def was_delivered(channel_id, key, since, workspace=None):
+    """check whether a message with the idempotency `key` was posted to
+    `channel_id` in a Workspace since `since`, in case an earlier attempt to
+    send it failed after Slack accepted it, like timing out waiting for the
+    response
     """
-    message_text = kwargs.get("text", kwargs.get("blocks"))
     try:
-        client.chat_postMessage(channel=channel_id, as_user=True, **kwargs)
+        client = get_client(workspace)
+        # messages sent to a user ID are posted in the bot's direct message
+        # with them
+        if channel_id.startswith(("U", "W")):
+            channel_id = client.conversations_open(users=channel_id)\
+                ["channel"]["id"]
+        # https://api.slack.com/methods/conversations.history
+        response = client.conversations_history(channel=channel_id,
+            oldest=f"{since.timestamp():.6f}", include_all_metadata="true",
+            limit=100)
     except Exception as exception: # see [1] (bottom of file)
-        wait_time = get_wait_time(exception, self.request)
+        logger.warning(f"Failed to check if message \"{key}\" was already "
+            f"delivered. Sending it again. Error: {exception}")
+        return False
+    return any(
+        message.get("metadata", {}).get("event_payload", {}).get("key") == key
+        for message in response.get("messages", [])
+    )
+
+
+@app.task(bind=True, base=DeadLetterTask)
+def send_msg(self, outbound_message_id, check_delivered=False):
+    """send a queued OutboundMessage as the bot, recording the attempt and
+    whether it was delivered on the message. the message is skipped if it was
+    already delivered, e.g. if the task ran twice, or if `check_delivered` and
+    the previous attempt failed after Slack accepted it
+    """
+    # import within the function to avoid a circular ImportError
+    import matcher.models as models
+    OutboundMessage = models.OutboundMessage
+    outbound_message = OutboundMessage.objects.select_related("workspace")\
+        .get(pk=outbound_message_id)
+    workspace = outbound_message.workspace
+    channel_id = outbound_message.channel_id
+    key = outbound_message.get_key()
+    message_text = outbound_message.message.get("text",
+        outbound_message.message.get("blocks"))
+    if outbound_message.cancelled:
+        logger.info(f"Skipped sending cancelled message \"{key}\".")
+        return f"{channel_id}: skipped cancelled \"{key}\""
+    # checked since the message was due rather than since it was
+    # dispatched, which is updated when it's dispatched again, see
+    # `dispatch_due_messages`
+    if outbound_message.delivered or (check_delivered and
+        was_delivered(channel_id, key, outbound_message.send_after,
+            workspace)):
+        # only record the delivery if it wasn't already recorded
+        OutboundMessage.objects.filter(pk=outbound_message_id,
+            delivered__isnull=True).update(delivered=timezone.now())
+        OutboundMessage.objects.filter(pk=outbound_message_id)\
+            .update(duplicates_suppressed=F("duplicates_suppressed") + 1)
+        logger.info(f"Skipped sending duplicate message \"{key}\".")
+        return f"{channel_id}: skipped duplicate \"{key}\""
+    # marks the attempt in flight, so `dispatch_due_messages` doesn't hand
+    # the message off again while it's being sent
+    OutboundMessage.objects.filter(pk=outbound_message_id)\
+        .update(attempts=F("attempts") + 1, attempted=timezone.now())
+    attempts = outbound_message.attempts + 1
+    try:
+        # the key is attached to the message as metadata so `was_delivered`
+        # can find it
+        # https://api.slack.com/metadata/using
+        get_client(workspace).chat_postMessage(channel=channel_id,
+            as_user=True, metadata={"event_type": "meetups_message",
+                "event_payload": {"key": key}},
+            **outbound_message.message)
+    except Exception as exception: # see [1] (bottom of file)
+        # counted from the message's attempts rather than the task's
+        # retries, which start over when it's handed off again
+        wait_time = get_wait_time(exception, attempts - 1)
+        retry_after = timezone.now() + timedelta(seconds=wait_time)
+        if self.request.is_eager and attempts <= self.max_retries:
+            # rather than wait in the process that sent the task, put the
+            # message back in the queue, and `dispatch_due_messages` hands it
+            # off again once the wait is over
+            OutboundMessage.objects.filter(pk=outbound_message_id).update(
+                last_error=str(exception), retry_after=retry_after,
+                dispatched=None)
+            logger.warning(f"Failed to send message \"{message_text}\" to "
+                f"{channel_id}. Requeued to retry in {wait_time} seconds. "
+                f"Error: {exception}. {self.max_retries - attempts + 1} "
+                "retries remaining.")
+            return f"{channel_id}: requeued \"{key}\""
+        OutboundMessage.objects.filter(pk=outbound_message_id)\
+            .update(last_error=str(exception), retry_after=retry_after)
         logger.warning(f"Failed to send message \"{message_text}\" to "
             f"{channel_id}. Retrying in {wait_time} seconds. Error: "
             f"{exception}. {get_retries_remaining(self)} retries remaining.")
-        raise self.retry(exc=exception, countdown=wait_time)
+        # if Slack responded, the message wasn't posted. otherwise, e.g. if
+        # the request timed out, it may have been, so check before retrying
+        raise self.retry(exc=exception, countdown=wait_time,
+            kwargs={"check_delivered": check_delivered or
+                getattr(exception, "response", None) is None})
+    OutboundMessage.objects.filter(pk=outbound_message_id)\
+        .update(delivered=timezone.now(), last_error="")
     return f"{channel_id}: \"{message_text}\"" # logged to Celery worker
 
 
-@app.task(bind=True)
+@app.task(bind=True, base=DeadLetterTask)
 def open_match_dm(self, match_id):
     """create a group direct message between the two people in a match and
     introduce them to each other
@@ -79,71 +265,111 @@ def open_match_dm(self, match_id):
 
     # get the Match object
     try:
-        match = Match.objects.get(pk=match_id)
-    # the match *should* always exist here as this function runs post-save,
-    # but it doesn't for some reason. retry to work around it, though the
-    # underlying race condition should be indentified
+        match = Match.objects.select_related("round__pool__workspace")\
+            .get(pk=match_id)
+    # the match should always exist here as this task is only sent once the
+    # match is committed (see `handle_match_save`), but retry rather than
+    # failing outright if it isn't there
     except Match.DoesNotExist as exception:
-        wait_time = get_wait_time(exception, self.request)
+        wait_time = get_wait_time(exception, self.request.retries)
         logger.warning(f"Did not find match with ID: {match_id}. Retrying in "
             f"{wait_time} seconds. Error: {exception}. "
             f"{get_retries_remaining(self)} retries remaining.")
         raise self.retry(exc=exception, countdown=wait_time)
 
-    # open a direct message between the people in the match
-    user_ids = ",".join([match.person_1.user_id, match.person_2.user_id])
-    # https://api.slack.com/methods/conversations.open
-    try:
-        response = client.conversations_open(users=user_ids)
-        match.conversation_id = response["channel"]["id"]
-    except Exception as exception: # see [1] (bottom of file)
-        wait_time = get_wait_time(exception, self.request)
-        logger.warning(f"Failed to open conversation for match: {match}. "
-            f"Retrying in {wait_time} seconds. Error: {exception}. "
-            f"{get_retries_remaining(self)} retries remaining.")
-        raise self.retry(exc=exception, countdown=wait_time)
-    match.save()
-    
-    # send people's introductions to each other in the channel
-    # `unfurl_links=False` prevents link previews from appearing if someone
-    # included a link in their intro
-    try:
-        client.chat_postMessage(channel=match.conversation_id, as_user=True,
-            text=messages.MATCH_INTRO.format(person_1=match.person_1,
-            person_1_intro=blockquote(match.person_1.intro),
-            person_2=match.person_2,
-            person_2_intro=blockquote(match.person_2.intro),
-            pool=match.round.pool), unfurl_links=False)
-    except Exception as exception: # see [1] (bottom of file)
-        wait_time = get_wait_time(exception, self.request)
-        logger.warning(f"Failed to send message for match: {match}. "
-            f"Retrying in {wait_time} seconds. Error: {exception}. "
-            f"{get_retries_remaining(self)} retries remaining.")
-        raise self.retry(exc=exception, countdown=wait_time)
-    logger.info(f"Sent message for match: {match}.")
+    # time opening the conversation as part of the round's timing, see
+    # `matcher/tracing.py`
+    with traced(match.round, "dm_opening") as span:
+        # each attempt's span is added to the phase's total, so count
+        # whether this attempt is a retry rather than how many came before it
+        span.retries = 1 if self.request.retries else 0
+        # open a direct message between the people in the match
+        user_ids = ",".join([match.person_1.user_id,
+            match.person_2.user_id])
+        # https://api.slack.com/methods/conversations.open
+        try:
+            response = get_client(match.round.pool.workspace)\
+                .conversations_open(users=user_ids)
+            match.conversation_id = response["channel"]["id"]
+        except Exception as exception: # see [1] (bottom of file)
+            wait_time = get_wait_time(exception, self.request.retries)
+            logger.warning(f"Failed to open conversation for match: "
+                f"{match}. Retrying in {wait_time} seconds. Error: "
+                f"{exception}. {get_retries_remaining(self)} retries "
+                "remaining.")
+            raise self.retry(exc=exception, countdown=wait_time)
+        # only write the conversation ID rather than the whole row, which
+        # keeps the write short and skips the `post_save` signal handlers.
+        # queue people's introductions to each other in the same
+        # transaction. `unfurl_links=False` prevents link previews from
+        # appearing if someone included a link in their intro
+        with transaction.atomic():
+            Match.objects.filter(pk=match.pk)\
+                .update(conversation_id=match.conversation_id)
+            models.queue_message(match.conversation_id, "match_intro",
+                match=match, text=messages.MATCH_INTRO.format(
+                person_1=match.person_1,
+                person_1_intro=blockquote(match.person_1.intro),
+                person_2=match.person_2,
+                person_2_intro=blockquote(match.person_2.intro),
+                pool=match.round.pool), unfurl_links=False)
+    logger.info(f"Queued message for match: {match}.")
     return match # logged to Celery worker
 
 
 @app.task
-def ask_if_met(_, user_id, pool_id):
+def respond_to_action(response_url, user_id, text, blocks,
+                      workspace_id=None):
+    """reply to someone clicking a button by replacing the message it was in
+    with `text` and `blocks`, using the interaction's `response_url`, see
+    `acknowledge_action` in `./views.py`. falls back to queueing a new
+    message if the request fails
+    https://api.slack.com/interactivity/handling#message_responses
+    """
+    import urllib.request
+    body = json.dumps({"replace_original": True, "text": text,
+        "blocks": blocks}).encode("utf-8")
+    request = urllib.request.Request(response_url, data=body,
+        headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=RESPONSE_URL_TIMEOUT):
+            return f"{user_id}: \"{text}\"" # logged to Celery worker
+    except Exception as exception: # see [1] (bottom of file)
+        logger.warning(f"Failed to respond to action from {user_id} using "
+            f"its response URL. Sending a new message instead. Error: "
+            f"{exception}")
+    # import within the function to avoid a circular ImportError
+    import matcher.models as models
+    models.queue_message(user_id, "action_response",
+        workspace=models.Workspace.objects.filter(pk=workspace_id).first(),
+        text=text)
+    return f"{user_id}: queued \"{text}\""
+
+
+def ask_if_met(user_id, pool_id):
     """ask this person if they met up with their last match in this pool, if
-    any, and if we don't know yet
+    any, and if we don't know yet. not a Celery task: it only queues a
+    message, so it's called directly while handling a webhook. (calling a
+    task object directly from several threads at once, as the ASGI server
+    does, can fail before Celery has set the task up)
     """
     # import within the function to avoid a circular ImportError
     import matcher.models as models
+    from .lookups import get_person, get_pool
     Match = models.Match
-    pool = models.Pool.objects.get(pk=pool_id)
-    person = models.Person.objects.get(user_id=user_id)
+    pool = get_pool(pk=pool_id)
+    person = get_person(user_id)
     # a Person can be either `person_1` or `person_2` on a Match; it's random
     user_matches = (
         Match.objects.filter(round__pool=pool, person_1=person) |
         Match.objects.filter(round__pool=pool, person_2=person)
     )
-    if not user_matches:
+    latest_match = user_matches.select_related("round__pool")\
+        .order_by("-round__end_date").first()
+    if not latest_match:
         # if the Person hasn't matched with anyone yet, skip sending this
         # message
         return HttpResponse(204)
-    latest_match = user_matches.latest("round__end_date")
     # if the Person or their match hasn't already provided feedback on their
     # last match, continue to ask if they met
     if latest_match.met is None:
@@ -153,11 +379,13 @@ def ask_if_met(_, user_id, pool_id):
             latest_match.id,
             {"pool": pool, "other_person": other_person}
         )
-        send_msg.delay(user_id, blocks=blocks)
         # clear any existing last query because this field is only used for
-        # text-based queries, not block-based queries
-        person.last_query = None
-        person.save()
+        # text-based queries, not block-based queries. `person` may be cached,
+        # so update the field alone rather than saving the whole object
+        with transaction.atomic():
+            models.Person.objects.filter(pk=person.pk).update(last_query=None)
+            models.queue_message(user_id, "ask_if_met",
+                match=latest_match, blocks=blocks)
     return HttpResponse(204)
 
 
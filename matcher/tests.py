@@ -1,3 +1,1635 @@
-from django.test import TestCase
+import copy
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import pytz
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from celery.contrib.testing.worker import start_worker
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from meetups import settings
+from . import messages, tasks
+from .admin import (exclude_from_round, get_round_participants,
+                    rematch_dropouts)
+from .archive import archive_rounds, get_past_partners
+from .constants import QUESTIONS
+from .delivery import (TokenBucket, claim_message,
+                       dispatch_due_messages)
+from .feedback import cancel_met_prompts, request_met_feedback
+from .loadtest import (FakeSlackAPI, build_block_action, build_message_event,
+                       fire_at_rate, percentile, post_signed, sign_request)
+from .lookups import (LRUCache, get_person, get_pool, get_workspace,
+                      person_cache, pool_cache, workspace_cache)
+from .management.commands.load_test_db import (
+    Command as LoadTestDBCommand, webhook_write, worker_write)
+from .middleware import (ProfileRequests, VerifySlackRequest,
+                         get_request_workspace, get_team_id, with_workspace)
+from .models import (Pool, Person, PoolMembership, Round, Match,
+                     ArchivedMatch, ArchivedRound, PairHistory, Schedule,
+                     ScheduleRun, OutboundMessage, FailedDelivery,
+                     MatchingRule, RoundPhase, Workspace, get_message_key,
+                     queue_message)
+from .pairing import (AVOID_SAME, PREFER_DIFFERENT, compile_constraints,
+                      make_shards, pair_people, pair_shards)
+from .scheduling import (get_scheduled_actions, run_action,
+                         run_due_schedules)
+from .tracing import count_slack_call, get_round_timings, traced
+from .utils import blockquote
+from .views import (get_pool_stats, get_stats, handle_slack_action,
+                    handle_slack_message, update_met)
+
+
+# number of rows of each model to create; large enough that any per-row query
+# would blow through the query budgets below
+ROW_COUNT = 60
+# maximum queries for each admin page, including session/user lookups and
+# savepoints; these don't depend on `ROW_COUNT`
+CHANGELIST_BUDGET = 8
+CHANGE_FORM_BUDGET = 10
+
+
+# the default manifest storage requires running `collectstatic` first
+without_manifest_storage = override_settings(STORAGES={
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+})
+
+
+@without_manifest_storage
+class AdminQueryBudgetTest(TestCase):
+    """admin pages should run a bounded number of queries regardless of how
+    many rows they display
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser("admin", "admin@example.com", "admin")
+        workspaces = Workspace.objects.bulk_create(
+            Workspace(name=f"Workspace {i}", team_id=f"T{i:010d}",
+                api_token=f"xoxb-{i}")
+            for i in range(2)
+        )
+        pools = Pool.objects.bulk_create(
+            Pool(name=f"Pool {i}", channel_id=f"C{i:010d}",
+                channel_name=f"pool-{i}", workspace=workspaces[i % 2])
+            for i in range(3)
+        )
+        people = Person.objects.bulk_create(
+            Person(user_id=f"U{i:010d}", user_name=f"user{i}",
+                full_name=f"Person {i}", casual_name="Person", intro="Hi!",
+                attributes={"team": f"Team {i % 5}"})
+            for i in range(ROW_COUNT)
+        )
+        MatchingRule.objects.bulk_create(
+            MatchingRule(pool=pool, attribute=attribute, kind=kind)
+            for pool in pools
+            for attribute, kind in (("team", MatchingRule.AVOID_SAME),
+                ("office", MatchingRule.PREFER_DIFFERENT))
+        )
+        PoolMembership.objects.bulk_create(
+            PoolMembership(person=person, pool=pool, available=True,
+                rounds_since_excluded=i % 4 or None)
+            for i, person in enumerate(people) for pool in pools
+        )
+        # bulk creation skips `Round.save` and the `Match` post-save signal,
+        # so no Slack messages are sent
+        rounds = Round.objects.bulk_create(
+            Round(pool=pools[i % len(pools)], excluded=people[i])
+            for i in range(ROW_COUNT)
+        )
+        Match.objects.bulk_create(
+            Match(person_1=people[i], person_2=people[i - 1],
+                round=rounds[i])
+            for i in range(ROW_COUNT)
+        )
+        schedules = Schedule.objects.bulk_create(
+            Schedule(pool=pool) for pool in pools
+        )
+        ScheduleRun.objects.bulk_create(
+            ScheduleRun(schedule=schedules[i % len(schedules)], kind="ask",
+                scheduled_for=now() - timedelta(weeks=i),
+                run_at=now() - timedelta(weeks=i), round=rounds[i])
+            for i in range(ROW_COUNT)
+        )
+        outbound_messages = OutboundMessage.objects.bulk_create(
+            OutboundMessage(round=rounds[i], channel_id=people[i].user_id,
+                purpose="availability", message={"text": "Hi!"},
+                send_after=now())
+            for i in range(ROW_COUNT)
+        )
+        FailedDelivery.objects.bulk_create(
+            FailedDelivery(task="matcher.tasks.send_msg",
+                args=[outbound_messages[i].pk], round=rounds[i],
+                pool=rounds[i].pool, outbound_message=outbound_messages[i],
+                error_type="SlackApiError", error="ratelimited")
+            for i in range(ROW_COUNT)
+        )
+
+    def setUp(self):
+        self.client.login(username="admin", password="admin")
+
+    def assertMaxQueries(self, url, max_queries):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(context), max_queries,
+            f"{url} ran {len(context)} queries:\n" +
+            "\n".join(query["sql"] for query in context.captured_queries))
+
+    def assertChangelistQueries(self, model_name, query_string=""):
+        url = reverse(f"admin:matcher_{model_name}_changelist")
+        self.assertMaxQueries(url + query_string, CHANGELIST_BUDGET)
+
+    def assertChangeFormQueries(self, model_name, pk):
+        url = reverse(f"admin:matcher_{model_name}_change", args=[pk])
+        self.assertMaxQueries(url, CHANGE_FORM_BUDGET)
+
+    def test_pool_admin(self):
+        self.assertChangelistQueries("pool")
+        self.assertChangeFormQueries("pool", Pool.objects.first().pk)
+
+    def test_workspace_admin(self):
+        self.assertChangelistQueries("workspace")
+        self.assertChangeFormQueries("workspace",
+            Workspace.objects.first().pk)
+
+    def test_person_admin(self):
+        pool = Pool.objects.first()
+        self.assertChangelistQueries("person")
+        self.assertChangelistQueries("person", f"?pools={pool.pk}")
+        self.assertChangelistQueries("person",
+            f"?available_for_pool={pool.pk}")
+        self.assertChangeFormQueries("person", Person.objects.first().pk)
+
+    def test_pool_membership_admin(self):
+        self.assertChangelistQueries("poolmembership")
+        self.assertChangeFormQueries("poolmembership",
+            PoolMembership.objects.first().pk)
+
+    def test_round_admin(self):
+        self.assertChangelistQueries("round")
+        self.assertChangeFormQueries("round", Round.objects.first().pk)
+
+    def test_match_admin(self):
+        self.assertChangelistQueries("match")
+        self.assertChangelistQueries("match", "?q=Person")
+        self.assertChangeFormQueries("match", Match.objects.first().pk)
+
+    def test_schedule_admin(self):
+        self.assertChangelistQueries("schedule")
+        self.assertChangeFormQueries("schedule", Schedule.objects.first().pk)
+
+    def test_schedule_run_admin(self):
+        self.assertChangelistQueries("schedulerun")
+        self.assertChangeFormQueries("schedulerun",
+            ScheduleRun.objects.first().pk)
+
+    def test_pair_history_admin(self):
+        Round.objects.update(start_date=date(2020, 1, 6),
+            end_date=date(2020, 1, 10))
+        archive_rounds()
+        self.assertChangelistQueries("pairhistory")
+        self.assertChangeFormQueries("pairhistory",
+            PairHistory.objects.first().pk)
+
+    def test_failed_delivery_admin(self):
+        self.assertChangelistQueries("faileddelivery")
+        self.assertChangelistQueries("faileddelivery",
+            "?error_type=SlackApiError")
+        self.assertChangeFormQueries("faileddelivery",
+            FailedDelivery.objects.first().pk)
+
+
+class ThreadPoolWorkerTest(TransactionTestCase):
+    """a worker in the threads pool (see `settings.CELERY_WORKER_POOL`) sends
+    several queued messages at once while each waits on Slack. this runs a
+    real worker in this process, with an in-memory broker, so the messages
+    are committed for the worker's threads to see
+    """
+
+    def setUp(self):
+        self.fake_slack = FakeSlackAPI(port=0, latency=0.2)
+        self.fake_slack.start()
+        self.addCleanup(self.fake_slack.stop)
+        for patcher in (
+            mock.patch.object(settings, "SLACK_API_URL",
+                f"{self.fake_slack.url}api/"),
+            mock.patch.dict(tasks._clients, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Celery's settings can't be patched with `mock.patch.object`
+        for name, value in (("broker_url", "memory://"),
+                            ("broker_transport_options",
+                                {"polling_interval": 0.01})):
+            self.addCleanup(setattr, tasks.app.conf, name,
+                getattr(tasks.app.conf, name))
+            setattr(tasks.app.conf, name, value)
+
+    def test_send_concurrently(self):
+        self.assertEqual(tasks.app.conf.worker_pool,
+            settings.CELERY_WORKER_POOL)
+        self.assertTrue(tasks.app.conf.task_acks_late)
+        OutboundMessage.objects.bulk_create(
+            OutboundMessage(channel_id=f"U{i:010d}", purpose="test",
+                message={"text": "Hi!"}, send_after=now())
+            for i in range(10)
+        )
+        # the connections of the producers the app already made, for the
+        # configured broker, are reused by `delay`, so send on a new one
+        with start_worker(tasks.app, pool="threads", concurrency=5,
+            perform_ping_check=False), \
+            tasks.app.connection_for_write() as broker, \
+            mock.patch.object(tasks.send_msg, "delay",
+                side_effect=lambda *args, **kwargs: tasks.send_msg
+                .apply_async(args, kwargs, connection=broker)):
+            dispatch_due_messages(throttle=False)
+            deadline = time.monotonic() + 20
+            while OutboundMessage.objects.filter(delivered__isnull=True)\
+                .exists() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        self.assertFalse(OutboundMessage.objects.filter(
+            delivered__isnull=True).exists())
+        # calls which arrived while another was still waiting on the fake
+        # API's latency were sent at the same time
+        received = sorted(received for received, _ in
+            self.fake_slack.calls["chat.postMessage"])
+        self.assertEqual(len(received), 10)
+        self.assertTrue(any(later - earlier < self.fake_slack.latency
+            for earlier, later in zip(received, received[1:])))
+
+
+class EagerDeliveryTest(TestCase):
+    """queued messages are sent end to end without a broker, with tasks run
+    eagerly (see `settings.CELERY_TASK_ALWAYS_EAGER`) against a fake Slack
+    API
+    """
+
+    def setUp(self):
+        self.fake_slack = FakeSlackAPI(port=0, retry_after=0)
+        self.fake_slack.start()
+        self.addCleanup(self.fake_slack.stop)
+        for patcher in (
+            mock.patch.object(settings, "SLACK_API_URL",
+                f"{self.fake_slack.url}api/"),
+            mock.patch.dict(tasks._clients, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Celery's settings can't be patched with `mock.patch.object`
+        self.addCleanup(setattr, tasks.app.conf, "task_always_eager",
+            tasks.app.conf.task_always_eager)
+        tasks.app.conf.task_always_eager = True
+        self.outbound_message = OutboundMessage.objects.create(
+            channel_id="U0000000001", purpose="test",
+            message={"text": "Hi!"}, send_after=now())
+
+    def test_send(self):
+        dispatch_due_messages()
+        self.outbound_message.refresh_from_db()
+        self.assertIsNotNone(self.outbound_message.delivered)
+        self.assertEqual(self.outbound_message.attempts, 1)
+        self.assertEqual(
+            len(self.fake_slack.get_replies()["U0000000001"]), 1)
+
+    def test_requeue_instead_of_waiting(self):
+        self.fake_slack.rate_limit_ratio = 1
+        self.fake_slack.retry_after = 60
+        dispatch_due_messages()
+        self.outbound_message.refresh_from_db()
+        self.assertEqual(self.outbound_message.attempts, 1)
+        self.assertIsNone(self.outbound_message.dispatched)
+        self.assertGreater(self.outbound_message.retry_after, now())
+        # not handed off again until the wait is over
+        self.assertEqual(dispatch_due_messages(), [])
+        self.assertFalse(FailedDelivery.objects.exists())
+
+    def test_retry_then_save_for_replay(self):
+        self.fake_slack.rate_limit_ratio = 1
+        # each failed attempt is requeued, to be handed off again right away
+        for _ in range(tasks.send_msg.max_retries + 1):
+            self.assertEqual(len(dispatch_due_messages()), 1)
+        self.assertEqual(dispatch_due_messages(), [])
+        self.outbound_message.refresh_from_db()
+        self.assertIsNone(self.outbound_message.delivered)
+        self.assertEqual(self.outbound_message.attempts,
+            tasks.send_msg.max_retries + 1)
+        self.assertEqual(FailedDelivery.objects.get().outbound_message,
+            self.outbound_message)
+
+    def test_open_match_dm_saved_for_replay(self):
+        self.fake_slack.rate_limit_ratio = 1
+        self.fake_slack.retry_after = 60
+        pool = Pool.objects.create(name="Pool", channel_id="C0000000001",
+            channel_name="pool")
+        round = Round.objects.bulk_create([Round(pool=pool)])[0]
+        people = Person.objects.bulk_create(
+            Person(user_id=f"U000000001{i}", user_name=f"person{i}",
+                full_name=f"Person {i}", casual_name=f"Person {i}")
+            for i in range(2))
+        match = Match.objects.bulk_create([Match(person_1=people[0],
+            person_2=people[1], round=round)])[0]
+        # fails for good without waiting to retry in this process
+        tasks.open_match_dm.delay(match.pk)
+        self.assertEqual(FailedDelivery.objects.get().match, match)
+        self.assertEqual(OutboundMessage.objects.filter(
+            purpose="match_intro").count(), 0)
+
+    def test_open_match_dm_after_commit(self):
+        pool = Pool.objects.create(name="Pool", channel_id="C0000000001",
+            channel_name="pool")
+        round = Round.objects.bulk_create([Round(pool=pool)])[0]
+        people = Person.objects.bulk_create(
+            Person(user_id=f"U000000001{i}", user_name=f"person{i}",
+                full_name=f"Person {i}", casual_name=f"Person {i}")
+            for i in range(2))
+        with mock.patch.object(tasks.open_match_dm, "delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                match = Match.objects.create(person_1=people[0],
+                    person_2=people[1], round=round)
+                # the task wouldn't find the match until it's committed
+                delay.assert_not_called()
+        delay.assert_called_once_with(match.pk)
+
+    def test_queue_once(self):
+        pool = Pool.objects.create(name="Pool", channel_id="C0000000001",
+            channel_name="pool")
+        round = Round.objects.bulk_create([Round(pool=pool)])[0]
+        outbound_message = queue_message("U0000000002", "test", round=round,
+            text="Hi!")
+        self.assertEqual(outbound_message.key,
+            get_message_key("test", "U0000000002", round=round))
+        self.assertIsNone(queue_message("U0000000002", "test", round=round,
+            text="Hi!"))
+        self.assertEqual(OutboundMessage.objects.filter(
+            key=outbound_message.key).count(), 1)
+
+    def test_skip_delivered(self):
+        OutboundMessage.objects.filter(pk=self.outbound_message.pk).update(
+            key="test:round-1:U0000000001")
+        dispatch_due_messages()
+        # sent again, e.g. by a task that ran twice
+        tasks.send_msg.delay(self.outbound_message.pk)
+        # or after an attempt that Slack accepted but which timed out
+        OutboundMessage.objects.filter(pk=self.outbound_message.pk).update(
+            delivered=None)
+        tasks.send_msg.delay(self.outbound_message.pk, check_delivered=True)
+        self.outbound_message.refresh_from_db()
+        self.assertIsNotNone(self.outbound_message.delivered)
+        self.assertEqual(self.outbound_message.attempts, 1)
+        self.assertEqual(self.outbound_message.duplicates_suppressed, 2)
+        self.assertEqual(
+            len(self.fake_slack.get_replies()["U0000000001"]), 1)
+
+
+class ArchiveTest(TestCase):
+    """archiving old rounds keeps everything matching, stats and people's
+    answers depend on
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pool = Pool.objects.create(name="Pool", channel_id="C0000000001",
+            channel_name="pool")
+        cls.people = Person.objects.bulk_create(
+            Person(user_id=f"U000000000{i}", user_name=f"person{i}",
+                full_name=f"Person {i}", casual_name=f"Person {i}")
+            for i in range(5)
+        )
+        # bulk creation skips `Round.save` and the `Match` post-save signal,
+        # so no Slack messages are sent
+        old_round, latest_round = Round.objects.bulk_create([
+            Round(pool=cls.pool, start_date=date(2020, 1, 6),
+                end_date=date(2020, 1, 10), excluded=cls.people[4]),
+            Round(pool=cls.pool),
+        ])
+        p = cls.people
+        cls.met_match, cls.unknown_match, _ = Match.objects.bulk_create([
+            Match(round=old_round, person_1=p[0], person_2=p[1], met=True),
+            Match(round=old_round, person_1=p[3], person_2=p[2]),
+            Match(round=latest_round, person_1=p[0], person_2=p[2]),
+        ])
+        OutboundMessage.objects.create(round=old_round,
+            channel_id=p[0].user_id, purpose="availability", message={"text": "Hi!"},
+            send_after=now(), delivered=now())
+        RoundPhase.objects.create(round=old_round, name="matching",
+            started=now(), finished=now(), span_count=1)
+
+    def get_stats_matches(self):
+        # archived matches no longer have IDs of their own, and have the
+        # person with the lower ID first
+        return sorted((*sorted((match["person_1"], match["person_2"])),
+            match["met"]) for match in get_stats(self.pool)["matches"])
+
+    def test_past_partners(self):
+        people = Person.objects.all()
+        past_partners = get_past_partners(people)
+        self.assertEqual(archive_rounds(), 1)
+        self.assertEqual(get_past_partners(people), past_partners)
+        self.assertEqual(past_partners[self.people[0].pk],
+            {self.people[1].pk, self.people[2].pk})
+
+    def test_stats(self):
+        stats = get_stats(self.pool)
+        stats_matches = self.get_stats_matches()
+        archive_rounds()
+        archived_stats = get_stats(self.pool)
+        for field in ("participant_count", "round_count"):
+            self.assertEqual(archived_stats[field], stats[field])
+        self.assertCountEqual(archived_stats["people"], stats["people"])
+        self.assertEqual(self.get_stats_matches(), stats_matches)
+
+    def test_history_kept(self):
+        archive_rounds()
+        archived_round = ArchivedRound.objects.get()
+        self.assertEqual(archived_round.excluded, self.people[4])
+        self.assertEqual(OutboundMessage.objects.get().archived_round,
+            archived_round)
+        self.assertEqual(RoundPhase.objects.get().archived_round,
+            archived_round)
+
+    def test_met_after_archiving(self):
+        archive_rounds()
+        history = PairHistory.objects.get(person_2=self.people[3])
+        self.assertEqual((history.met_count, history.not_met_count), (0, 0))
+
+        def click(person, match, value):
+            return update_met({"user": {"id": person.user_id}},
+                {"value": value}, match.pk)
+
+        response = click(self.people[3], self.unknown_match, "no")
+        self.assertEqual(response.status_code, 200)
+        history.refresh_from_db()
+        self.assertEqual((history.met_count, history.not_met_count), (0, 1))
+        # changing an answer moves it to the other count
+        click(self.people[2], self.unknown_match, "yes")
+        history.refresh_from_db()
+        self.assertEqual((history.met_count, history.not_met_count), (1, 0))
+        self.assertTrue(ArchivedMatch.objects.get(
+            original_id=self.unknown_match.pk).met)
+        # people who weren't in the match can't answer for it
+        response = click(self.people[0], self.unknown_match, "no")
+        self.assertEqual(response.status_code, 404)
+
+
+class MetFeedbackTest(TestCase):
+    """people in a round's unanswered matches are asked once whether they
+    met, and the question is cancelled once either of them answers
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pool = Pool.objects.create(name="Pool", channel_id="C0000000001",
+            channel_name="pool")
+        cls.people = Person.objects.bulk_create(
+            Person(user_id=f"U{i:010d}", full_name=f"Person {i}",
+                casual_name="Person", intro="Hi!",
+                last_query=QUESTIONS["update_intro"])
+            for i in range(6)
+        )
+        cls.round = Round.objects.bulk_create([Round(pool=pool)])[0]
+        cls.matches = Match.objects.bulk_create(
+            Match(person_1=cls.people[i], person_2=cls.people[i + 1],
+                round=cls.round)
+            for i in range(0, 6, 2)
+        )
+        Match.objects.filter(pk=cls.matches[2].pk).update(met=True)
+
+    def test_request_met_feedback(self):
+        self.assertEqual(request_met_feedback(self.round), 4)
+        self.assertEqual(set(OutboundMessage.objects.values_list(
+            "channel_id", flat=True)),
+            {person.user_id for person in self.people[:4]})
+        # people mid-way through a text exchange keep their last query
+        self.assertFalse(Person.objects.exclude(
+            last_query=QUESTIONS["update_intro"]).exists())
+        self.assertEqual(request_met_feedback(self.round), 0)
+        self.assertEqual(OutboundMessage.objects.count(), 4)
+
+    def test_cancel_on_answer(self):
+        request_met_feedback(self.round)
+        OutboundMessage.objects.filter(channel_id=self.people[0].user_id)\
+            .update(delivered=now())
+        self.assertEqual(cancel_met_prompts(self.matches[0]), 1)
+        self.assertEqual(OutboundMessage.objects.filter(
+            cancelled__isnull=False).get().channel_id,
+            self.people[1].user_id)
+
+
+class ExclusionTest(TestCase):
+    """with an odd number of people, whoever was excluded longest ago (or
+    never) sits out, and re-matching dropouts only counts a round once
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pool = Pool.objects.create(name="Pool",
+            channel_id="C0000000001", channel_name="pool")
+        cls.people = Person.objects.bulk_create(
+            Person(user_id=f"U{i:010d}", full_name=f"Person {i}",
+                casual_name="Person", intro="Hi!", can_be_excluded=True)
+            for i in range(7)
+        )
+        PoolMembership.objects.bulk_create(
+            PoolMembership(person=person, pool=cls.pool, available=True)
+            for person in cls.people
+        )
+
+    def setUp(self):
+        # new matches open a conversation in a Celery task
+        patcher = mock.patch.object(tasks.open_match_dm, "delay")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_counts(self):
+        return dict(PoolMembership.objects.filter(pool=self.pool)\
+            .values_list("person", "rounds_since_excluded"))
+
+    def create_round(self):
+        return Round.objects.bulk_create([Round(pool=self.pool)])[0]
+
+    def test_rotation(self):
+        excluded = []
+        for _ in range(len(self.people)):
+            round = self.create_round()
+            self.assertEqual(len(get_round_participants(round)), 6)
+            excluded.append(round.excluded_id)
+        # everyone sits out once before anyone sits out twice
+        self.assertCountEqual(excluded,
+            [person.pk for person in self.people])
+        round = self.create_round()
+        get_round_participants(round)
+        self.assertEqual(round.excluded_id, excluded[0])
+        self.assertEqual(self.get_counts()[excluded[1]], 6)
+
+    def match_round(self):
+        """exclude the last person from a new round and match the rest in
+        order, after everyone was last excluded 3 rounds ago
+        """
+        PoolMembership.objects.update(rounds_since_excluded=3)
+        round = self.create_round()
+        exclude_from_round(round, self.people[6])
+        matches = Match.objects.bulk_create(
+            Match(round=round, person_1=self.people[i],
+                person_2=self.people[i + 1])
+            for i in range(0, 6, 2)
+        )
+        return round, matches
+
+    def test_rematch_odd(self):
+        round, _ = self.match_round()
+        counts = self.get_counts()
+        new_matches, left_out = rematch_dropouts(round,
+            [self.people[0], self.people[2]])
+        self.assertEqual(len(new_matches), 1)
+        # the person already excluded is left out again, without counting
+        # the round twice
+        self.assertEqual(left_out, self.people[6])
+        self.assertEqual(self.get_counts(), counts)
+
+    def test_rematch_even(self):
+        round, matches = self.match_round()
+        Match.objects.filter(pk=matches[0].pk).update(
+            conversation_id="G0000000001")
+        intro = OutboundMessage.objects.create(channel_id="G0000000001",
+            purpose="match_intro", message={"text": "Hi!"},
+            key=get_message_key("match_intro", "G0000000001",
+                match=matches[0]),
+            send_after=now())
+        new_matches, left_out = rematch_dropouts(round, [self.people[0]])
+        self.assertEqual(len(new_matches), 1)
+        self.assertIsNone(left_out)
+        # the excluded person is matched after all, so everyone's counts
+        # are as they were before the round
+        round.refresh_from_db()
+        self.assertIsNone(round.excluded)
+        self.assertEqual(set(self.get_counts().values()), {3})
+        # the dropout's match's introduction isn't sent
+        intro.refresh_from_db()
+        self.assertIsNotNone(intro.cancelled)
+
+
+@without_manifest_storage
+class AdminActionTest(TestCase):
+    """bulk actions on the admin changelists, which are only offered to
+    users with the permission they need
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser("admin", "admin@example.com", "admin")
+        # can view and change pool memberships, but not delete them
+        editor = User.objects.create_user("editor", password="editor",
+            is_staff=True)
+        editor.user_permissions.set(Permission.objects.filter(
+            codename__in=("view_poolmembership", "change_poolmembership")))
+        cls.pool = Pool.objects.create(name="Pool",
+            channel_id="C0000000001", channel_name="pool")
+        cls.people = Person.objects.bulk_create(
+            Person(user_id=f"U{i:010d}", full_name=f"Person {i}",
+                casual_name="Person", intro="Hi!")
+            for i in range(4)
+        )
+        cls.memberships = PoolMembership.objects.bulk_create(
+            PoolMembership(person=person, pool=cls.pool, available=True)
+            for person in cls.people
+        )
+
+    def setUp(self):
+        # new matches open a conversation in a Celery task
+        patcher = mock.patch.object(tasks.open_match_dm, "delay")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_action(self, model_name, action, objects, username="admin"):
+        self.client.login(username=username, password=username)
+        return self.client.post(
+            reverse(f"admin:matcher_{model_name}_changelist"),
+            {"action": action, "_selected_action": [o.pk for o in objects]},
+            follow=True)
+
+    def match_round(self):
+        round = Round.objects.bulk_create([Round(pool=self.pool)])[0]
+        matches = Match.objects.bulk_create(
+            Match(round=round, person_1=self.people[i],
+                person_2=self.people[i + 1])
+            for i in range(0, 4, 2)
+        )
+        return round, matches
+
+    def test_person_actions(self):
+        self.run_action("person", "allow_exclusion", self.people[:2])
+        self.assertEqual(
+            Person.objects.filter(can_be_excluded=True).count(), 2)
+        self.run_action("person", "disallow_exclusion", self.people[:1])
+        self.assertEqual(
+            Person.objects.filter(can_be_excluded=True).count(), 1)
+
+    def test_pool_membership_actions(self):
+        selected = self.memberships[:2]
+        for action, available in (("mark_unavailable", False),
+            ("mark_unknown", None), ("mark_available", True)):
+            self.run_action("poolmembership", action, selected)
+            self.assertEqual(list(PoolMembership.objects
+                .filter(pk__in=[m.pk for m in selected])
+                .values_list("available", flat=True)), [available] * 2)
+        self.run_action("poolmembership", "remove_from_pool", selected[:1])
+        self.assertEqual(PoolMembership.objects.count(), 3)
+
+    def test_rematch_without(self):
+        round, _ = self.match_round()
+        self.run_action("poolmembership", "rematch_without",
+            [self.memberships[0], self.memberships[2]])
+        new_match = Match.objects.get(round=round)
+        self.assertEqual({new_match.person_1, new_match.person_2},
+            {self.people[1], self.people[3]})
+
+    def test_redo_matching(self):
+        round, matches = self.match_round()
+        Match.objects.filter(pk=matches[0].pk).update(
+            conversation_id="G0000000001")
+        intro = OutboundMessage.objects.create(channel_id="G0000000001",
+            purpose="match_intro", message={"text": "Hi!"},
+            key=get_message_key("match_intro", "G0000000001",
+                match=matches[0]),
+            send_after=now())
+        self.run_action("round", "redo_matching", [round])
+        new_matches = Match.objects.filter(round=round)
+        self.assertEqual(new_matches.count(), 2)
+        self.assertFalse(new_matches.filter(
+            pk__in=[match.pk for match in matches]).exists())
+        # the deleted match's introduction isn't sent
+        intro.refresh_from_db()
+        self.assertIsNotNone(intro.cancelled)
+
+    def test_permissions(self):
+        self.client.login(username="editor", password="editor")
+        response = self.client.get(
+            reverse("admin:matcher_poolmembership_changelist"))
+        actions = [name for name, _ in
+            response.context["action_form"].fields["action"].choices]
+        self.assertIn("mark_unavailable", actions)
+        self.assertNotIn("remove_from_pool", actions)
+        self.run_action("poolmembership", "remove_from_pool",
+            self.memberships[:1], username="editor")
+        self.assertEqual(PoolMembership.objects.count(), 4)
+
+
+class DispatchTest(TestCase):
+    """queued messages are handed off to the task queue once, unless their
+    task was lost
+    """
+
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(tasks.send_msg, "delay"),
+            mock.patch.dict("matcher.delivery._send_budgets", clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.delay = tasks.send_msg.delay
+        self.outbound_messages = OutboundMessage.objects.bulk_create(
+            OutboundMessage(channel_id=f"U{i:010d}", purpose="test",
+                message={"text": "Hi!"}, send_after=now())
+            for i in range(3)
+        )
+
+    def test_dispatch_once(self):
+        self.assertEqual(len(dispatch_due_messages()), 3)
+        self.assertEqual(dispatch_due_messages(), [])
+        self.assertEqual(self.delay.call_count, 3)
+
+    def test_redispatch_lost(self):
+        lost, failed, delivered = self.outbound_messages
+        dispatched = now() - timedelta(
+            minutes=settings.OUTBOX_REDISPATCH_MINUTES + 1)
+        OutboundMessage.objects.update(dispatched=dispatched)
+        OutboundMessage.objects.filter(pk=delivered.pk).update(
+            delivered=now())
+        FailedDelivery.objects.create(task=tasks.send_msg.name,
+            args=[failed.pk], outbound_message=failed)
+        self.assertEqual(dispatch_due_messages(), [lost])
+        self.delay.assert_called_once_with(lost.pk, check_delivered=True)
+        # not again until it's been long enough since it was redispatched
+        self.assertEqual(dispatch_due_messages(), [])
+
+    def test_skip_retrying(self):
+        in_flight, retrying, lost = self.outbound_messages
+        stale = now() - timedelta(
+            minutes=settings.OUTBOX_REDISPATCH_MINUTES + 1)
+        OutboundMessage.objects.update(dispatched=stale, attempted=stale,
+            retry_after=stale)
+        # an attempt started since, or a retry scheduled by the task queue
+        OutboundMessage.objects.filter(pk=in_flight.pk).update(
+            attempted=now())
+        OutboundMessage.objects.filter(pk=retrying.pk).update(
+            retry_after=now() + timedelta(seconds=30))
+        self.assertEqual(dispatch_due_messages(), [lost])
+
+    def test_claim_once(self):
+        outbound_message = self.outbound_messages[0]
+        # read by two processes at once, and claimed by one of them
+        self.assertTrue(claim_message(outbound_message, now()))
+        self.assertFalse(claim_message(outbound_message, now()))
+        with mock.patch("matcher.delivery.claim_message",
+            return_value=False):
+            self.assertEqual(dispatch_due_messages(), [])
+        self.delay.assert_not_called()
+
+    @mock.patch.object(settings, "SLACK_SEND_RATE", 0.001)
+    @mock.patch.object(settings, "SLACK_SEND_BURST", 2)
+    def test_throttle_per_workspace(self):
+        busy, quiet = Workspace.objects.bulk_create(
+            Workspace(name=f"Workspace {i}", team_id=f"T{i:010d}",
+                api_token=f"xoxb-{i}")
+            for i in range(2)
+        )
+        OutboundMessage.objects.update(workspace=busy)
+
+        def queue_quiet_message():
+            return OutboundMessage.objects.create(workspace=quiet,
+                channel_id="U0000000009", purpose="test",
+                message={"text": "Hi!"}, send_after=now())
+
+        quiet_message = queue_quiet_message()
+        dispatched = dispatch_due_messages()
+        self.assertEqual([message.workspace_id for message in dispatched]
+            .count(busy.pk), 2)
+        self.assertIn(quiet_message, dispatched)
+        # the busy workspace's third message waits for its budget, but
+        # doesn't hold up the quiet workspace's next message
+        quiet_message = queue_quiet_message()
+        self.assertEqual(dispatch_due_messages(), [quiet_message])
+        self.assertEqual(OutboundMessage.objects.filter(workspace=busy,
+            dispatched__isnull=True).count(), 1)
+
+    def test_token_bucket(self):
+        with mock.patch("matcher.delivery.time.monotonic",
+            return_value=0) as monotonic:
+            bucket = TokenBucket(rate=2, burst=5)
+            self.assertEqual(bucket.take(10), 5)
+            self.assertEqual(bucket.take(1), 0)
+            monotonic.return_value = 1.5
+            self.assertEqual(bucket.take(10), 3)
+            bucket.give_back(2)
+            self.assertEqual(bucket.take(10), 2)
+            # refills up to the burst size
+            monotonic.return_value = 100
+            self.assertEqual(bucket.take(10), 5)
+
+    def test_put_back_if_task_queue_is_down(self):
+        self.delay.side_effect = [None, ConnectionError]
+        with self.assertRaises(ConnectionError):
+            dispatch_due_messages()
+        self.assertEqual(OutboundMessage.objects.filter(
+            dispatched__isnull=True).count(), 2)
+
+
+class DatabaseLoadTest(TestCase):
+    """SQLite is set up for concurrent writers, and the database load test
+    drives the same writes as the web server and Celery workers
+    """
+
+    def test_connection_settings(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 1000 *
+                settings.DATABASES["default"]["OPTIONS"]["timeout"])
+
+    def test_writes(self):
+        pool_people, match_ids = LoadTestDBCommand().seed(5)
+        self.assertEqual(len(pool_people), 5)
+        self.assertEqual(len(match_ids), 2)
+        webhook_write(*pool_people[0])
+        self.assertIsNotNone(PoolMembership.objects.get(
+            person__user_id=pool_people[0][1]).available)
+        worker_write(match_ids[0])
+        self.assertTrue(Match.objects.get(pk=match_ids[0]).conversation_id)
+
+    def test_load_test_db(self):
+        # the command switches to a scratch database and forks, so it's run
+        # in its own process rather than against the test database
+        result = subprocess.run([sys.executable, "manage.py",
+            "load_test_db", "--people", "20", "--rate", "40", "--duration",
+            "1", "--webhook-processes", "1", "--worker-processes", "1"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+            timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        report = dict(item.split(": ") for item in
+            result.stdout.splitlines()[-2].split(", "))
+        self.assertGreaterEqual(int(report["writes"]), 36)
+        self.assertEqual(report["lock errors"], "0")
+        self.assertEqual(report["other errors"], "0")
+        self.assertIn("Load test passed.", result.stdout)
+
+
+class LookupCacheTest(TestCase):
+    """lookups on the webhook hot path are cached until they expire or this
+    process changes them
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.person = Person.objects.create(user_id="U0000000001",
+            full_name="Person", casual_name="Person")
+        cls.pool = Pool.objects.create(name="Pool", channel_id="C0000000001",
+            channel_name="pool")
+
+    def setUp(self):
+        for cache in (person_cache, pool_cache, workspace_cache):
+            cache.clear()
+
+    def test_invalidate_person(self):
+        with self.assertNumQueries(1):
+            get_person("U0000000001")
+            get_person("U0000000001")
+        person = Person.objects.get(pk=self.person.pk)
+        person.full_name = "Renamed"
+        person.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_person("U0000000001").full_name, "Renamed")
+        person.delete()
+        with self.assertRaises(Person.DoesNotExist):
+            get_person("U0000000001")
+
+    def test_invalidate_pools(self):
+        with self.assertNumQueries(2):
+            get_pool(pk=self.pool.pk)
+            get_pool(channel_name="pool")
+            get_pool(pk=str(self.pool.pk))
+            get_pool(channel_name="pool")
+        Pool.objects.get(pk=self.pool.pk).save()
+        with self.assertNumQueries(2):
+            get_pool(pk=self.pool.pk)
+            get_pool(channel_name="pool")
+
+    def test_unknown_team_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_workspace("T0000000001"))
+            self.assertIsNone(get_workspace("T0000000001"))
+        # adding the workspace clears the cached unknown team ID
+        workspace = Workspace.objects.create(name="Other",
+            team_id="T0000000001", api_token="xoxb-other")
+        self.assertEqual(get_workspace("T0000000001"), workspace)
+
+    def test_expiry_and_eviction(self):
+        cache = LRUCache("test", max_size=2, ttl=60)
+        load = mock.Mock(side_effect=lambda: load.call_count)
+        with mock.patch("matcher.lookups.time.monotonic",
+            return_value=0) as monotonic:
+            self.assertEqual(cache.get("a", load), 1)
+            self.assertEqual(cache.get("a", load), 1)
+            monotonic.return_value = 61
+            self.assertEqual(cache.get("a", load), 2)
+            cache.get("b", load)
+            # "a" was used more recently than "b", so "b" is evicted
+            cache.get("a", load)
+            cache.get("c", load)
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertEqual(cache.get_stats(), {"size": 2, "hits": 2,
+            "misses": 4, "evictions": 1, "hit_rate": 0.333})
+
+
+class VerifySlackRequestTest(TestCase):
+    """requests are verified with the signing secret of the workspace whose
+    team ID they carry, or the default one
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Workspace.objects.create(name="Other", team_id="T0000000001",
+            api_token="xoxb-other", signing_secret="other-secret")
+
+    def setUp(self):
+        workspace_cache.clear()
+        patcher = mock.patch.object(settings, "SLACK_SIGNING_SECRET",
+            "default-secret")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def verify(self, team_id, signing_secret):
+        body, content_type = build_message_event("U0000000001", "Hi!",
+            team_id=team_id)
+        headers = sign_request(signing_secret, body)
+        request = RequestFactory().post("/slack/message/", body,
+            content_type=content_type, headers=headers)
+        response = VerifySlackRequest(lambda request: None)\
+            .process_request(request)
+        return response.status_code if response else 200
+
+    def test_workspace_secret(self):
+        self.assertEqual(self.verify("T0000000001", "other-secret"), 200)
+        self.assertEqual(self.verify("T0000000001", "default-secret"), 403)
+
+    def test_default_secret(self):
+        self.assertEqual(self.verify(None, "default-secret"), 200)
+        self.assertEqual(self.verify("T0000000002", "default-secret"), 200)
+        self.assertEqual(self.verify(None, "other-secret"), 403)
+
+
+class LoadTestHarnessTest(TestCase):
+    """the load test's fake Slack API and request builders behave like Slack,
+    and requests are answered in the workspace they came from with that
+    workspace's own client
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workspace = Workspace.objects.create(name="Other",
+            team_id="T0000000001", api_token="xoxb-other",
+            signing_secret="other-secret")
+
+    def setUp(self):
+        workspace_cache.clear()
+        self.fake_slack = FakeSlackAPI(port=0, members=["U0000000001"])
+        self.fake_slack.start()
+        self.addCleanup(self.fake_slack.stop)
+        for patcher in (
+            mock.patch.object(settings, "SLACK_API_TOKEN", "xoxb-default"),
+            mock.patch.object(settings, "SLACK_API_URL",
+                f"{self.fake_slack.url}api/"),
+            mock.patch.dict(tasks._clients, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fake_slack_api(self):
+        client = tasks.get_client()
+        self.assertEqual(client.conversations_members(channel="C0000000001")
+            ["members"], ["U0000000001"])
+        conversation_id = client.conversations_open(
+            users="U0000000001,U0000000002")["channel"]["id"]
+        self.assertEqual(conversation_id, self.fake_slack.get_conversation_id(
+            "U0000000001,U0000000002"))
+        client.chat_postMessage(channel=conversation_id, text="Hi!",
+            metadata={"event_type": "test", "event_payload": {"key": "k"}})
+        history = client.conversations_history(channel=conversation_id)
+        self.assertEqual([message["metadata"]["event_payload"]["key"]
+            for message in history["messages"]], ["k"])
+        status, _ = post_signed(f"{self.fake_slack.url}response/U0000000001",
+            b'{"text": "Hi!"}', "application/json", "secret")
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(self.fake_slack.get_replies()),
+            [conversation_id, "U0000000001"])
+        self.fake_slack.rate_limit_ratio = 1
+        self.fake_slack.retry_after = 7
+        with self.assertRaises(Exception) as context:
+            client.chat_postMessage(channel=conversation_id, text="Hi!")
+        self.assertEqual(context.exception.response.status_code, 429)
+        self.assertEqual(tasks.get_wait_time(context.exception, 0), 7)
+        self.assertEqual(self.fake_slack.rate_limited_count, 1)
+
+    def test_fire_at_rate(self):
+        results = fire_at_rate(range(5), rate=50, send=lambda request:
+            request * 2)
+        self.assertEqual(sorted(result for _, _, result in results),
+            [0, 2, 4, 6, 8])
+        starts = sorted(start for _, start, _ in results)
+        # started at the rate, not all at once
+        self.assertGreaterEqual(starts[-1] - starts[0], 4 / 50 - 0.01)
+        self.assertEqual(percentile([3, 1, 2, 4], 50), 3)
+        self.assertEqual(percentile([3, 1, 2, 4], 99), 4)
+        self.assertEqual(percentile([], 50), 0)
+
+    def test_request_workspace(self):
+        for body, content_type in (
+            build_message_event("U0000000001", "Hi!", team_id="T0000000001"),
+            build_block_action("U0000000001", "met-1", "yes",
+                team_id="T0000000001"),
+        ):
+            request = RequestFactory().post("/slack/", body,
+                content_type=content_type)
+            self.assertEqual(get_team_id(request), "T0000000001")
+            self.assertEqual(get_request_workspace(request), self.workspace)
+        body, content_type = build_block_action("U0000000001", "met-1", "yes")
+        self.assertIsNone(get_request_workspace(RequestFactory().post(
+            "/slack/", body, content_type=content_type)))
+        request = RequestFactory().post("/slack/", b"not JSON",
+            content_type="application/json")
+        self.assertIsNone(get_team_id(request))
+
+    def test_client_per_workspace(self):
+        default_client = tasks.get_client()
+        client = tasks.get_client(self.workspace)
+        self.assertIsNot(client, default_client)
+        self.assertEqual(default_client.token, "xoxb-default")
+        self.assertEqual(client.token, "xoxb-other")
+        # reused for every call in this process
+        self.assertIs(tasks.get_client(Workspace.objects.get()), client)
+        self.assertIs(tasks.get_client(None), default_client)
+        # a new token gets a new client
+        self.workspace.api_token = "xoxb-new"
+        self.assertEqual(tasks.get_client(self.workspace).token, "xoxb-new")
+        # calls are counted on the spans in progress, see `traced`
+        round = Round.objects.bulk_create([Round(pool=Pool.objects.create(
+            name="Pool", channel_id="C0000000001", channel_name="pool"))])[0]
+        with traced(round, "member_sync"):
+            client.conversations_members(channel="C0000000001")
+        self.assertEqual(RoundPhase.objects.get().slack_calls, 1)
+
+
+@mock.patch.object(settings, "AVAILABILITY_FANOUT_RATE", 10)
+class FanoutTest(TestCase):
+    """a new round's availability questions are spread over its fan-out
+    time and sent in its pool's workspace
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workspace = Workspace.objects.create(name="Other",
+            team_id="T0000000001", api_token="xoxb-other")
+        cls.pool = Pool.objects.create(name="Pool", channel_id="C0000000001",
+            channel_name="pool", workspace=cls.workspace)
+        people = Person.objects.bulk_create(
+            Person(user_id=f"U000000000{i}", user_name=f"person{i}",
+                full_name=f"Person {i}", casual_name=f"Person {i}",
+                intro="Hi!")
+            for i in range(4)
+        )
+        PoolMembership.objects.bulk_create(
+            PoolMembership(person=person, pool=cls.pool) for person in people
+        )
+
+    def setUp(self):
+        self.fake_slack = FakeSlackAPI(port=0, members=[f"U000000000{i}"
+            for i in range(4)])
+        self.fake_slack.start()
+        self.addCleanup(self.fake_slack.stop)
+        for patcher in (
+            mock.patch.object(settings, "SLACK_API_URL",
+                f"{self.fake_slack.url}api/"),
+            mock.patch.dict(tasks._clients, clear=True),
+            mock.patch.object(tasks.send_msg, "delay"),
+            mock.patch.dict("matcher.delivery._send_budgets", clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_intervals(self, round):
+        send_afters = list(OutboundMessage.objects.filter(round=round)
+            .order_by("send_after").values_list("send_after", flat=True))
+        return [(later - earlier).total_seconds()
+            for earlier, later in zip(send_afters, send_afters[1:])]
+
+    def test_spread_over_fanout_minutes(self):
+        with mock.patch.object(tasks, "get_client",
+            wraps=tasks.get_client) as get_client:
+            round = Round(pool=self.pool, fanout_minutes=2)
+            round.save()
+        get_client.assert_called_with(self.workspace)
+        self.assertEqual(self.get_intervals(round), [30, 30, 30])
+        self.assertEqual(set(OutboundMessage.objects.values_list(
+            "workspace", flat=True)), {self.workspace.pk})
+        # only the first message is due yet
+        self.assertEqual(len(dispatch_due_messages()), 1)
+        self.assertEqual(round.get_fanout_progress(), (1, 4))
+
+    def test_max_rate(self):
+        round = Round(pool=self.pool, fanout_minutes=0)
+        round.save()
+        self.assertEqual(self.get_intervals(round), [0.1, 0.1, 0.1])
+
+
+class AsyncViewTest(TestCase):
+    """the Slack webhooks run as async views, behind middleware which can all
+    run in the event loop, and reply in the workspace they were sent from
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workspace = Workspace.objects.create(name="Other",
+            team_id="T0000000001", api_token="xoxb-other",
+            signing_secret="other-secret", admin_user_id="U0000000009")
+
+    def setUp(self):
+        workspace_cache.clear()
+        patcher = mock.patch.object(settings, "SLACK_SIGNING_SECRET",
+            "default-secret")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_middleware_async_capable(self):
+        # otherwise Django runs the middleware, and everything after it, in a
+        # thread for each request
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(import_string(path).async_capable, path)
+        for view in (handle_slack_message, handle_slack_action,
+                     get_pool_stats):
+            self.assertTrue(iscoroutinefunction(view), view)
+
+    def test_with_workspace(self):
+        @with_workspace
+        async def view(request):
+            return request.workspace
+
+        def get_workspace(team_id):
+            body, content_type = build_message_event("U0000000001", "Hi!",
+                team_id=team_id)
+            return async_to_sync(view)(RequestFactory().post(
+                "/slack/message/", body, content_type=content_type))
+
+        self.assertEqual(get_workspace("T0000000001"), self.workspace)
+        self.assertIsNone(get_workspace("T0000000002"))
+        self.assertIsNone(get_workspace(None))
+
+    async def test_reply_in_workspace(self):
+        body, content_type = build_message_event("U0000000001", "Hi!",
+            team_id="T0000000001")
+        response = await self.async_client.post(reverse("slack_message"),
+            body, content_type=content_type,
+            headers=sign_request("other-secret", body))
+        self.assertEqual(response.status_code, 200)
+        outbound_message = await OutboundMessage.objects.aget(
+            purpose="unknown_message")
+        self.assertEqual(outbound_message.workspace_id, self.workspace.pk)
+        self.assertEqual(outbound_message.channel_id, "U0000000009")
+
+    async def test_reject_unsigned(self):
+        body, content_type = build_message_event("U0000000001", "Hi!",
+            team_id="T0000000001")
+        response = await self.async_client.post(reverse("slack_message"),
+            body, content_type=content_type,
+            headers=sign_request("default-secret", body))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(await OutboundMessage.objects.aexists())
+
+    def test_profile_async_request(self):
+        async def view(request):
+            return HttpResponse(await Workspace.objects.acount())
+
+        with mock.patch.object(settings, "PROFILE_REQUESTS", True), \
+            mock.patch.object(settings, "PROFILE_SAMPLE_RATE", 0), \
+            self.assertLogs("matcher.profiling") as logs:
+            middleware = ProfileRequests(view)
+            self.assertTrue(iscoroutinefunction(middleware))
+            response = async_to_sync(middleware)(
+                RequestFactory().get("/stats/pool/"))
+        self.assertEqual(response.content, b"1")
+        record = json.loads(logs.records[0].getMessage())
+        # the query ran in a thread, not in the event loop
+        self.assertEqual(record["queries"], 1)
+
+
+class ActionResponseTest(TestCase):
+    """clicking a button replaces its message using the interaction's
+    response URL, after the webhook has returned, or sends a new message if
+    that fails
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pool = Pool.objects.create(name="Pool",
+            channel_id="C0000000001", channel_name="pool")
+        person = Person.objects.create(user_id="U0000000001",
+            full_name="Person", casual_name="Person")
+        PoolMembership.objects.create(person=person, pool=cls.pool)
+
+    def setUp(self):
+        workspace_cache.clear()
+        self.fake_slack = FakeSlackAPI(port=0)
+        self.fake_slack.start()
+        self.addCleanup(self.fake_slack.stop)
+        for patcher in (
+            mock.patch.object(settings, "SLACK_SIGNING_SECRET", "secret"),
+            mock.patch.object(settings, "SLACK_API_URL",
+                f"{self.fake_slack.url}api/"),
+            mock.patch.dict(tasks._clients, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Celery's settings can't be patched with `mock.patch.object`
+        self.addCleanup(setattr, tasks.app.conf, "task_always_eager",
+            tasks.app.conf.task_always_eager)
+        tasks.app.conf.task_always_eager = True
+        self.response_url = f"{self.fake_slack.url}response/U0000000001"
+
+    def click(self, value):
+        body, content_type = build_block_action("U0000000001",
+            f"availability-{self.pool.pk}", value,
+            response_url=self.response_url)
+        return self.client.post(reverse("slack_action"), body,
+            content_type=content_type,
+            headers=sign_request("secret", body))
+
+    def test_respond_after_returning(self):
+        with mock.patch.object(tasks.respond_to_action, "delay") as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.click("yes")
+            self.assertEqual(response.status_code, 200)
+            # nothing is sent to Slack until the webhook's changes are saved
+            delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+        delay.assert_called_once()
+        self.assertEqual(delay.call_args.args[:3], (self.response_url,
+            "U0000000001", messages.UPDATED_AVAILABLE))
+
+    def test_respond_with_response_url(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.click("no")
+        responses = self.fake_slack.calls["response"]
+        self.assertEqual(len(responses), 1)
+        self.assertTrue(responses[0][1]["replace_original"])
+        self.assertEqual(responses[0][1]["text"],
+            messages.UPDATED_UNAVAILABLE)
+        self.assertFalse(OutboundMessage.objects.filter(
+            purpose="action_response").exists())
+
+    def test_fall_back_to_new_message(self):
+        self.fake_slack.rate_limit_ratio = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            self.click("no")
+        self.assertEqual(OutboundMessage.objects.get(
+            purpose="action_response").message,
+            {"text": messages.UPDATED_UNAVAILABLE})
+
+
+@mock.patch.object(settings, "SCHEDULE_STAGGER_MINUTES", 15)
+@mock.patch.object(settings, "AVAILABILITY_FANOUT_MINUTES", 30)
+class ScheduleTest(TestCase):
+    """pools scheduled at the same time are staggered, each round starting
+    once the previous one's fan-out is over, and each action runs once
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pools = Pool.objects.bulk_create(
+            Pool(name=f"Pool {i}", channel_id=f"C{i:010d}",
+                channel_name=f"pool-{i}")
+            for i in range(3)
+        )
+        # asking at 10:00 UTC and matching at 14:00 every Monday
+        Schedule.objects.bulk_create(
+            Schedule(pool=pool, start_date=date(2026, 1, 5))
+            for pool in pools
+        )
+        Schedule.objects.update(created=datetime(2026, 1, 1, tzinfo=pytz.utc))
+
+    def setUp(self):
+        self.schedules = list(Schedule.objects.select_related("pool")
+            .order_by("pool"))
+
+    def get_run_ats(self, start, end, runs=()):
+        return [(kind, schedule.pool.name, run_at.strftime("%H:%M"))
+            for run_at, _, kind, schedule, _ in get_scheduled_actions(
+                self.schedules, start, end, runs)]
+
+    def test_stagger(self):
+        self.assertEqual(self.get_run_ats(
+            datetime(2026, 10, 5, tzinfo=pytz.utc),
+            datetime(2026, 10, 6, tzinfo=pytz.utc)), [
+            ("ask", "Pool 0", "10:00"),
+            ("ask", "Pool 1", "10:30"),
+            ("ask", "Pool 2", "11:00"),
+            ("match", "Pool 0", "14:00"),
+            ("match", "Pool 1", "14:15"),
+            ("match", "Pool 2", "14:30"),
+        ])
+
+    def test_pinned_per_slot(self):
+        # however the scheduler's window slides, each action is due at the
+        # same time
+        run_ats = set()
+        for minutes in range(0, 120, 5):
+            end = datetime(2026, 10, 5, 9, 30, tzinfo=pytz.utc) + \
+                timedelta(minutes=minutes)
+            run_ats.update(self.get_run_ats(end - timedelta(hours=1), end))
+        self.assertEqual(sorted(run_ats), [
+            ("ask", "Pool 0", "10:00"),
+            ("ask", "Pool 1", "10:30"),
+            ("ask", "Pool 2", "11:00"),
+        ])
+
+    def test_stagger_by_recorded_fanout(self):
+        scheduled_for = datetime(2026, 10, 5, 10, tzinfo=pytz.utc)
+        round = Round.objects.bulk_create([Round(pool=self.schedules[0].pool,
+            fanout_minutes=60)])[0]
+        run = ScheduleRun.objects.create(schedule=self.schedules[0],
+            kind="ask", scheduled_for=scheduled_for,
+            run_at=scheduled_for + timedelta(minutes=5), round=round)
+        self.assertEqual(self.get_run_ats(scheduled_for,
+            scheduled_for + timedelta(hours=2), [run]), [
+            ("ask", "Pool 0", "10:05"),
+            ("ask", "Pool 1", "11:05"),
+            ("ask", "Pool 2", "11:35"),
+        ])
+
+    @mock.patch("matcher.models.get_channel_members", return_value=[])
+    def test_run_once(self, get_channel_members):
+        now = datetime(2026, 10, 5, 10, 31, tzinfo=pytz.utc)
+        runs = run_due_schedules(now)
+        self.assertEqual([(run.schedule.pool.name, run.kind, run.succeeded)
+            for run in runs], [("Pool 0", "ask", True),
+            ("Pool 1", "ask", True)])
+        self.assertEqual(Round.objects.count(), 2)
+        self.assertEqual(run_due_schedules(now), [])
+        # another scheduler process claiming an action that already ran
+        run_at, scheduled_for, kind, schedule, ask_time = \
+            get_scheduled_actions(self.schedules, now - timedelta(hours=1),
+                now)[0]
+        self.assertIsNone(run_action(schedule, kind, scheduled_for, run_at,
+            ask_time))
+        self.assertEqual(Round.objects.count(), 2)
+        # matching matches the rounds the schedules created, and fails for
+        # the pool whose round was due after the scheduler stopped
+        with mock.patch("matcher.scheduling.match") as match:
+            runs = run_due_schedules(now + timedelta(hours=4))
+        self.assertEqual([(run.schedule.pool.name, run.kind, run.succeeded)
+            for run in runs], [("Pool 0", "match", True),
+            ("Pool 1", "match", True), ("Pool 2", "match", False)])
+        self.assertEqual([call.args[0] for call in match.call_args_list],
+            [run.round for run in runs[:2]])
+
+
+class TracingTest(TestCase):
+    """spans of work are added up per phase of a round, and shown with the
+    phases worked out from the round's messages and matches
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        pool = Pool.objects.create(name="Pool", channel_id="C0000000001",
+            channel_name="pool")
+        cls.round = Round.objects.bulk_create([Round(pool=pool)])[0]
+        cls.people = Person.objects.bulk_create(
+            Person(user_id=f"U000000001{i}", user_name=f"person{i}",
+                full_name=f"Person {i}", casual_name=f"Person {i}")
+            for i in range(2))
+
+    def test_traced(self):
+        with traced(self.round, "matching") as span:
+            list(Person.objects.all())
+            count_slack_call()
+        with self.assertRaises(ValueError):
+            with traced(self.round, "matching"):
+                raise ValueError
+        phase = RoundPhase.objects.get(round=self.round, name="matching")
+        self.assertEqual(phase.span_count, 2)
+        self.assertEqual(phase.started, span.started)
+        self.assertEqual(phase.query_count, 1)
+        self.assertEqual(phase.slack_calls, 1)
+        self.assertEqual(phase.errors, 1)
+
+    def test_retries_counted_once_per_attempt(self):
+        fake_slack = FakeSlackAPI(port=0)
+        fake_slack.start()
+        self.addCleanup(fake_slack.stop)
+        for patcher in (
+            mock.patch.object(settings, "SLACK_API_URL",
+                f"{fake_slack.url}api/"),
+            mock.patch.dict(tasks._clients, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        match = Match.objects.bulk_create([Match(person_1=self.people[0],
+            person_2=self.people[1], round=self.round)])[0]
+        # the first attempt and three retries
+        for retries in range(4):
+            tasks.open_match_dm.apply(args=(match.pk,), retries=retries)
+        phase = RoundPhase.objects.get(round=self.round, name="dm_opening")
+        self.assertEqual(phase.span_count, 4)
+        self.assertEqual(phase.retries, 3)
+
+    def test_get_round_timings(self):
+        start = now()
+        Match.objects.bulk_create([Match(person_1=self.people[0],
+            person_2=self.people[1], round=self.round, met=True)])
+        OutboundMessage.objects.bulk_create([
+            OutboundMessage(round=self.round, purpose="availability",
+                channel_id="U0000000010", message={}, send_after=start,
+                attempts=2, delivered=start + timedelta(seconds=90)),
+            OutboundMessage(round=self.round, purpose="availability",
+                channel_id="U0000000011", message={}, send_after=start,
+                attempts=1),
+            OutboundMessage(round=self.round, purpose="ask_if_met",
+                channel_id="U0000000010", message={}, send_after=start),
+        ])
+        matching_start = start + timedelta(hours=2)
+        RoundPhase.objects.bulk_create([
+            RoundPhase(round=self.round, name="matching",
+                started=matching_start,
+                finished=matching_start + timedelta(seconds=1.8),
+                span_count=1, busy_seconds=1.8, query_count=12),
+            RoundPhase(round=self.round, name="dm_opening",
+                started=matching_start,
+                finished=matching_start + timedelta(seconds=60),
+                span_count=2, busy_seconds=3, query_count=8, slack_calls=4,
+                retries=1),
+        ])
+        self.assertEqual(get_round_timings(self.round), [
+            ("availability fan-out",
+                "1m30s, 1 of 2 messages delivered, 1 retries"),
+            ("response window", "1h58m"),
+            ("matching", "1.8s, 12 queries"),
+            ("opening match conversations", "1m00s (3.0s busy over 2 "
+                "spans), 8 queries, 4 Slack calls, 1 retries"),
+            ("met feedback", "1 of 1 matches answered, 1 people asked"),
+        ])
+
+
+class PairingTest(SimpleTestCase):
+    """pairing ranks who to pair people with by the matching rules and past
+    pairings, and sharded pairing keeps to them like pairing everyone at
+    once
+    """
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.person_ids = list(range(1, 201))
+        rng.shuffle(self.person_ids)
+        attributes = {person_id: {"team": person_id % 20,
+            "office": [person_id % 3, "remote"] if person_id % 7 == 0
+                else person_id % 3}
+            for person_id in self.person_ids}
+        self.avoid, self.prefer_different = compile_constraints(attributes,
+            [("team", AVOID_SAME), ("office", PREFER_DIFFERENT)])
+        # everyone's last pairing
+        self.past_partners = {}
+        for person_1_id, person_2_id in zip(self.person_ids[::2],
+            self.person_ids[1::2]):
+            self.past_partners[person_1_id] = {person_2_id}
+            self.past_partners[person_2_id] = {person_1_id}
+        rng.shuffle(self.person_ids)
+
+    def assertPairsFollowRules(self, pairs):
+        self.assertCountEqual(
+            [person_id for pair in pairs for person_id in pair],
+            self.person_ids)
+        for person_1_id, person_2_id in pairs:
+            self.assertFalse(self.avoid[person_1_id] &
+                self.avoid[person_2_id])
+            self.assertNotIn(person_2_id, self.past_partners[person_1_id])
+
+    def test_sharded(self):
+        pairs, leftovers = pair_people(self.person_ids, self.past_partners,
+            self.avoid, self.prefer_different, allow_duplicates=True)
+        self.assertEqual(leftovers, [])
+        self.assertPairsFollowRules(pairs)
+        sharded_pairs = pair_shards(make_shards(self.person_ids, 50),
+            self.past_partners, self.avoid, self.prefer_different,
+            workers=1)
+        self.assertPairsFollowRules(sharded_pairs)
+
+    def test_compile_constraints(self):
+        avoid, prefer_different = compile_constraints({
+            1: {"team": "a", "office": ["x", "remote"]},
+            2: {"team": "b", "office": "remote"},
+            3: {"team": "a", "office": ""},
+            4: {"office": None},
+        }, [("team", AVOID_SAME), ("office", PREFER_DIFFERENT)])
+        # people without a value for a rule's attribute have no mask for it
+        self.assertEqual(set(avoid), {1, 2, 3})
+        self.assertEqual(set(prefer_different), {1, 2})
+        # one bit per (attribute, value), so people share a bit exactly
+        # when they share a value
+        self.assertTrue(avoid[1] & avoid[3])
+        self.assertFalse(avoid[1] & avoid[2])
+        self.assertEqual(bin(prefer_different[1]).count("1"), 2)
+        self.assertTrue(prefer_different[1] & prefer_different[2])
+        self.assertFalse(avoid[1] & prefer_different[1])
+        # values are compared as strings, and bits are shared across rules
+        # on the same attribute and value
+        avoid, prefer_different = compile_constraints(
+            {1: {"floor": 2}, 2: {"floor": "2"}},
+            [("floor", AVOID_SAME), ("floor", PREFER_DIFFERENT)])
+        self.assertEqual(avoid[1], avoid[2])
+        self.assertEqual(avoid, prefer_different)
+
+    def test_pair_people_ranking(self):
+        avoid = {1: 0b1, 2: 0b1}
+        prefer_different = {1: 0b10, 3: 0b10}
+        past_partners = {1: {4}, 4: {1}}
+        # each candidate for person 1 breaks something, and the one breaking
+        # the least important thing is picked: a "prefer different" rule,
+        # then a past pairing, then an "avoid same" rule
+        for candidates, partner in (
+            ([2, 4, 3], 3),
+            ([2, 4], 4),
+            ([2], 2),
+        ):
+            pairs, leftovers = pair_people([1, *candidates], past_partners,
+                avoid, prefer_different, allow_duplicates=True)
+            self.assertEqual(pairs[0], (1, partner))
+        # someone breaking nothing is picked over everyone before them
+        pairs, _ = pair_people([1, 2, 4, 3, 5], past_partners, avoid,
+            prefer_different)
+        self.assertEqual(pairs[0], (1, 5))
+        # without duplicates allowed, only "prefer different" can be broken
+        self.assertEqual(pair_people([1, 3], past_partners, avoid,
+            prefer_different), ([(1, 3)], []))
+        self.assertEqual(pair_people([1, 4, 2], past_partners, avoid,
+            prefer_different), ([(4, 2)], [1]))
+
+
+class MessageTemplateTest(SimpleTestCase):
+    """the compiled block templates and cached blockquotes render the
+    expected messages
+    """
+
+    def test_block_templates(self):
+        pool = Pool(id=1, name="Pool", channel_id="C0000000001",
+            channel_name="pool")
+        # braces in names aren't treated as format fields
+        person = Person(user_id="U0000000001", full_name="Person {1}",
+            casual_name="Person")
+        dictionary = {"pool": pool, "person": person, "other_person": person}
+        templates = copy.deepcopy(messages.BLOCKS)
+
+        def get_actions(action, yes, no):
+            return {"type": "actions", "block_id": f"{action}-2",
+                "elements": [
+                    {"type": "button", "style": "primary", "value": "yes",
+                        "text": {"type": "plain_text", "text": yes}},
+                    {"type": "button", "value": "no",
+                        "text": {"type": "plain_text", "text": no}},
+                ]}
+
+        self.assertEqual(
+            messages.format_block_text("ASK_IF_MET", 2, dictionary), [
+            {"type": "section", "text": {"type": "mrkdwn",
+                "text": "Last time in <#C0000000001|pool>, you paired with "
+                    "Person {1} (<@U0000000001>). Did you have a chance to "
+                    "meet with Person?"}},
+            get_actions("met", "Yes, we met", "No, we didn’t meet"),
+        ])
+        self.assertEqual(
+            messages.format_block_text("ASK_IF_AVAILABLE", 2, dictionary), [
+            {"type": "section", "text": {"type": "mrkdwn",
+                "text": "Hey Person, want to be paired to meet someone new "
+                    "in <#C0000000001|pool> this week?"}},
+            get_actions("availability", "Yes, I want to be paired",
+                "Not this time"),
+        ])
+        # the templates aren't changed by rendering them
+        self.assertEqual(messages.BLOCKS, templates)
+
+    def test_blockquote(self):
+        for message, quoted in (
+            ("Hi!", "> Hi!"),
+            ("Hi!\n\nI'm new.\n", "> Hi!\n> \n> I'm new.\n> "),
+            ("\n> quoted", "> \n> > quoted"),
+        ):
+            self.assertEqual(blockquote(message), quoted)
+            # cached, and the same the second time
+            self.assertEqual(blockquote(message), quoted)
+        self.assertIsNone(blockquote(""))
@@ -0,0 +1,215 @@
+"""timing spans for the phases of a Round, like syncing members or opening
+match conversations. a span records how long a piece of work took and how
+many database queries and Slack API calls it made, and is added to the
+Round's RoundPhase for its phase, which is shown on the Round admin change
+page
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+# spans in progress in this thread, innermost last
+_local = threading.local()
+
+# phases in the order they happen in a round, with their display names
+PHASES = (
+    ("member_sync", "member sync"),
+    ("fanout", "availability fan-out"),
+    ("response_window", "response window"),
+    ("participants", "choosing participants"),
+    ("matching", "matching"),
+    ("dm_opening", "opening match conversations"),
+    ("met_feedback", "met feedback"),
+)
+
+
+class Span:
+    """a timed piece of work in a phase of a round"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = timezone.now()
+        self.finished = None
+        self.query_count = 0
+        self.slack_calls = 0
+        self.retries = 0
+        self.errors = 0
+
+    @property
+    def seconds(self):
+        return ((self.finished or timezone.now()) - self.started)\
+            .total_seconds()
+
+
+def get_spans():
+    if not hasattr(_local, "spans"):
+        _local.spans = []
+    return _local.spans
+
+
+@contextmanager
+def trace(name):
+    """time the work done in this context as a Span named `name`, counting
+    its database queries and Slack API calls. an exception counts as an
+    error on the span and is reraised
+    """
+    span = Span(name)
+
+    def count_query(execute, sql, params, many, context):
+        span.query_count += 1
+        return execute(sql, params, many, context)
+
+    get_spans().append(span)
+    try:
+        with connection.execute_wrapper(count_query):
+            yield span
+    except BaseException:
+        span.errors += 1
+        raise
+    finally:
+        span.finished = timezone.now()
+        get_spans().remove(span)
+
+
+def count_slack_call():
+    """count a Slack API call on the spans in progress, see `get_client`"""
+    for span in get_spans():
+        span.slack_calls += 1
+
+
+def record_span(round_id, span):
+    """add a finished Span to the RoundPhase for its phase of the Round with
+    `round_id`. timing is only informational, so failing to record it is
+    logged rather than raised
+    """
+    try:
+        _record_span(round_id, span)
+    except Exception as exception: # see [1] in ./tasks.py
+        logger.warning(f"Failed to record timing for \"{span.name}\" in "
+            f"round {round_id}: {exception}")
+
+
+def _record_span(round_id, span):
+    # import within the function to avoid a circular ImportError
+    from .models import RoundPhase
+    phase, created = RoundPhase.objects.get_or_create(round_id=round_id,
+        name=span.name, defaults={
+            "started": span.started,
+            "finished": span.finished,
+            "span_count": 1,
+            "busy_seconds": span.seconds,
+            "query_count": span.query_count,
+            "slack_calls": span.slack_calls,
+            "retries": span.retries,
+            "errors": span.errors,
+        })
+    if not created:
+        # add to the totals in a single UPDATE, as spans of the same phase
+        # can finish at the same time in different processes
+        RoundPhase.objects.filter(pk=phase.pk).update(
+            started=Least("started", Value(span.started)),
+            finished=Greatest("finished", Value(span.finished)),
+            span_count=F("span_count") + 1,
+            busy_seconds=F("busy_seconds") + span.seconds,
+            query_count=F("query_count") + span.query_count,
+            slack_calls=F("slack_calls") + span.slack_calls,
+            retries=F("retries") + span.retries,
+            errors=F("errors") + span.errors,
+        )
+
+
+@contextmanager
+def traced(round, name):
+    """time the work done in this context as a Span named `name`, and add it
+    to the Round's phase when it finishes, even if it raised an exception
+    """
+    span = None
+    try:
+        with trace(name) as span:
+            yield span
+    finally:
+        if span:
+            record_span(round.pk, span)
+
+
+def format_duration(seconds):
+    """format a number of seconds like "1.8s", "4m12s" or "2h5m" """
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes < 60:
+        return f"{minutes}m{seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m"
+
+
+def get_round_timings(round):
+    """return a list of (phase name, summary) for each phase of a Round
+    with timing, like ("matching", "1.8s, 12 queries"). the fan-out, response
+    window and met feedback phases are worked out from the round's messages
+    and matches rather than recorded as spans
+    """
+    # import within the function to avoid a circular ImportError
+    from django.db.models import Count, Max, Min, Q, Sum
+    from .models import Match, OutboundMessage, RoundPhase
+    phases = {phase.name: phase
+        for phase in RoundPhase.objects.filter(round=round)}
+    is_fanout = Q(purpose__in=("availability", "welcome"))
+    fanout = OutboundMessage.objects.filter(round=round).aggregate(
+        total=Count("pk", filter=is_fanout),
+        delivered_count=Count("pk",
+            filter=is_fanout & Q(delivered__isnull=False)),
+        first=Min("send_after", filter=is_fanout),
+        last=Max("delivered", filter=is_fanout),
+        retries=Sum(F("attempts") - 1, filter=is_fanout & Q(attempts__gt=1),
+            default=0),
+        asked_if_met=Count("pk", filter=Q(purpose="ask_if_met",
+            cancelled__isnull=True)),
+    )
+    timings = {}
+    for name, phase in phases.items():
+        summary = format_duration(phase.busy_seconds)
+        if phase.span_count > 1:
+            elapsed = (phase.finished - phase.started).total_seconds()
+            summary = f"{format_duration(elapsed)} ({summary} busy over "\
+                f"{phase.span_count} spans)"
+        details = [summary, f"{phase.query_count} queries"]
+        if phase.slack_calls:
+            details.append(f"{phase.slack_calls} Slack calls")
+        if phase.retries:
+            details.append(f"{phase.retries} retries")
+        if phase.errors:
+            details.append(f"{phase.errors} errors")
+        timings[name] = ", ".join(details)
+    if fanout["total"]:
+        details = [f"{fanout['delivered_count']} of {fanout['total']} messages "
+            "delivered"]
+        if fanout["last"]:
+            details.insert(0, format_duration(
+                (fanout["last"] - fanout["first"]).total_seconds()))
+        details.append(f"{fanout['retries']} retries")
+        timings["fanout"] = ", ".join(details)
+    # from when the last availability message was sent until matching
+    window_start = fanout["last"] or getattr(phases.get("member_sync"),
+        "finished", None)
+    matching = phases.get("participants") or phases.get("matching")
+    if window_start and matching:
+        timings["response_window"] = format_duration(
+            max(0, (matching.started - window_start).total_seconds()))
+    if fanout["asked_if_met"] or "matching" in phases:
+        met = Match.objects.filter(round=round).aggregate(
+            total=Count("pk"), answered=Count("pk",
+                filter=Q(met__isnull=False)))
+        timings["met_feedback"] = f"{met['answered']} of {met['total']} "\
+            f"matches answered, {fanout['asked_if_met']} people asked"
+    return [(label, timings[name]) for name, label in PHASES
+        if name in timings]
@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 
 # regex for a user or channel mention at the beginning of a message
@@ -7,14 +8,6 @@ import re
 MENTION_PATTERN = r"(?:^\s?<@(.*?)>\s?)|(?:^\s?<#(.*?)\|.*?>\s?)"
 
 
-def get_set_element(_set):
-    """get the element from the set to which the iterator points; returns an
-    arbitrary item
-    """
-    for element in _set:
-        return element
-
-
 def get_person_from_match(user_id, match):
     """given a Match, return the Person corresponding to the passed user ID
     """
@@ -40,12 +33,15 @@ def get_other_person_from_match(user_id, match):
             f"the passed match ({match}).")
 
 
+# intros are quoted in every match they're in, so each process keeps the
+# most recently quoted ones. a changed intro is a new key
+@lru_cache(maxsize=4096)
 def blockquote(message):
     """return `message` with markdown blockquote formatting (start each line
     with "> ")
     """
     if message:
-        return re.sub(r"^", "> ", message, flags=re.MULTILINE)
+        return "> " + message.replace("\n", "\n> ")
     else:
         return None
 
@@ -1,25 +1,31 @@
 import json
 import logging
 
+from asgiref.sync import sync_to_async
+from django.db import transaction
 from django.http import HttpResponse, JsonResponse
 from django.views.generic.base import TemplateView
 from django.utils.decorators import decorator_from_middleware
 from django.views.decorators.cache import cache_page
 
 import matcher.messages as messages
-from meetups.settings import DEBUG, ADMIN_SLACK_USER_ID
+from meetups.settings import DEBUG
 from .constants import QUESTIONS
-from .middleware import VerifySlackRequest
+from .archive import (get_archived_match, get_archived_stats_matches,
+                      set_archived_met)
+from .feedback import cancel_met_prompts
+from .lookups import get_person, get_pool
+from .middleware import VerifySlackRequest, with_workspace
 from .models import (Person, Match, Pool, PoolMembership, Round,
+                     ArchivedRound, queue_message, get_admin_user_id,
                      get_channel_members as get_channel_members_list)
-from .tasks import client, send_msg, ask_if_met
+from .tasks import get_client, ask_if_met, respond_to_action
 from .utils import (get_person_from_match, get_other_person_from_match,
                     blockquote, get_mention, remove_mention)
 
 
 logger = logging.getLogger(__name__)
 
-
 class HomePageView(TemplateView):
     template_name = "index.html"
 
@@ -31,8 +37,16 @@ class HomePageView(TemplateView):
         return context
 
 
+# the Slack webhook views and the stats API are async, so that when the app is
+# served over ASGI (see `meetups/asgi.py`) a request waiting on the database
+# or Slack doesn't tie up a whole worker. they validate requests in the event
+# loop and hand off to the (sync) handler functions below, which run in a
+# thread with their own database connection. replies are sent in the
+# workspace the request came from, see `with_workspace`
+
+@with_workspace
 @decorator_from_middleware(VerifySlackRequest)
-def handle_slack_message(request):
+async def handle_slack_message(request):
     """validate that an incoming Slack message is well-formed enough to
     continue processing, and if so send to its appropriate handler function
     """
@@ -63,13 +77,17 @@ def handle_slack_message(request):
     # send a message to that Slack user from the bot.
     message_sender = event.get("user")
     message_text = event.get("text")
-    if message_sender == ADMIN_SLACK_USER_ID and get_mention(message_text):
-        return send_message_as_bot(message_text)
-    return respond_to_user(req["event"])
+    if message_sender == get_admin_user_id(request.workspace) and \
+        get_mention(message_text):
+        return await sync_to_async(send_message_as_bot)(message_text,
+            request.workspace)
+    return await sync_to_async(respond_to_user)(req["event"],
+        request.workspace)
 
 
+@with_workspace
 @decorator_from_middleware(VerifySlackRequest)
-def handle_slack_action(request):
+async def handle_slack_action(request):
     """validate that an incoming Slack action is well-formed enough to
     continue processing, and if so send to its appropriate handler function
     """
@@ -104,54 +122,69 @@ def handle_slack_action(request):
     except KeyError:
         return JsonResponse(status=400, 
             data={"error": f"unknown action \"{action.get('block_id')}\""})
-    return action_func(req, action, block_id)
+    return await sync_to_async(action_func)(req, action, block_id,
+        request.workspace)
 
 @cache_page(60 * 30) # cache response for 30 minutes
-def get_pool_stats(request, channel_name):
-    """validate that an incoming Slack message is well-formed enough to
-    continue processing, and if so send to its appropriate handler function
-    """
+async def get_pool_stats(request, channel_name):
+    """return the stats for a pool's stats page as JSON"""
     if request.method != "GET":
         return JsonResponse(status=405,
             data={"error": f"\"{request.method}\" method not supported"})
     try:
-        pool = Pool.objects.get(channel_name=channel_name)
+        pool = await sync_to_async(get_pool)(channel_name=channel_name)
     except Pool.DoesNotExist:
         return JsonResponse(status=404,
             data={"error": f"pool with channel name {channel_name} does not "
                             "exist"})
+    # run the queries together in one thread rather than switching threads
+    # for each one
+    return JsonResponse(await sync_to_async(get_stats)(pool))
+
+
+def get_stats(pool):
+    """return a dict of the participants, rounds and matches in a pool, for
+    its stats page
+    """
     most_recent_round = Round.objects.filter(pool=pool).latest("end_date")
     # exclude the most recent round because we won't have info yet on who met
     # up from it, so including it would skew the statistics
-    matches = Match.objects.filter(round__pool=pool)\
-        .exclude(round=most_recent_round)
-    match_people = set([match.person_1.pk for match in matches] +
-                        [match.person_2.pk for match in matches])
-    return JsonResponse({
+    matches = list(Match.objects.filter(round__pool=pool)\
+        .exclude(round=most_recent_round)\
+        .values("id", "person_1", "person_2", "met"))
+    # include matches from archived rounds, which are summarized by pair
+    matches += get_archived_stats_matches(pool)
+    match_people = set([match["person_1"] for match in matches] +
+                        [match["person_2"] for match in matches])
+    return {
         "name": pool.name,
         "participant_count": len(match_people),
         "people": list(Person.objects.filter(pk__in=match_people)\
             .values("id", "full_name")),
         "round_count": Round.objects.filter(pool=pool)\
-            .exclude(pk=most_recent_round.pk).count(),
-        "matches": list(matches.values("id", "person_1", "person_2",
-            "met"))
-    })
+            .exclude(pk=most_recent_round.pk).count() +
+            ArchivedRound.objects.filter(pool=pool).count(),
+        "matches": matches
+    }
 
 
-def respond_to_user(event):
-    """respond to an incoming Slack message with a message from the bot"""
+def respond_to_user(event, workspace=None):
+    """respond to an incoming Slack message from a Workspace (or the default
+    workspace) with a message from the bot
+    """
     user_id = event.get("user")
     message_text = event.get("text", "")
     # if no user ID is attached to the message, do nothing. this happens
     # sometimes, not sure why
     if user_id is None:
         return HttpResponse(204)
+    # not cached (see `matcher/lookups.py`), because `last_query` changes
+    # with every question the bot asks and determines how to reply
     try:
         person = Person.objects.get(user_id=user_id)
     except Person.DoesNotExist:
         # user is not registered with the bot
-        return handle_unknown_message(user_id, message_text)
+        return handle_unknown_message(user_id, message_text, workspace)
     message_map = {
         QUESTIONS["add_intro"]: add_intro,
         QUESTIONS["update_intro"]: update_intro,
@@ -163,14 +196,14 @@ def respond_to_user(event):
     if not query:
         # the bot isn't expecting a particular reply from the user and is
         # unable to determine intent from the message
-        return handle_unknown_message(user_id, message_text)
+        return handle_unknown_message(user_id, message_text, workspace)
     try:
         handler_func = message_map[query]
     except KeyError:
         logger.error(f"Unknown last query for {person}: {query}")
         return JsonResponse(status=500,
             data={"error": f"unknown last query \"{query}\""})
-    return handler_func(event, person)
+    return handler_func(event, person, workspace)
 
 
 def determine_user_intent(message):
@@ -184,58 +217,64 @@ def determine_user_intent(message):
         return None
 
 
-def add_intro(event, person):
+def add_intro(event, person, workspace=None):
     """"set the user's message to their intro and welcome them
     """
-    # onboard new Person
-    person.intro = event.get("text", "")
-    person.last_query = None
-    person.save()
-    # automatically set the Person to available for their first time
-    # if people have an issue with this, they can contact
-    # `ADMIN_SLACK_USER_ID`. Might revisit if this causes issues.
-    PoolMembership.objects.filter(person=person).update(available=True)
-    logger.info(f"Onboarded {person} with intro!")
     message = messages.INTRO_RECEIVED.format(person=person)
-    if ADMIN_SLACK_USER_ID:
+    if get_admin_user_id(workspace):
         message += (" " + messages.INTRO_RECEIVED_QUESTIONS)
-    send_msg.delay(person.user_id, text=message)
+    with transaction.atomic():
+        # onboard new Person
+        person.intro = event.get("text", "")
+        person.last_query = None
+        person.save()
+        # automatically set the Person to available for their first time
+        # if people have an issue with this, they can contact
+        # `ADMIN_SLACK_USER_ID`. Might revisit if this causes issues.
+        PoolMembership.objects.filter(person=person).update(available=True)
+        queue_message(person.user_id, "intro_received",
+            workspace=workspace, text=message)
+    logger.info(f"Onboarded {person} with intro!")
     return HttpResponse(204)
 
 
-def prompt_intro_update(event, person):
+def prompt_intro_update(event, person, workspace=None):
     """"prompt the user to update their intro
     """
     message = messages.UPDATE_INTRO_INSTRUCTIONS.format(
         person=person,
         person_intro=blockquote(person.intro)
     )
-    send_msg.delay(person.user_id, text=message)
-    person.last_query = QUESTIONS["update_intro"]
-    person.save()
+    with transaction.atomic():
+        person.last_query = QUESTIONS["update_intro"]
+        person.save()
+        queue_message(person.user_id, "update_intro_instructions",
+            workspace=workspace, text=message)
     return HttpResponse(204)
 
 
-def update_intro(event, person):
+def update_intro(event, person, workspace=None):
     """"update the user's intro with the message text they sent
     """
     # update Person's intro
     person.intro = event.get("text", "")
     person.last_query = None
-    person.save()
-    # automatically set the Person to available for their first time
-    # if people have an issue with this, they can contact
-    # `ADMIN_SLACK_USER_ID`. Might revisit if this causes issues.
-    logger.info(f"Updated intro for {person}")
     message = messages.INTRO_UPDATED.format(
         person=person,
         person_intro=blockquote(person.intro)
     )
-    send_msg.delay(person.user_id, text=message)
+    with transaction.atomic():
+        person.save()
+        queue_message(person.user_id, "intro_updated", workspace=workspace,
+            text=message)
+    # automatically set the Person to available for their first time
+    # if people have an issue with this, they can contact
+    # `ADMIN_SLACK_USER_ID`. Might revisit if this causes issues.
+    logger.info(f"Updated intro for {person}")
     return HttpResponse(204)
 
 
-def update_availability(payload, action, pool_id):
+def update_availability(payload, action, pool_id, workspace=None):
     """update a Person's availability based on their yes/no answer, and follow
     up asking if they met with their last Match, if any, and we don't know yet
     """
@@ -252,32 +291,35 @@ def update_availability(payload, action, pool_id):
         return JsonResponse(status=400, 
             data={"error": "request payload is missing user ID"})
     try:
-        pool = Pool.objects.get(pk=pool_id)
+        pool = get_pool(pk=pool_id)
     except Pool.DoesNotExist:
         return JsonResponse(status=400, 
             data={"error": f"pool does not exist with id {pool_id}"})
-    person = Person.objects.get(user_id=user_id)
-    try:
-        pool_membership = PoolMembership.objects.get(pool=pool, person=person)
-    except PoolMembership.DoesNotExist:
+    person = get_person(user_id)
+    # write only the changed column in a single autocommitted UPDATE to keep
+    # the database write lock as short as possible. no rows being updated
+    # means they aren't in the pool, so there's no need to look up their
+    # membership first
+    updated = PoolMembership.objects.filter(pool=pool, person=person)\
+        .update(available=available)
+    if not updated:
         return JsonResponse(status=400,
             data={"error": f"pool membership does not exist with pool: "\
                 f"{pool} and person: {person}"})
-    pool_membership.available = available
-    pool_membership.save()
     logger.info(f"Set the availability of {person} in {pool} to {available}.")
     if available:
         message = messages.UPDATED_AVAILABLE
     else:
         message = messages.UPDATED_UNAVAILABLE
-    # perform tasks in sequence to avoid a race condition between the messages
-    # https://docs.celeryproject.org/en/4.4.2/userguide/canvas.html#chains
-    (send_msg.s(user_id, text=message) |
-     ask_if_met.s(user_id, pool.pk)).delay()
+    # the acknowledgement is handed off before asking if they met, so it's
+    # normally sent first. `ask_if_met` only queues a message, so it runs here
+    # rather than through the task queue
+    acknowledge_action(payload, message, workspace)
+    ask_if_met(user_id, pool.pk)
     return HttpResponse(204)
 
 
-def update_met(payload, action, match_id):
+def update_met(payload, action, match_id, workspace=None):
     """update a Match's `met` status with the provided yes/no answer
     """
     if action.get("value") == "yes":
@@ -301,9 +343,12 @@ def update_met(payload, action, match_id):
     try:
         match = user_matches.get(id=match_id)
     except Match.DoesNotExist:
-        return JsonResponse(status=404, 
-            data={"error": f"match for user \"{user_id}\" with ID "
-                f"\"{match_id}\" does not exist"})
+        # the match's round may have been archived since they were asked
+        match = get_archived_match(user_id, match_id)
+        if match is None:
+            return JsonResponse(status=404,
+                data={"error": f"match for user \"{user_id}\" with ID "
+                    f"\"{match_id}\" does not exist"})
     # variables used in message string
     person = get_person_from_match(user_id, match)
     other_person = get_other_person_from_match(user_id, match)
@@ -311,39 +356,71 @@ def update_met(payload, action, match_id):
         logger.warning(f"Conflicting \"met\" info for match \"{match}\". "
             f"Original value was {match.met}, new value from {person} is "
             f"{met}.")
-    match.met = met
-    match.save()
+    if isinstance(match, Match):
+        match.met = met
+        match.save()
+        # don't ask the other person now that we know
+        cancel_met_prompts(match)
+    else:
+        # the prompts for archived matches were all sent long ago
+        set_archived_met(match, met)
     logger.info(f"Updated match \"{match}\" \"met\" value to {match.met}.")
     if met:
         message = messages.MET.format(other_person=other_person)
     else:
         message = messages.DID_NOT_MEET
-    send_msg.delay(user_id, text=message)
+    acknowledge_action(payload, message, workspace)
     return HttpResponse(204)
 
 
-def handle_unknown_message(user_id, message):
+def acknowledge_action(payload, text, workspace=None):
+    """reply to someone clicking a button by replacing the message it was in
+    with `text`, using the interaction's `response_url`. this is quicker than
+    sending a new message through the outbox, isn't rate limited, and removes
+    the buttons so they can't be clicked again. the reply is sent by the
+    `respond_to_action` task once the change it's about is saved, so the
+    webhook doesn't wait on Slack, and it falls back to sending a new message
+    if the request fails. if there's no `response_url`, a new message is
+    queued right away
+    https://api.slack.com/interactivity/handling#message_responses
+    """
+    user_id = payload["user"]["id"]
+    response_url = payload.get("response_url")
+    if not response_url:
+        queue_message(user_id, "action_response", workspace=workspace,
+            text=text)
+        return
+    blocks = messages.format_action_response(payload.get("message", {}),
+        text)
+    transaction.on_commit(lambda: respond_to_action.delay(response_url,
+        user_id, text, blocks, workspace_id=getattr(workspace, "pk", None)))
+
+
+def handle_unknown_message(user_id, message, workspace=None):
     """If the bot receives a message it doesn't know how to deal with, send it
-    a direct message to the admin, if defined, otherwise respond with a
-    generic "Sorry I don't know how to help you" type of message
+    a direct message to the workspace's admin, if defined, otherwise respond
+    with a generic "Sorry I don't know how to help you" type of message
     """
     logger.info(f"Received unknown query from {user_id}: \"{message}\".")
-    if ADMIN_SLACK_USER_ID:
-        send_msg.delay(ADMIN_SLACK_USER_ID,
+    admin_user_id = get_admin_user_id(workspace)
+    if admin_user_id:
+        queue_message(admin_user_id, "unknown_message", workspace=workspace,
             text=messages.UNKNOWN_MESSAGE_ADMIN.format(user_id=user_id,
             message=blockquote(message)))
     else:
-        send_msg.delay(user_id, text=messages.UNKNOWN_MESSAGE_NO_ADMIN)
+        queue_message(user_id, "unknown_message", workspace=workspace,
+            text=messages.UNKNOWN_MESSAGE_NO_ADMIN)
     return HttpResponse(204)
 
 
-def send_message_as_bot(message):
+def send_message_as_bot(message, workspace=None):
     """Send a message to the first user @-mentioned in message as the bot
     """
     channel_id = get_mention(message)
     message = remove_mention(message)
     if message: # don't try to send an empty message
-        send_msg.delay(channel_id, text=message)
+        queue_message(channel_id, "admin_message", workspace=workspace,
+            text=message)
         logger.info(f"Sent message to {channel_id} as bot: \"{message}\".")
     return HttpResponse(204)
 
@@ -352,9 +429,13 @@ def get_channel_members(request, channel_id):
     """utility view function to return a list of members from the provided
     channel ID
     """
+    pool = Pool.objects.filter(channel_id=channel_id)\
+        .select_related("workspace").first()
+    workspace = pool.workspace if pool else None
     members = []
-    for member in get_channel_members_list(channel_id):
-        members.append(client.users_info(user=member).get("user"))
+    for member in get_channel_members_list(channel_id, workspace=workspace):
+        members.append(get_client(workspace).users_info(user=member)\
+            .get("user"))
     member_emails = "\n".join([
         user["profile"]["email"] for user in members
         if user["profile"].get("email") is not None